@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent import futures
+import grpc
+from common import metrics
+
+COMPRESSION = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def server_options(reuse_port=True):
+    """Channel arguments for a service's gRPC server, from the environment.
+
+    ``GRPC_MAX_CONCURRENT_STREAMS`` caps the streams a client may open on
+    one connection, ``GRPC_KEEPALIVE_TIME_MS`` / ``GRPC_KEEPALIVE_TIMEOUT_MS``
+    turn on server keepalive pings (and let clients ping as often as
+    ``GRPC_MIN_PING_INTERVAL_MS``), and ``GRPC_MAX_MESSAGE_MB`` raises the
+    4 MiB message size limit in both directions.
+    """
+    options = [("grpc.so_reuseport", 1 if reuse_port else 0)]
+    streams = os.getenv("GRPC_MAX_CONCURRENT_STREAMS")
+    if streams:
+        options.append(("grpc.max_concurrent_streams", int(streams)))
+    keepalive = os.getenv("GRPC_KEEPALIVE_TIME_MS")
+    if keepalive:
+        options += [
+            ("grpc.keepalive_time_ms", int(keepalive)),
+            ("grpc.keepalive_timeout_ms", int(os.getenv("GRPC_KEEPALIVE_TIMEOUT_MS", "20000"))),
+            ("grpc.keepalive_permit_without_calls", 1),
+        ]
+    min_ping = os.getenv("GRPC_MIN_PING_INTERVAL_MS")
+    if min_ping:
+        options += [
+            ("grpc.http2.min_ping_interval_without_data_ms", int(min_ping)),
+            ("grpc.http2.max_ping_strikes", 0),
+        ]
+    message_mb = os.getenv("GRPC_MAX_MESSAGE_MB")
+    if message_mb:
+        size = int(float(message_mb) * 2**20)
+        options += [
+            ("grpc.max_receive_message_length", size),
+            ("grpc.max_send_message_length", size),
+        ]
+    return options
+
+
+def create_server(reuse_port=True, stream_threads=0):
+    """A thread-pool gRPC server configured from the environment.
+
+    ``GRPC_THREADS`` sizes the pool (default 10), ``GRPC_MAX_CONCURRENT_RPCS``
+    rejects calls past that many with RESOURCE_EXHAUSTED instead of queueing
+    them, and ``GRPC_COMPRESSION`` (none, gzip or deflate) compresses responses.
+    Every call is timed into the ``grpc_server_handling_seconds`` histogram.
+
+    ``stream_threads`` more threads are added for long-lived streams the
+    service caps itself, so those streams never take the threads the other
+    calls are served on.
+    """
+    max_rpcs = os.getenv("GRPC_MAX_CONCURRENT_RPCS")
+    compression = os.getenv("GRPC_COMPRESSION", "none").lower()
+    if compression not in COMPRESSION:
+        raise ValueError(f"Unknown GRPC_COMPRESSION: {compression}")
+    return grpc.server(
+        futures.ThreadPoolExecutor(max_workers=int(os.getenv("GRPC_THREADS", "10")) + stream_threads),
+        options=server_options(reuse_port),
+        compression=COMPRESSION[compression],
+        interceptors=[metrics.ServerInterceptor()],
+        maximum_concurrent_rpcs=int(max_rpcs) if max_rpcs else None
+    )
+
+
+def run_worker(register, address, reuse_port=True, worker=0, stream_threads=0):
+    """Serve until SIGTERM or SIGINT, then drain.
+
+    On a signal the server stops accepting new calls at once but lets the
+    ones already running finish for up to ``GRPC_DRAIN_SECONDS`` (default
+    10), so a rolling restart does not cut off in-flight RPCs.
+
+    With ``METRICS_PORT`` set, the worker's ``/metrics`` are served on
+    ``METRICS_PORT + worker``; every worker process keeps its own.
+    """
+    metrics_port = os.getenv("METRICS_PORT")
+    if metrics_port:
+        metrics.serve_http(int(metrics_port) + worker)
+    server = create_server(reuse_port, stream_threads)
+    register(server)
+    server.add_insecure_port(address)
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+    server.start()
+    while not stopping.wait(1):
+        pass
+    server.stop(float(os.getenv("GRPC_DRAIN_SECONDS", "10"))).wait()
+
+
+def serve(name, register, port, processes=None, prepare=None, stream_threads=0):
+    """Run a gRPC service in one or more worker processes.
+
+    ``register(server)`` adds the servicers to a fresh server and is called
+    inside every worker, so each process builds its own servicer state.
+    ``prepare()``, if given, runs once beforehand in the parent (schema
+    creation, seeding) so workers do not race each other through it.
+
+    ``GRPC_PROCESSES`` workers (default 1; ``processes`` overrides it) all
+    bind ``port`` with SO_REUSEPORT and the kernel spreads connections over
+    them, which gets a Python service past one core.  With
+    ``GRPC_REUSEPORT=0`` worker ``i`` listens on ``port + i`` instead, for a
+    local load balancer in front.  SIGTERM and SIGINT are passed on to the
+    workers, which drain before exiting.  ``stream_threads`` is passed on
+    to ``create_server``.
+    """
+    if processes is None:
+        processes = int(os.getenv("GRPC_PROCESSES", "1"))
+    reuse_port = os.getenv("GRPC_REUSEPORT", "1") != "0"
+    if prepare is not None:
+        prepare()
+
+    if processes <= 1:
+        print(f"{name} starting on port {port}")
+        run_worker(register, f"[::]:{port}", reuse_port, stream_threads=stream_threads)
+        return
+
+    # Workers are forked before this process creates any gRPC object, which
+    # is what gRPC requires of a fork.
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for i in range(processes):
+        worker_port = port if reuse_port else port + i
+        worker = context.Process(
+            target=run_worker,
+            args=(register, f"[::]:{worker_port}", reuse_port, i, stream_threads),
+            name=f"{name} worker {i}"
+        )
+        worker.start()
+        workers.append(worker)
+    ports = str(port) if reuse_port else f"{port}-{port + processes - 1}"
+    print(f"{name} starting on port {ports} with {processes} processes")
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
+
+
+class _Entry:
+    __slots__ = ("value", "fetched_at", "refreshing")
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.refreshing = False
+
+
+class FragmentCache:
+    """Rendered fragments by key, served stale while they are refreshed.
+
+    ``get(key)`` returns the cached fragment while it is younger than
+    ``ttl``.  Up to ``stale_ttl`` it is still returned at once and a
+    refresh runs in the background, one per key at a time.  Past that, or
+    on a miss, the caller fetches, and concurrent callers for the same key
+    wait for that one fetch instead of all calling out.
+
+    ``fetch(key)`` is expected to enforce its own deadline.  When it fails
+    the last fragment that was fetched successfully is returned, however
+    old, and ``None`` only if there never was one; so a slow or failing
+    backend costs a page at most one deadline and usually nothing.
+    """
+
+    def __init__(self, fetch, ttl=30.0, stale_ttl=300.0, maxsize=10000,
+                 refresh_workers=4, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._refresher = futures.ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix="fragment-refresh"
+        )
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = self.clock() - entry.fetched_at
+                if age < self.ttl:
+                    self.hits += 1
+                    return entry.value
+                if age < self.stale_ttl:
+                    self.stale_hits += 1
+                    if not entry.refreshing:
+                        entry.refreshing = True
+                        self._refresher.submit(self._refresh, key, entry)
+                    return entry.value
+            self.misses += 1
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = futures.Future()
+
+        if leader:
+            try:
+                value = self.fetch(key)
+            except Exception:
+                value = None
+            with self._lock:
+                del self._inflight[key]
+                if value is not None:
+                    self._store(key, value)
+                else:
+                    self.failures += 1
+                    if entry is not None:
+                        value = entry.value
+                        self.fallbacks += 1
+            call.set_result(value)
+            return value
+        return call.result()
+
+    def _refresh(self, key, entry):
+        try:
+            value = self.fetch(key)
+        except Exception:
+            value = None
+        with self._lock:
+            entry.refreshing = False
+            if value is None:
+                self.failures += 1
+            else:
+                self._store(key, value)
+
+    def _store(self, key, value):
+        # Caller holds the lock.
+        self._entries[key] = _Entry(value, self.clock())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "fallbacks": self.fallbacks,
+                "failures": self.failures,
+            }
@@ -1,35 +1,76 @@
 import os
-from flask import Flask, render_template
+from flask import Flask, abort, jsonify, render_template, request
+from markupsafe import Markup
 import grpc
 from recommendations_pb2 import BookCategory, RecommendationRequest
 from recommendations_pb2_grpc import RecommendationsStub
+from fragment_cache import FragmentCache
+from common import metrics
 
 
 
 app = Flask(__name__)
+metrics.instrument_flask(app)
 
 
 
 
 recommendations_host = os.getenv("RECOMMENDATIONS_HOST", "localhost")
-recommendations_channel = grpc.insecure_channel(f"{recommendations_host}:50051")
+recommendations_channel = grpc.intercept_channel(
+    grpc.insecure_channel(f"{recommendations_host}:50051"), metrics.ClientInterceptor()
+)
 recommendations_client = RecommendationsStub(recommendations_channel)
+recommendations_deadline = float(os.getenv("RECOMMENDATIONS_DEADLINE_MS", "200")) / 1000
 
 
+def render_recommendations(key):
+    # Runs on request threads and on the cache's refresh threads alike.
+    user_id, category = key
+    recommendations_request = RecommendationRequest(user_id=user_id, category=category, max_results=5)
+    recommendations_response = recommendations_client.Recommend(
+        recommendations_request, timeout=recommendations_deadline
+    )
+    with app.app_context():
+        return Markup(render_template(
+            "recommendations.html",
+            recommendations=recommendations_response.recommendations,
+        ))
 
-@app.route("/")
-def render_homepage():
-    recommendations_request = RecommendationRequest(user_id=1, category=BookCategory.SCIENCE_FICTION, max_results=5)
-    recommendations_response = recommendations_client.Recommend(recommendations_request)
 
+fragments = FragmentCache(
+    render_recommendations,
+    ttl=float(os.getenv("FRAGMENT_TTL", "30")),
+    stale_ttl=float(os.getenv("FRAGMENT_STALE_TTL", "300")),
+    maxsize=int(os.getenv("FRAGMENT_CACHE_SIZE", "10000")),
+)
 
 
+
+@app.route("/")
+def render_homepage():
+    # A bad user_id is a bad request, not user 1's page.
+    user_id = request.args.get("user_id", "1")
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        abort(400)
+    if not 0 <= user_id < 2 ** 31:
+        abort(400)
+    category = request.args.get("category", "SCIENCE_FICTION")
+    if category not in BookCategory.keys():
+        abort(404)
+
     return render_template(
         "homepage.html",
-        recommendations=recommendations_response.recommendations,
+        recommendations=fragments.get((user_id, BookCategory.Value(category))),
     )
 
 
+@app.route("/stats/fragment-cache")
+def fragment_cache_stats():
+    return jsonify(fragments.stats())
+
+
 
 
 
@@ -0,0 +1,200 @@
+"""Array-backed book catalog with a popularity ranking per category.
+
+    python catalog.py build books.csv catalog.bin
+    python catalog.py bench --books 1000000
+
+``build`` turns a CSV of ``id,title,category,popularity`` rows (category
+by enum name, e.g. SCIENCE_FICTION) into one binary file:
+
+    header      magic, version, book count, category count
+    categories  (category, first rank, count) per category
+    ids         int32 per book
+    offsets     uint64 per book + 1, into the title blob
+    ranked      uint32 book positions, per category, most popular first
+    titles      UTF-8 titles back to back
+
+The service maps the file and reads every array through a memoryview, so
+the catalog is never copied into Python objects and worker processes share
+the same pages.  Arrays are written in the machine's byte order.
+"""
+import argparse
+import atexit
+import csv
+import mmap
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+MAGIC = b"RCAT"
+VERSION = 1
+HEADER = struct.Struct("=4sIII")
+CATEGORY = struct.Struct("=iII")
+
+
+def _pad(out, written):
+    padding = -written % 8
+    out.write(b"\0" * padding)
+    return written + padding
+
+
+def write_catalog(books, out):
+    """Write ``(id, title, category, popularity)`` tuples to the binary file ``out``."""
+    ids = array("i")
+    offsets = array("Q", [0])
+    popularity = []
+    by_category = {}
+    titles = bytearray()
+    for position, (book_id, title, category, score) in enumerate(books):
+        ids.append(book_id)
+        titles += title.encode()
+        offsets.append(len(titles))
+        popularity.append(score)
+        by_category.setdefault(category, []).append(position)
+
+    ranked = array("I")
+    categories = []
+    for category in sorted(by_category):
+        positions = by_category[category]
+        positions.sort(key=lambda p: (-popularity[p], ids[p]))
+        categories.append((category, len(ranked), len(positions)))
+        ranked.extend(positions)
+
+    written = out.write(HEADER.pack(MAGIC, VERSION, len(ids), len(categories)))
+    for entry in categories:
+        written += out.write(CATEGORY.pack(*entry))
+    for section in (ids, offsets, ranked):
+        written = _pad(out, written)
+        written += out.write(section.tobytes())
+    out.write(titles)
+
+
+class Catalog:
+    """Read-only view of a catalog file (or of its bytes).
+
+    ``top(category, k, exclude)`` walks the category's ranking from the top
+    and skips excluded ids, so it costs O(k + excluded ids met on the way)
+    however large the catalog is.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        view = memoryview(buffer)
+        magic, version, count, category_count = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a catalog file")
+
+        position = HEADER.size
+        self.categories = {}
+        for _ in range(category_count):
+            category, start, length = CATEGORY.unpack_from(view, position)
+            self.categories[category] = (start, length)
+            position += CATEGORY.size
+        ranked_count = sum(length for _, length in self.categories.values())
+
+        def section(fmt, length):
+            nonlocal position
+            position += -position % 8
+            start = position
+            position += length * array(fmt).itemsize
+            return view[start:position].cast(fmt)
+
+        self.ids = section("i", count)
+        self._offsets = section("Q", count + 1)
+        self._ranked = section("I", ranked_count)
+        self._titles = view[position:]
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def title(self, position):
+        return bytes(self._titles[self._offsets[position]:self._offsets[position + 1]]).decode()
+
+    def top(self, category, k, exclude=()):
+        """Up to ``k`` ``(id, title)`` of a category, most popular first."""
+        start, length = self.categories[category]
+        found = []
+        for rank in range(start, start + length):
+            if len(found) >= k:
+                break
+            position = self._ranked[rank]
+            book_id = self.ids[position]
+            if book_id not in exclude:
+                found.append((book_id, self.title(position)))
+        return found
+
+
+def read_csv(path):
+    from recommendations_pb2 import BookCategory
+
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield (
+                int(row["id"]), row["title"], BookCategory.Value(row["category"]),
+                float(row.get("popularity") or 0)
+            )
+
+
+def bench(args):
+    rng = random.Random(1)
+    books = (
+        (i, f"Book {i}", i % args.categories, rng.random())
+        for i in range(1, args.books + 1)
+    )
+    path = args.path
+    if path is None:
+        # Removed at exit, like the lab_3 benchmarks' scratch directories.
+        directory = tempfile.mkdtemp(prefix="bench-catalog-")
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "catalog.bin")
+    started = time.perf_counter()
+    with open(path, "wb") as out:
+        write_catalog(books, out)
+    print(f"built {args.books} books in {time.perf_counter() - started:.1f}s")
+
+    catalog = Catalog.open(path)
+    # The worst case: the user has seen exactly the top of every ranking.
+    seen = [
+        {book_id for book_id, _ in catalog.top(category, args.seen)}
+        for category in range(args.categories)
+    ]
+    started = time.perf_counter()
+    for i in range(args.queries):
+        catalog.top(i % args.categories, args.k, seen[i % args.categories])
+    elapsed = time.perf_counter() - started
+    print(f"top-{args.k} excluding {args.seen} seen: {elapsed / args.queries * 1e6:.1f}us per query")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("source")
+    build.add_argument("path")
+    measure = commands.add_parser("bench")
+    measure.add_argument("--books", type=int, default=1000000)
+    measure.add_argument("--categories", type=int, default=3)
+    measure.add_argument("--k", type=int, default=5)
+    measure.add_argument("--seen", type=int, default=20)
+    measure.add_argument("--queries", type=int, default=10000)
+    measure.add_argument("--path", help="keep the catalog here (default: a temporary file)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.path, "wb") as out:
+            write_catalog(read_csv(args.source), out)
+    else:
+        bench(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
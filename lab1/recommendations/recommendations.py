@@ -1,7 +1,11 @@
-from concurrent import futures
-import random
+import io
+import os
 import grpc
-from recommendations_pb2 import (BookCategory, BookRecommendation, RecommendationResponse)
+from catalog import Catalog, write_catalog
+from common.server import serve as run_service
+from recommendations_pb2 import (
+    BookCategory, BookRecommendation, RecommendationResponse, BatchRecommendationResponse
+)
 import recommendations_pb2_grpc
 
 
@@ -50,25 +54,57 @@ books_by_category = {
     ],
 }
 
+def load_catalog():
+    """The catalog file at CATALOG_PATH, or the built-in books above.
+
+    Built-in books are ranked in the order they are listed.
+    """
+    path = os.getenv("CATALOG_PATH")
+    if path:
+        return Catalog.open(path)
+    out = io.BytesIO()
+    write_catalog((
+        (book.id, book.title, category, -rank)
+        for category, books in books_by_category.items()
+        for rank, book in enumerate(books)
+    ), out)
+    return Catalog(out.getvalue())
+
 class RecommendationService(recommendations_pb2_grpc.RecommendationsServicer):
-    def Recommend(self, request, context):
-        if request.category not in books_by_category:
-            context.abort(grpc.StatusCode.NOT_FOUND, "Category not found")
+    def __init__(self, catalog=None):
+        self.catalog = catalog or load_catalog()
 
-        books_for_category = books_by_category[request.category]
-        num_results = min(request.max_results, len(books_for_category))
-        books_to_recommend = random.sample(books_for_category, num_results)
+    def _recommend(self, request, exclude, context):
+        if request.category not in self.catalog.categories:
+            context.abort(grpc.StatusCode.NOT_FOUND, "Category not found")
 
-        return RecommendationResponse(recommendations=books_to_recommend)
+        books = self.catalog.top(request.category, max(request.max_results, 0), exclude)
+        return RecommendationResponse(recommendations=[
+            BookRecommendation(id=book_id, title=title) for book_id, title in books
+        ])
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    def Recommend(self, request, context):
+        return self._recommend(request, set(request.exclude_ids), context)
+
+    def RecommendBatch(self, request, context):
+        # Several categories at once, e.g. for one page: a book already
+        # recommended to a user earlier in the batch is not repeated.
+        shown = {}
+        responses = []
+        for item in request.requests:
+            seen = shown.setdefault(item.user_id, set())
+            response = self._recommend(item, seen.union(item.exclude_ids), context)
+            seen.update(book.id for book in response.recommendations)
+            responses.append(response)
+        return BatchRecommendationResponse(responses=responses)
+
+def register(server):
     recommendations_pb2_grpc.add_RecommendationsServicer_to_server(
         RecommendationService(), server
     )
-    server.add_insecure_port("[::]:50051")
-    server.start()
-    server.wait_for_termination()
+
+def serve():
+    run_service("Recommendations", register, 50051)
 
 
 
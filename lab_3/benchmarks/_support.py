@@ -0,0 +1,60 @@
+import atexit
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+LAB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROTO_DIR = os.path.join(LAB_DIR, "protobufs")
+
+
+def compile_protos(out_dir):
+    from grpc_tools import protoc
+
+    protos = sorted(
+        os.path.join(PROTO_DIR, name)
+        for name in os.listdir(PROTO_DIR) if name.endswith(".proto")
+    )
+    status = protoc.main([
+        "grpc_tools.protoc", f"-I{PROTO_DIR}",
+        f"--python_out={out_dir}", f"--grpc_python_out={out_dir}", *protos
+    ])
+    if status != 0:
+        raise RuntimeError("protoc failed")
+
+
+def scratch_dir(prefix):
+    """A temporary directory that is removed when the benchmark exits."""
+    path = tempfile.mkdtemp(prefix=prefix)
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def use_service(name):
+    """Make a service importable in-process, the way its Dockerfile lays it out.
+
+    Generates the protobuf modules, puts them and the service directory on
+    ``sys.path`` and switches to a scratch directory so the service's SQLite
+    files are temporary; both directories are removed at exit.
+    """
+    generated = scratch_dir("protos-")
+    compile_protos(generated)
+    sys.path[:0] = [generated, os.path.join(LAB_DIR, name), LAB_DIR]
+    workdir = scratch_dir(f"{name}-")
+    os.chdir(workdir)
+    return workdir
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,154 @@
+"""Thousands of concurrent bookings through the asyncio (ASGI) booking app.
+
+    python benchmarks/async_bookings.py --concurrency 5000 --delay-ms 200
+
+Calls ``asgi.app`` directly with ASGI messages (no HTTP server needed)
+against ``grpc.aio`` user and event services, in a second process, that
+take ``--delay-ms`` to answer, so every booking is in flight at the same time.
+Reports throughput, latency and the peak Python memory per in-flight
+booking, then checks every booking was created and can be read back.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+from _support import use_service, percentile
+
+
+async def call(app, method, path, body=None, query=b""):
+    payload = json.dumps(body).encode() if body is not None else b""
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({
+        "type": "http", "method": method, "path": path, "query_string": query, "headers": []
+    }, receive, send)
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return sent[0]["status"], body
+
+
+def serve_backends(delay, ports):
+    import grpc
+    import event_pb2
+    import event_pb2_grpc
+    import user_pb2
+    import user_pb2_grpc
+
+    class Users(user_pb2_grpc.UserServiceServicer):
+        async def BatchGetUsers(self, request, context):
+            await asyncio.sleep(delay)
+            return user_pb2.BatchGetUsersResponse(users=[
+                user_pb2.UserResponse(user_id=user_id, name="Bench", email="bench@example.com")
+                for user_id in request.user_ids
+            ])
+
+    class Events(event_pb2_grpc.EventServiceServicer):
+        def __init__(self):
+            self.held = set()
+
+        async def HoldSeats(self, request, context):
+            await asyncio.sleep(delay)
+            self.held.add(request.hold_id)
+            return event_pb2.HoldSeatsResponse(success=True, hold_id=request.hold_id, seat_numbers=[1])
+
+        async def ConfirmHold(self, request, context):
+            await asyncio.sleep(delay)
+            if request.hold_id not in self.held:
+                return event_pb2.ConfirmHoldResponse(success=False, message="Unknown hold")
+            self.held.discard(request.hold_id)
+            return event_pb2.ConfirmHoldResponse(success=True)
+
+    async def serve():
+        server = grpc.aio.server()
+        user_pb2_grpc.add_UserServiceServicer_to_server(Users(), server)
+        event_pb2_grpc.add_EventServiceServicer_to_server(Events(), server)
+        ports.put(server.add_insecure_port("127.0.0.1:0"))
+        await server.start()
+        await server.wait_for_termination()
+
+    asyncio.run(serve())
+
+
+async def run(args, port):
+    os.environ.update({
+        "USER_SERVICE_HOST": "127.0.0.1", "USER_SERVICE_PORT": str(port),
+        "EVENT_SERVICE_HOST": "127.0.0.1", "EVENT_SERVICE_PORT": str(port),
+    })
+
+    import asgi
+
+    async def book(i):
+        started = time.perf_counter()
+        status, body = await call(asgi.app, "POST", "/api/bookings", {
+            "user_id": i % args.users + 1, "event_id": 101, "number_of_tickets": 1
+        })
+        return status, json.loads(body), (time.perf_counter() - started) * 1000
+
+    await book(0)
+    if args.memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(book(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    memory = ""
+    if args.memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        memory = f" peak_mem={peak / 2**20:.1f}MiB ({peak / args.concurrency / 1024:.1f}KiB/booking)"
+
+    samples = [latency for _, _, latency in results]
+    failures = [(status, body) for status, body, _ in results if status != 201]
+    print(f"bookings={args.concurrency} elapsed={elapsed:.2f}s rate={args.concurrency / elapsed:.0f}/s "
+          f"p50={percentile(samples, 0.5):.0f}ms p99={percentile(samples, 0.99):.0f}ms{memory}")
+
+    booking_id = results[-1][1].get("booking_id")
+    status, body = await call(asgi.app, "GET", f"/api/bookings/{booking_id}")
+    if status != 200:
+        failures.append((status, body))
+    status, body = await call(asgi.app, "GET", "/api/bookings", query=b"event_id=101&limit=1000")
+    listed = len(json.loads(body)["bookings"])
+    print(f"listed={listed}")
+
+    await asgi.close_clients()
+    for status, body in failures[:5]:
+        print(f"FAILED: {status} {body}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--delay-ms", type=float, default=200)
+    parser.add_argument("--memory", action="store_true")
+    args = parser.parse_args()
+
+    use_service("booking_service")
+    # The backends run in their own process so the app's event loop is the
+    # only thing measured; deadlines are long because a single loop working
+    # through thousands of bookings is throughput-bound, not stuck.
+    ports = multiprocessing.Queue()
+    backends = multiprocessing.Process(target=serve_backends, args=(args.delay_ms / 1000, ports), daemon=True)
+    backends.start()
+    os.environ.setdefault("MAX_IN_FLIGHT", str(args.concurrency + 1))
+    os.environ.setdefault("USER_SERVICE_TIMEOUT", "60")
+    os.environ.setdefault("EVENT_SERVICE_TIMEOUT", "60")
+    try:
+        return asyncio.run(run(args, ports.get(timeout=30)))
+    finally:
+        backends.terminate()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
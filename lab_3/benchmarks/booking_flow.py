@@ -0,0 +1,475 @@
+"""End-to-end load scenarios for the booking flow, with a regression check.
+
+    python benchmarks/booking_flow.py --output baseline.json
+    python benchmarks/booking_flow.py --baseline baseline.json --tolerance 0.25
+    python benchmarks/booking_flow.py --baseline benchmarks/booking_flow_baseline.json
+
+Starts user_service, event_service and booking_service as subprocesses on
+free loopback ports, each in a scratch directory so every database is
+temporary, and runs the scenarios in turn with ``--clients`` threads:
+
+    steady          bookings, reads and cancellations spread over many events
+    flash_sale      every client books the same event until it is sold out
+    cancellations   a sold-out event has every booking cancelled, twice each
+    polling         availability polling with an occasional booking
+
+Each scenario reports throughput, p50/p95/p99 latency in milliseconds
+(overall and per operation) and the consistency violations found once it
+is over: tickets sold past an event's capacity, available seats that do
+not match the confirmed bookings, bookings the harness was told were
+created or cancelled that the service disagrees with, and cancellations
+that succeeded twice.  Results are printed as JSON and written to
+``--output``.  With ``--baseline`` every scenario is compared with a stored
+run: throughput down, or p95/p99 up, by more than ``--tolerance``, more
+errors (5xx or failed requests), or any violation is a regression and the
+exit status is 1.
+
+booking_flow_baseline.json, next to this script, is a run with the default
+options on the tree before the seat release outbox (commit b28f3c8), on one
+CPU.  Throughput and latency depend on the machine and on whatever else it
+is running, so for a real comparison record a baseline from that tree on
+your own machine, and compare runs made close together.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from _support import LAB_DIR, compile_protos, free_port, percentile, scratch_dir
+
+
+class Services:
+    """The three services as local processes, torn down by ``stop``."""
+
+    def __init__(self, generated):
+        self.generated = generated
+        self.user_port = free_port()
+        self.event_port = free_port()
+        self.http_port = free_port()
+        self.processes = []
+        self.logs = []
+
+    def start(self, service, script, **env):
+        workdir = scratch_dir(f"{service}-")
+        log = open(os.path.join(workdir, "service.log"), "wb")
+        self.logs.append(log)
+        self.processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(LAB_DIR, service, script)],
+            cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join([self.generated, LAB_DIR]), **env)
+        ))
+
+    def start_all(self):
+        self.start("user_service", "user.py", PORT=str(self.user_port))
+        self.start("event_service", "event.py", PORT=str(self.event_port))
+        self.start(
+            "booking_service", "booking.py",
+            PORT=str(self.http_port), GRPC_PORT=str(free_port()),
+            USER_SERVICE_HOST="127.0.0.1", USER_SERVICE_PORT=str(self.user_port),
+            EVENT_SERVICE_HOST="127.0.0.1", EVENT_SERVICE_PORT=str(self.event_port),
+        )
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for log in self.logs:
+            log.close()
+
+
+class Context:
+    def __init__(self, args, services, events):
+        self.args = args
+        self.services = services
+        self.events = events
+        self._next_event_id = 10000
+        self._lock = threading.Lock()
+
+    def http(self, method, path, body=None):
+        # A connection per request, as browsers get from Flask's server.
+        connection = http.client.HTTPConnection("127.0.0.1", self.services.http_port, timeout=60)
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(
+                method, path, body=json.dumps(body) if body is not None else None, headers=headers
+            )
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.getheader("Content-Type", "").startswith("application/json"):
+            return response.status, json.loads(data)
+        return response.status, data
+
+    def create_event(self, seats):
+        from event_pb2 import CreateEventRequest
+
+        with self._lock:
+            event_id = self._next_event_id
+            self._next_event_id += 1
+        response = self.events.CreateEvent(CreateEventRequest(
+            event_id=event_id, name=f"Load test {event_id}", date="2030-01-01T19:00:00Z",
+            venue="Loopback Arena", ticket_price=10.0, total_seats=seats
+        ), timeout=60)
+        if not response.success:
+            raise RuntimeError(f"Could not create event {event_id}: {response.message}")
+        return event_id
+
+    def available(self, event_id):
+        from event_pb2 import CheckAvailabilityRequest
+
+        return self.events.CheckAvailability(
+            CheckAvailabilityRequest(event_id=event_id), timeout=60
+        ).available_seats
+
+    def confirmed(self, event_id):
+        status, data = self.http("GET", f"/api/bookings?event_id={event_id}&status=confirmed&format=ndjson")
+        if status != 200:
+            raise RuntimeError(f"Listing bookings of event {event_id} failed with {status}")
+        return {
+            booking["booking_id"]: booking["number_of_tickets"]
+            for booking in map(json.loads, data.decode().splitlines())
+        }
+
+
+class Recorder:
+    """Latency samples and response statuses per operation, shared by the clients."""
+
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+        self.errors = 0
+        self.created = {}
+        self.cancelled = {}
+        self._lock = threading.Lock()
+
+    def call(self, operation, fn, *args):
+        started = time.perf_counter()
+        try:
+            status, body = fn(*args)
+        except Exception:
+            status, body = "exception", None
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.samples.setdefault(operation, []).append(elapsed)
+            statuses = self.statuses.setdefault(operation, {})
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == "exception" or status >= 500:
+                self.errors += 1
+        return status, body
+
+    def book(self, ctx, user_id, event_id, tickets):
+        status, body = self.call(
+            "book", ctx.http, "POST", "/api/bookings",
+            {"user_id": user_id, "event_id": event_id, "number_of_tickets": tickets}
+        )
+        if status == 201:
+            with self._lock:
+                self.created[body["booking_id"]] = (event_id, tickets)
+            return body["booking_id"]
+        return None
+
+    def cancel(self, ctx, booking_id):
+        status, _ = self.call("cancel", ctx.http, "DELETE", f"/api/bookings/{booking_id}")
+        if status == 200:
+            with self._lock:
+                self.cancelled[booking_id] = self.cancelled.get(booking_id, 0) + 1
+        return status
+
+    def summary(self, seconds):
+        everything = [sample for samples in self.samples.values() for sample in samples]
+
+        def latencies(samples):
+            return {
+                "p50": round(percentile(samples, 0.50), 3),
+                "p95": round(percentile(samples, 0.95), 3),
+                "p99": round(percentile(samples, 0.99), 3),
+            }
+
+        return {
+            "requests": len(everything),
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "throughput": round(len(everything) / seconds, 1) if seconds else 0.0,
+            "latency_ms": latencies(everything),
+            "operations": {
+                operation: {"count": len(samples), **latencies(samples), "statuses": self.statuses[operation]}
+                for operation, samples in sorted(self.samples.items())
+            },
+        }
+
+
+def run_clients(count, client):
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def check(ctx, recorder, totals):
+    """Consistency of the events in ``totals`` (event_id -> seats) once the load is over."""
+    violations = []
+    for booking_id, count in recorder.cancelled.items():
+        if count > 1:
+            violations.append({"type": "double_cancel", "booking_id": booking_id, "times": count})
+
+    deadline = time.monotonic() + ctx.args.settle
+    for event_id, total in sorted(totals.items()):
+        # Seats released in the background (expired holds, queued releases)
+        # get until the deadline to show up before a mismatch counts.
+        while True:
+            confirmed = ctx.confirmed(event_id)
+            sold = sum(confirmed.values())
+            available = ctx.available(event_id)
+            if available == total - sold or time.monotonic() >= deadline:
+                break
+            time.sleep(0.2)
+        if sold > total:
+            violations.append({"type": "oversold", "event_id": event_id, "seats": total, "sold": sold})
+        if available != total - sold:
+            violations.append({
+                "type": "availability_mismatch", "event_id": event_id,
+                "available": available, "expected": total - sold,
+            })
+
+        expected = {
+            booking_id for booking_id, (booked_event, _) in recorder.created.items()
+            if booked_event == event_id and booking_id not in recorder.cancelled
+        }
+        for booking_id in sorted(expected - set(confirmed)):
+            violations.append({"type": "lost_booking", "event_id": event_id, "booking_id": booking_id})
+        for booking_id in sorted(set(confirmed) - expected):
+            # Confirmed, but the client was told otherwise (an error, or a
+            # cancellation that reported success).
+            violations.append({"type": "unacknowledged_booking", "event_id": event_id, "booking_id": booking_id})
+    return violations
+
+
+def steady(ctx):
+    """60% bookings, 25% reads of an own booking, 15% cancellations."""
+    args = ctx.args
+    seats = args.seats
+    event_ids = [ctx.create_event(seats) for _ in range(args.events)]
+    recorder = Recorder()
+    stop = time.perf_counter() + args.seconds
+
+    def client(i):
+        rng = random.Random(args.seed + i)
+        mine = []
+        while time.perf_counter() < stop:
+            roll = rng.random()
+            if roll < 0.60 or not mine:
+                booking_id = recorder.book(ctx, rng.randint(1, 3), rng.choice(event_ids), rng.randint(1, 4))
+                if booking_id is not None:
+                    mine.append(booking_id)
+            elif roll < 0.85:
+                recorder.call("get", ctx.http, "GET", f"/api/bookings/{rng.choice(mine)}")
+            else:
+                recorder.cancel(ctx, mine.pop(rng.randrange(len(mine))))
+
+    elapsed = run_clients(args.clients, client)
+    return recorder, elapsed, {event_id: seats for event_id in event_ids}
+
+
+def flash_sale(ctx):
+    """Every client books 1-2 tickets of one event until it is sold out."""
+    args = ctx.args
+    event_id = ctx.create_event(args.flash_seats)
+    recorder = Recorder()
+    sold_out = threading.Event()
+    # A bound in case the event never reports sold out.
+    stop = time.perf_counter() + args.seconds * 5
+
+    def client(i):
+        rng = random.Random(args.seed + i)
+        while not sold_out.is_set() and time.perf_counter() < stop:
+            if recorder.book(ctx, rng.randint(1, 3), event_id, rng.randint(1, 2)) is None:
+                status, body = recorder.call(
+                    "availability", lambda: (200, ctx.available(event_id))
+                )
+                if status == 200 and body == 0:
+                    sold_out.set()
+
+    elapsed = run_clients(args.clients, client)
+    return recorder, elapsed, {event_id: args.flash_seats}
+
+
+def cancellations(ctx):
+    """Book out an event, then cancel every booking twice at the same time."""
+    args = ctx.args
+    event_id = ctx.create_event(args.storm_bookings)
+    setup = Recorder()
+    queue = list(range(args.storm_bookings))
+    lock = threading.Lock()
+
+    def book(i):
+        while True:
+            with lock:
+                if not queue:
+                    return
+                queue.pop()
+            setup.book(ctx, 1 + i % 3, event_id, 1)
+
+    run_clients(args.clients, book)
+    recorder = Recorder()
+    recorder.created = setup.created
+    work = [booking_id for booking_id in setup.created for _ in range(2)]
+    random.Random(args.seed).shuffle(work)
+
+    def client(i):
+        while True:
+            with lock:
+                if not work:
+                    return
+                booking_id = work.pop()
+            recorder.cancel(ctx, booking_id)
+
+    elapsed = run_clients(args.clients, client)
+    return recorder, elapsed, {event_id: args.storm_bookings}
+
+
+def polling(ctx):
+    """95% CheckAvailability straight from the event service, 5% bookings."""
+    args = ctx.args
+    seats = args.seats
+    event_ids = [ctx.create_event(seats) for _ in range(max(1, args.events // 4))]
+    recorder = Recorder()
+    stop = time.perf_counter() + args.seconds
+
+    def client(i):
+        rng = random.Random(args.seed + i)
+        while time.perf_counter() < stop:
+            event_id = rng.choice(event_ids)
+            if rng.random() < 0.95:
+                recorder.call("availability", lambda: (200, ctx.available(event_id)))
+            else:
+                recorder.book(ctx, rng.randint(1, 3), event_id, 1)
+
+    elapsed = run_clients(args.clients, client)
+    return recorder, elapsed, {event_id: seats for event_id in event_ids}
+
+
+SCENARIOS = {
+    "steady": steady,
+    "flash_sale": flash_sale,
+    "cancellations": cancellations,
+    "polling": polling,
+}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        for violation in result["violations"]:
+            regressions.append(f"{name}: {violation['type']} {json.dumps(violation)}")
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            continue
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {result['throughput']} req/s, baseline {before['throughput']}"
+            )
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors, baseline {before['errors']}")
+        for key in ("p95", "p99"):
+            now, then = result["latency_ms"][key], before["latency_ms"][key]
+            if now > then * (1 + tolerance):
+                regressions.append(f"{name}: {key} {now}ms, baseline {then}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--seats", type=int, default=2000,
+                        help="seats per event in the steady and polling scenarios")
+    parser.add_argument("--flash-seats", type=int, default=500)
+    parser.add_argument("--storm-bookings", type=int, default=300)
+    parser.add_argument("--settle", type=float, default=10,
+                        help="seconds background releases get before a seat mismatch counts")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    generated = scratch_dir("protos-")
+    compile_protos(generated)
+    sys.path.insert(0, generated)
+    import grpc
+    from event_pb2_grpc import EventServiceStub
+
+    services = Services(generated)
+    channel = None
+    try:
+        services.start_all()
+        channel = grpc.insecure_channel(f"127.0.0.1:{services.event_port}")
+        grpc.channel_ready_future(channel).result(timeout=60)
+        user_channel = grpc.insecure_channel(f"127.0.0.1:{services.user_port}")
+        grpc.channel_ready_future(user_channel).result(timeout=60)
+        user_channel.close()
+        ctx = Context(args, services, EventServiceStub(channel))
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if ctx.http("GET", "/api/stats/user-cache")[0] == 200:
+                    break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(0.2)
+
+        results = {}
+        for name in args.scenarios:
+            recorder, elapsed, totals = SCENARIOS[name](ctx)
+            results[name] = {**recorder.summary(elapsed), "violations": check(ctx, recorder, totals)}
+            print(f"{name:14s} {results[name]['throughput']:8.1f} req/s "
+                  f"p50={results[name]['latency_ms']['p50']:.2f}ms "
+                  f"p95={results[name]['latency_ms']['p95']:.2f}ms "
+                  f"p99={results[name]['latency_ms']['p99']:.2f}ms "
+                  f"errors={results[name]['errors']} violations={len(results[name]['violations'])}",
+                  file=sys.stderr)
+    finally:
+        if channel is not None:
+            channel.close()
+        services.stop()
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "scenarios": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(results, json.load(f), args.tolerance)
+        for regression in report["regressions"]:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if report.get("regressions") or any(result["violations"] for result in results.values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
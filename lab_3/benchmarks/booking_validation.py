@@ -0,0 +1,107 @@
+"""Compare sequential and parallel user/event validation in create_booking.
+
+    python benchmarks/booking_validation.py --latency-ms 20
+
+Runs stand-in user and event services that answer after a fixed delay,
+then times the old one-after-the-other GetUser + CheckAvailability calls
+against the concurrent fan-out used by ``POST /api/bookings``.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent import futures
+
+from _support import use_service, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    use_service("booking_service")
+
+    import grpc
+    import event_pb2
+    import event_pb2_grpc
+    import user_pb2
+    import user_pb2_grpc
+
+    delay = args.latency_ms / 1000
+
+    class SlowUsers(user_pb2_grpc.UserServiceServicer):
+        def GetUser(self, request, context):
+            time.sleep(delay)
+            return user_pb2.UserResponse(user_id=request.user_id, name="Bench", email="bench@example.com")
+
+        def BatchGetUsers(self, request, context):
+            time.sleep(delay)
+            return user_pb2.BatchGetUsersResponse(users=[
+                user_pb2.UserResponse(user_id=user_id, name="Bench", email="bench@example.com")
+                for user_id in request.user_ids
+            ])
+
+    class SlowEvents(event_pb2_grpc.EventServiceServicer):
+        def CheckAvailability(self, request, context):
+            time.sleep(delay)
+            return event_pb2.CheckAvailabilityResponse(available=True, available_seats=1000)
+
+        def HoldSeats(self, request, context):
+            time.sleep(delay)
+            return event_pb2.HoldSeatsResponse(success=True, hold_id=request.hold_id, seat_numbers=[1])
+
+        def ConfirmHold(self, request, context):
+            return event_pb2.ConfirmHoldResponse(success=True)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    user_pb2_grpc.add_UserServiceServicer_to_server(SlowUsers(), server)
+    event_pb2_grpc.add_EventServiceServicer_to_server(SlowEvents(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    os.environ.update({
+        "USER_SERVICE_HOST": "127.0.0.1", "USER_SERVICE_PORT": str(port),
+        "EVENT_SERVICE_HOST": "127.0.0.1", "EVENT_SERVICE_PORT": str(port),
+    })
+
+    import booking
+
+    user_client = user_pb2_grpc.UserServiceStub(grpc.insecure_channel(f"127.0.0.1:{port}"))
+    event_client = event_pb2_grpc.EventServiceStub(grpc.insecure_channel(f"127.0.0.1:{port}"))
+    user_request = user_pb2.UserRequest(user_id=1)
+    availability_request = event_pb2.CheckAvailabilityRequest(event_id=101, number_of_tickets=1)
+
+    def sequential():
+        user_client.GetUser(user_request)
+        event_client.CheckAvailability(availability_request)
+
+    def parallel():
+        calls = [
+            user_client.GetUser.future(user_request),
+            event_client.CheckAvailability.future(availability_request),
+        ]
+        for call in calls:
+            call.result()
+
+    client = booking.app.test_client()
+
+    def create():
+        response = client.post("/api/bookings", json={"user_id": 1, "event_id": 101, "number_of_tickets": 1})
+        assert response.status_code == 201, response.get_json()
+
+    for name, fn in (("validate_sequential", sequential), ("validate_parallel", parallel),
+                     ("create_booking", create)):
+        fn()
+        samples = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{name:20s} p50={percentile(samples, 0.5):7.2f}ms p99={percentile(samples, 0.99):7.2f}ms")
+
+    server.stop(None)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Compare the HTTP/JSON and gRPC front doors of the booking service.
+
+    python benchmarks/front_doors.py --requests 2000 --clients 16
+
+Runs the booking service with both servers in one process, against
+in-process user and event services that answer immediately, and drives
+GetBooking and CreateBooking through each front door with the same number
+of concurrent clients.  HTTP clients open a connection per request, as
+they do against Flask's server; gRPC clients share one HTTP/2 channel.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent import futures
+
+from _support import use_service, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    args = parser.parse_args()
+
+    use_service("booking_service")
+
+    import grpc
+    import booking_pb2
+    import booking_pb2_grpc
+    import event_pb2
+    import event_pb2_grpc
+    import user_pb2
+    import user_pb2_grpc
+    from werkzeug.serving import make_server
+
+    class Users(user_pb2_grpc.UserServiceServicer):
+        def BatchGetUsers(self, request, context):
+            return user_pb2.BatchGetUsersResponse(users=[
+                user_pb2.UserResponse(user_id=user_id, name="Bench", email="bench@example.com")
+                for user_id in request.user_ids
+            ])
+
+    class Events(event_pb2_grpc.EventServiceServicer):
+        def HoldSeats(self, request, context):
+            return event_pb2.HoldSeatsResponse(success=True, hold_id=request.hold_id, seat_numbers=[1])
+
+        def ConfirmHold(self, request, context):
+            return event_pb2.ConfirmHoldResponse(success=True)
+
+    backends = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    user_pb2_grpc.add_UserServiceServicer_to_server(Users(), backends)
+    event_pb2_grpc.add_EventServiceServicer_to_server(Events(), backends)
+    backend_port = backends.add_insecure_port("127.0.0.1:0")
+    backends.start()
+    os.environ.update({
+        "USER_SERVICE_HOST": "127.0.0.1", "USER_SERVICE_PORT": str(backend_port),
+        "EVENT_SERVICE_HOST": "127.0.0.1", "EVENT_SERVICE_PORT": str(backend_port),
+        "GRPC_WORKERS": str(args.clients),
+    })
+
+    import booking
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    http_server = make_server("127.0.0.1", 0, booking.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    http_port = http_server.server_port
+    grpc_server, grpc_port = booking.serve_grpc("127.0.0.1:0")
+    channel = grpc.insecure_channel(f"127.0.0.1:{grpc_port}")
+    stub = booking_pb2_grpc.BookingServiceStub(channel)
+
+    def http_call(method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", http_port)
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                               headers=headers)
+            response = connection.getresponse()
+            response.read()
+            assert response.status < 300, response.status
+        finally:
+            connection.close()
+
+    booking_body = {"user_id": 1, "event_id": 101, "number_of_tickets": 1}
+    http_call("POST", "/api/bookings", booking_body)
+    scenarios = [
+        ("http  GetBooking", lambda: http_call("GET", "/api/bookings/1")),
+        ("grpc  GetBooking", lambda: stub.GetBooking(booking_pb2.GetBookingRequest(booking_id=1))),
+        ("http  CreateBooking", lambda: http_call("POST", "/api/bookings", booking_body)),
+        ("grpc  CreateBooking", lambda: stub.CreateBooking(booking_pb2.CreateBookingRequest(**booking_body))),
+    ]
+
+    for name, call in scenarios:
+        call()
+
+        def timed(_):
+            started = time.perf_counter()
+            call()
+            return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with futures.ThreadPoolExecutor(max_workers=args.clients) as pool:
+            samples = list(pool.map(timed, range(args.requests)))
+        elapsed = time.perf_counter() - started
+        print(f"{name:20s} {args.requests / elapsed:7.0f} req/s "
+              f"p50={percentile(samples, 0.5):6.2f}ms p99={percentile(samples, 0.99):6.2f}ms")
+
+    channel.close()
+    grpc_server.stop(None)
+    http_server.shutdown()
+    backends.stop(None)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Provision a large event through CreateEvent and ProvisionSeatMap.
+
+    python benchmarks/provision_event.py --backend sql --seats 100000
+
+Creates one event with ``CreateEvent`` (uniform rows) and one with a
+streamed seat map split into sections, then reports the time taken and the
+availability the service reports afterwards.  ``--memory`` also reports the
+peak Python memory of each call (tracemalloc slows the run down a lot), and
+``--orm-baseline`` times the old one ``session.add(Seat(...))`` per seat
+path for comparison.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from concurrent import futures
+
+from _support import use_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default=os.getenv("INVENTORY_BACKEND", "sql"))
+    parser.add_argument("--seats", type=int, default=100000)
+    parser.add_argument("--row-length", type=int, default=50)
+    parser.add_argument("--rows-per-section", type=int, default=100)
+    parser.add_argument("--rows-per-message", type=int, default=100)
+    parser.add_argument("--memory", action="store_true")
+    parser.add_argument("--orm-baseline", action="store_true")
+    args = parser.parse_args()
+
+    use_service("event_service")
+    os.environ["INVENTORY_BACKEND"] = args.backend
+
+    import grpc
+    from event_pb2 import (
+        CheckAvailabilityRequest, CreateEventRequest, ReserveSeatsRequest,
+        SeatMapChunk, SeatRowSpec
+    )
+    from event_pb2_grpc import EventServiceStub, add_EventServiceServicer_to_server
+    from event import EventService
+    from models import get_session, Event, Seat
+
+    service = EventService()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    add_EventServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    client = EventServiceStub(channel)
+
+    def event_request(event_id, **kwargs):
+        return CreateEventRequest(
+            event_id=event_id, name=f"Provisioning {event_id}", date="2024-01-01T00:00:00Z",
+            venue="Stadium", ticket_price=1.0, **kwargs
+        )
+
+    def seat_map(event_id):
+        rows, last_row = divmod(args.seats, args.row_length)
+        specs = [args.row_length] * rows + ([last_row] if last_row else [])
+        yield SeatMapChunk(event=event_request(event_id))
+        for start in range(0, len(specs), args.rows_per_message):
+            yield SeatMapChunk(rows=[
+                SeatRowSpec(section=f"Sector {(start + i) // args.rows_per_section + 1}", seats=seats)
+                for i, seats in enumerate(specs[start:start + args.rows_per_message])
+            ])
+
+    def measure(name, event_id, fn):
+        if args.memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        memory = ""
+        if args.memory:
+            memory = f" peak_mem={tracemalloc.get_traced_memory()[1] / 2**20:.1f}MiB"
+            tracemalloc.stop()
+        available = client.CheckAvailability(
+            CheckAvailabilityRequest(event_id=event_id, number_of_tickets=1)
+        ).available_seats
+        print(f"{name:18s} seats={available} elapsed={elapsed:.2f}s "
+              f"seats_per_sec={args.seats / elapsed:.0f}{memory}")
+        return available
+
+    failures = []
+    if measure("CreateEvent", 1001, lambda: client.CreateEvent(
+        event_request(1001, total_seats=args.seats, row_length=args.row_length)
+    )) != args.seats:
+        failures.append("CreateEvent")
+    if measure("ProvisionSeatMap", 1002, lambda: client.ProvisionSeatMap(seat_map(1002))) != args.seats:
+        failures.append("ProvisionSeatMap")
+
+    last_row = (args.seats + args.row_length - 1) // args.row_length
+    block = client.ReserveSeats(ReserveSeatsRequest(
+        event_id=1002, number_of_tickets=4, booking_id="provision-check", contiguous=True, row=last_row
+    ))
+    print(f"contiguous block in row {last_row}: {list(block.seat_numbers)}")
+
+    if args.orm_baseline and args.backend == "sql":
+        def orm_add():
+            session = get_session(service.engine)
+            try:
+                session.add(Event(
+                    event_id=1003, name="Provisioning 1003", date="2024-01-01T00:00:00Z",
+                    venue="Stadium", ticket_price=1.0, total_seats=args.seats
+                ))
+                for i in range(1, args.seats + 1):
+                    session.add(Seat(event_id=1003, seat_number=i, is_reserved=False))
+                session.commit()
+            finally:
+                session.close()
+        measure("orm session.add", 1003, orm_add)
+
+    channel.close()
+    server.stop(None)
+    for failure in failures:
+        print(f"FAILED: {failure} did not provision {args.seats} seats")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
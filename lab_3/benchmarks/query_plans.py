@@ -0,0 +1,114 @@
+"""List the full table scans on a service's hot path.
+
+    python benchmarks/query_plans.py event_service
+
+Drives the service's hot path, captures all the SQL it issues and runs each
+statement through ``EXPLAIN QUERY PLAN``.  Every plain ``SCAN <table>`` of a
+service table is printed as one JSON list.  tests/test_query_plans.py runs
+this for every service (and inventory backend, via ``INVENTORY_BACKEND``)
+and fails on any scan; each run needs its own interpreter, because the
+services' modules share names such as ``models``.
+"""
+import argparse
+import json
+import re
+import sys
+
+from _support import use_service
+
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def exercise_user_service():
+    from user import UserService
+    from user_pb2 import UserRequest
+
+    service = UserService()
+
+    def hot_path():
+        service.GetUser(UserRequest(user_id=1), None)
+
+    return service.engine, hot_path
+
+
+def exercise_event_service():
+    from datetime import datetime, timedelta
+    from event import EventService
+
+    service = EventService()
+
+    def hot_path():
+        service._get_event(101, None)
+        service.inventory.available(101)
+        service.inventory.reserve(101, 2, "plan-1")
+        expires_at = datetime.utcnow() + timedelta(minutes=5)
+        service.inventory.reserve_many(101, [(1, "plan-2", None), (1, "plan-3", expires_at)])
+        service.inventory.confirm(101, "plan-3", "plan-4")
+        service.inventory.reserve_block(101, 3, "plan-5", row=2)
+        service.inventory.release(101, "plan-1")
+        service.inventory.release(101, "plan-5")
+        service.inventory.release_expired()
+
+    return service.engine, hot_path
+
+
+def exercise_booking_service():
+    from models import init_db, get_session, Booking
+    from listing import booking_page
+
+    engine = init_db()
+
+    def hot_path():
+        session = get_session(engine)
+        try:
+            session.get(Booking, 1)
+            for filters in ({"user_id": 1}, {"event_id": 1}, {"status": "confirmed"}):
+                booking_page(session, limit=20, **filters)
+                booking_page(session, after=100, limit=20, descending=True, **filters)
+        finally:
+            session.close()
+
+    return engine, hot_path
+
+
+def full_scans(service):
+    from sqlalchemy import event, inspect
+
+    engine, hot_path = globals()[f"exercise_{service}"]()
+    tables = set(inspect(engine).get_table_names())
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if executemany and parameters and isinstance(parameters[0], (tuple, list, dict)):
+            parameters = parameters[0]
+        captured.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        hot_path()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    scans = []
+    with engine.connect() as connection:
+        for statement, parameters in captured:
+            plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            for row in plan:
+                match = FULL_SCAN.match(row[-1])
+                if match and match.group(1) in tables:
+                    scans.append({"table": match.group(1), "statement": " ".join(statement.split())})
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("service", choices=["user_service", "event_service", "booking_service"])
+    args = parser.parse_args()
+
+    use_service(args.service)
+    print(json.dumps(full_scans(args.service)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
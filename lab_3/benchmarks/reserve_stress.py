@@ -0,0 +1,122 @@
+"""Fire concurrent ReserveSeats calls at one event and check nothing is oversold.
+
+    python benchmarks/reserve_stress.py --backend sql --requests 5000
+    python benchmarks/reserve_stress.py --contiguous --seats 50000 --row-length 50
+
+Exits with status 1 if a seat is handed out twice, more tickets are sold
+than the event has, or the remaining availability does not add up.  With
+``--contiguous`` every reservation must also be one block within a row.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent import futures
+
+from _support import use_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default=os.getenv("INVENTORY_BACKEND", "sql"))
+    parser.add_argument("--batch-size", default=os.getenv("RESERVATION_BATCH_SIZE", "64"))
+    parser.add_argument("--batch-window-ms", default=os.getenv("RESERVATION_BATCH_WINDOW_MS", "0"))
+    parser.add_argument("--seats", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--tickets", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--server-threads", type=int, default=10)
+    parser.add_argument("--contiguous", action="store_true")
+    parser.add_argument("--row-length", type=int, default=0)
+    args = parser.parse_args()
+
+    use_service("event_service")
+    os.environ["INVENTORY_BACKEND"] = args.backend
+    os.environ["RESERVATION_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["RESERVATION_BATCH_WINDOW_MS"] = str(args.batch_window_ms)
+
+    import grpc
+    from event_pb2 import CheckAvailabilityRequest, ReserveSeatsRequest
+    from event_pb2_grpc import EventServiceStub, add_EventServiceServicer_to_server
+    from event import EventService
+    from models import get_session, Event
+
+    event_id = 900
+    service = EventService()
+    session = get_session(service.engine)
+    try:
+        session.add(Event(
+            event_id=event_id, name="Stress test", date="2024-01-01T00:00:00Z",
+            venue="Stadium", ticket_price=1.0, total_seats=args.seats,
+            row_length=args.row_length or None
+        ))
+        session.commit()
+        service.inventory.provision(session, event_id, args.seats)
+        session.commit()
+    finally:
+        session.close()
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.server_threads))
+    add_EventServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    client = EventServiceStub(channel)
+
+    def reserve(i):
+        return client.ReserveSeats(ReserveSeatsRequest(
+            event_id=event_id, number_of_tickets=args.tickets, booking_id=f"stress-{i}",
+            contiguous=args.contiguous
+        ))
+
+    started = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=args.clients) as pool:
+        responses = list(pool.map(reserve, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    remaining = client.CheckAvailability(
+        CheckAvailabilityRequest(event_id=event_id, number_of_tickets=1)
+    ).available_seats
+    channel.close()
+    server.stop(None)
+
+    sold = [seat for r in responses if r.success for seat in r.seat_numbers]
+    succeeded = sum(1 for r in responses if r.success)
+    capacity = args.seats // args.tickets
+    if args.contiguous and args.row_length:
+        rows, last_row = divmod(args.seats, args.row_length)
+        capacity = rows * (args.row_length // args.tickets) + last_row // args.tickets
+    expected = min(args.requests, capacity)
+    violations = []
+    if args.contiguous:
+        row_length = args.row_length or args.seats
+        scattered = sum(
+            1 for r in responses if r.success and (
+                list(r.seat_numbers) != list(range(r.seat_numbers[0], r.seat_numbers[0] + args.tickets))
+                or (r.seat_numbers[0] - 1) // row_length != (r.seat_numbers[-1] - 1) // row_length
+            )
+        )
+        if scattered:
+            violations.append(f"{scattered} reservations are not one block within a row")
+    if len(sold) != len(set(sold)):
+        violations.append(f"{len(sold) - len(set(sold))} seats sold more than once")
+    if len(sold) > args.seats:
+        violations.append(f"sold {len(sold)} seats out of {args.seats}")
+    if succeeded != expected:
+        violations.append(f"{succeeded} reservations succeeded, expected {expected}")
+    if remaining != args.seats - len(sold):
+        violations.append(f"{remaining} seats left, expected {args.seats - len(sold)}")
+
+    print(f"backend={args.backend} batch_size={args.batch_size} contiguous={args.contiguous} "
+          f"requests={args.requests} clients={args.clients}")
+    print(f"succeeded={succeeded} seats_sold={len(sold)} remaining={remaining}")
+    print(f"elapsed={elapsed:.2f}s calls_per_sec={args.requests / elapsed:.0f} "
+          f"reservations_per_sec={succeeded / elapsed:.0f}")
+    for violation in violations:
+        print(f"VIOLATION: {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
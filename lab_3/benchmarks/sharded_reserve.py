@@ -0,0 +1,148 @@
+"""Reservation throughput over 1..N event service shards, then add a shard.
+
+    python benchmarks/sharded_reserve.py --shards 1 2 4 --events 64 --seconds 5
+
+For every shard count, starts that many ``event.py`` processes (each with
+its own SQLite file), creates ``--events`` events through the booking
+service's ``ShardRouter`` and has ``--clients`` threads reserve one seat at
+a time on random events for ``--seconds``.  Each process is one core at
+most, so throughput should grow with the shard count as long as the
+machine has cores to spare for them and the clients.
+
+Afterwards one more shard is added to the largest setup: the events the
+new ring gives to it are moved with rebalance.py, and the seat counts seen
+through the new ring are checked against the ones before the move.
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from _support import LAB_DIR, free_port, scratch_dir, use_service
+
+
+def start_shards(names, ring, generated, backend, **extra_env):
+    processes = []
+    for name, address in ring:
+        if name not in names:
+            continue
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join([generated, LAB_DIR]),
+            PORT=address.rsplit(":", 1)[1],
+            EVENT_SHARDS=",".join(f"{n}={a}" for n, a in ring),
+            EVENT_SHARD=name,
+            INVENTORY_BACKEND=backend,
+            **extra_env
+        )
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(LAB_DIR, "event_service", "event.py")],
+            cwd=scratch_dir(f"{name}-"), env=env, stdout=subprocess.DEVNULL
+        ))
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--events", type=int, default=64)
+    parser.add_argument("--seats", type=int, default=100000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--backend", default=os.getenv("INVENTORY_BACKEND", "sql"))
+    args = parser.parse_args()
+
+    use_service("booking_service")
+    generated = sys.path[0]
+    sys.path.insert(1, os.path.join(LAB_DIR, "event_service"))
+
+    import grpc
+    from event_pb2 import CheckAvailabilityRequest, CreateEventRequest, ReserveSeatsRequest
+    from event_pb2_grpc import EventServiceStub
+    from common.sharding import ShardRouter
+    import rebalance
+
+    event_ids = list(range(1001, 1001 + args.events))
+
+    def connect(ring):
+        router = ShardRouter(EventServiceStub, ring, grpc.insecure_channel)
+        for channel in router.channels.values():
+            grpc.channel_ready_future(channel).result(timeout=30)
+        return router
+
+    def availability(router):
+        return {
+            event_id: router.CheckAvailability(CheckAvailabilityRequest(event_id=event_id)).available_seats
+            for event_id in event_ids
+        }
+
+    ring = []
+    processes = []
+    router = None
+    try:
+        for count in args.shards:
+            ring = [(f"s{i}", f"127.0.0.1:{free_port()}") for i in range(count)]
+            processes = start_shards({name for name, _ in ring}, ring, generated, args.backend)
+            router = connect(ring)
+            for event_id in event_ids:
+                router.CreateEvent(CreateEventRequest(
+                    event_id=event_id, name=f"Sharded {event_id}", date="2024-01-01T00:00:00Z",
+                    venue="Arena", ticket_price=1.0, total_seats=args.seats
+                ))
+
+            done = [0] * args.clients
+            stop = time.perf_counter() + args.seconds
+
+            def client(i):
+                rng = random.Random(i)
+                while time.perf_counter() < stop:
+                    event_id = rng.choice(event_ids)
+                    response = router.ReserveSeats(ReserveSeatsRequest(
+                        event_id=event_id, number_of_tickets=1, booking_id=f"c{i}-{done[i]}"
+                    ))
+                    if response.success:
+                        done[i] += 1
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            owners = {name: 0 for name, _ in ring}
+            for event_id in event_ids:
+                owners[router.ring.node_for(event_id)] += 1
+            print(f"shards={count} reservations/s={sum(done) / args.seconds:7.0f} "
+                  f"events per shard={sorted(owners.values())}")
+
+            if count != args.shards[-1]:
+                for process in processes:
+                    process.terminate()
+                    process.wait()
+
+        before = availability(router)
+        new_ring = ring + [(f"s{len(ring)}", f"127.0.0.1:{free_port()}")]
+        processes += start_shards(
+            {new_ring[-1][0]}, new_ring, generated, args.backend, EVENT_SHARD_JOINING="1"
+        )
+        new_router = connect(new_ring)
+        stubs = {name: new_router.stubs[name] for name, _ in new_ring}
+        started = time.perf_counter()
+        planned = list(rebalance.planned_moves(ring, new_ring, stubs))
+        moved = [step for step in planned if rebalance.move(*step, stubs, 60)]
+        dropped = sum(rebalance.drop(*step, stubs, 60) for step in moved)
+        elapsed = time.perf_counter() - started
+        after = availability(new_router)
+        print(f"added shard: moved={len(moved)}/{len(planned)} dropped={dropped} elapsed={elapsed:.2f}s "
+              f"seat counts {'match' if after == before else 'DIFFER'}")
+        return 0 if after == before and len(moved) == dropped == len(planned) else 1
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""The booking HTTP API on asyncio, for ASGI servers.
+
+    HTTP_SERVER=uvicorn python booking.py    (with the gRPC front door)
+    uvicorn asgi:app --host 0.0.0.0 --port 5000    (or: python asgi.py)
+
+Same ``/api/bookings`` routes and JSON as the Flask app in booking.py, and
+the same checks and results (flow.py), but every request is a coroutine
+and the user and event services are called through ``grpc.aio``, so a
+booking waiting on them costs a few kilobytes rather than a thread.
+SQLite work runs on a small thread pool (``DB_THREADS``) and at most
+``MAX_IN_FLIGHT`` requests are admitted at once; past that the service
+answers 503 instead of queueing without bound.  ``GET /metrics`` has the
+process's request, RPC and SQL timings.
+"""
+import asyncio
+import json
+import os
+import re
+import uuid
+from concurrent import futures
+from time import perf_counter
+from urllib.parse import parse_qs
+import grpc
+from user_pb2_grpc import UserServiceStub
+from event_pb2 import ConfirmHoldRequest, ReleaseSeatsRequest
+from event_pb2_grpc import EventServiceStub
+import flow
+from flow import engine, event_timeout, failed_release_delay
+from user_loader import AsyncUserLoader
+from outbox import fail_bookings
+from listing import booking_dict, iter_pages
+from common import metrics
+from common.sharding import ShardRouter
+
+max_in_flight = int(os.getenv("MAX_IN_FLIGHT", "10000"))
+max_event_rpcs = int(os.getenv("EVENT_SERVICE_MAX_RPCS", "500"))
+db_pool = futures.ThreadPoolExecutor(max_workers=int(os.getenv("DB_THREADS", "4")))
+in_flight = 0
+
+class Clients:
+    """``grpc.aio`` channels belong to the event loop that opens them, so
+    every loop gets its own, opened the first time it needs them."""
+
+    def __init__(self):
+        interceptors = [metrics.AsyncClientInterceptor()]
+        self.user_channel = grpc.aio.insecure_channel(
+            f"{flow.user_host}:{flow.user_port}", interceptors=interceptors
+        )
+        self.event = ShardRouter(
+            EventServiceStub, flow.event_shards,
+            lambda address: grpc.aio.insecure_channel(address, interceptors=interceptors)
+        )
+        self.users = AsyncUserLoader(
+            UserServiceStub(self.user_channel),
+            window=flow.user_batch_window,
+            max_batch=flow.user_batch_size,
+            timeout=flow.user_timeout,
+            cache=flow.user_cache
+        )
+        # Thousands of bookings may be in flight, but only this many calls
+        # to the event service are; the rest wait here, where it is cheap,
+        # rather than as HTTP/2 streams the server starts refusing.
+        self.event_slots = asyncio.Semaphore(max_event_rpcs)
+        self.releases = set()
+
+    async def close(self):
+        if self.releases:
+            await asyncio.wait(self.releases, timeout=event_timeout)
+        await self.user_channel.close()
+        for channel in self.event.channels.values():
+            await channel.close()
+
+clients_by_loop = {}
+
+def get_clients():
+    loop = asyncio.get_running_loop()
+    if loop not in clients_by_loop:
+        clients_by_loop[loop] = Clients()
+    return clients_by_loop[loop]
+
+async def close_clients():
+    clients = clients_by_loop.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients.close()
+
+def run_db(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(db_pool, fn, *args)
+
+async def event_rpc(rpc, request):
+    async with get_clients().event_slots:
+        return await rpc(request, timeout=event_timeout)
+
+def call(rpc, request):
+    return asyncio.ensure_future(event_rpc(rpc, request))
+
+def ignore_result(future):
+    if not future.cancelled():
+        future.exception()
+
+def release_hold(event_id, hold_id):
+    """Best-effort release of a hold we are not going to confirm.
+
+    Anything missed here is reclaimed by the event service once the hold
+    expires, so failures are ignored.  The task is kept referenced until it
+    finishes so it is not collected mid-call.
+    """
+    releases = get_clients().releases
+    task = call(get_clients().event.ReleaseSeats, ReleaseSeatsRequest(event_id=event_id, booking_id=hold_id))
+    releases.add(task)
+    task.add_done_callback(releases.discard)
+    task.add_done_callback(ignore_result)
+
+async def create_booking_result(user_id, event_id, number_of_tickets, contiguous=False, row=0):
+    """Hold the seats while the user is looked up, record the booking, then
+    confirm the hold under the new booking id."""
+    clients = get_clients()
+    hold_id = uuid.uuid4().hex
+    user_call = clients.users.load(user_id)
+    hold_call = call(clients.event.HoldSeats, flow.hold_request(
+        hold_id, event_id, number_of_tickets, contiguous=contiguous, row=row
+    ))
+    # Whichever of the two fails first decides, and the other is cancelled.
+    pending = {user_call, hold_call}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if user_call in done and user_call.exception() is not None:
+            def release_if_held(hold_call):
+                # A cancelled hold may still have been taken by the event service.
+                if hold_call.cancelled() or (hold_call.exception() is None and hold_call.result().success):
+                    release_hold(event_id, hold_id)
+            hold_call.cancel()
+            hold_call.add_done_callback(ignore_result)
+            hold_call.add_done_callback(release_if_held)
+            return flow.user_error(user_call.exception(), user_id)
+        if hold_call in done:
+            if hold_call.exception() is not None:
+                user_call.cancel()
+                return flow.event_error(hold_call.exception(), event_id)
+            if not hold_call.result().success:
+                user_call.cancel()
+                return flow.not_enough_seats(hold_call.result())
+
+    try:
+        booking, = await run_db(flow.insert_bookings, [{
+            "user_id": user_id, "event_id": event_id, "number_of_tickets": number_of_tickets
+        }])
+    except Exception:
+        release_hold(event_id, hold_id)
+        raise
+
+    try:
+        confirm_response = await event_rpc(clients.event.ConfirmHold, ConfirmHoldRequest(
+            event_id=event_id, hold_id=hold_id, booking_id=str(booking.booking_id)
+        ))
+        if not confirm_response.success:
+            await run_db(flow.discard_bookings, [booking.booking_id])
+            release_hold(event_id, hold_id)
+            return {"error": confirm_response.message}, 400
+    except grpc.RpcError:
+        # The confirm may or may not have been applied.  Give the hold back
+        # now in case it was not, and have the outbox release the booking
+        # id once it no longer can be.
+        release_hold(event_id, hold_id)
+        await run_db(fail_bookings, engine, [booking], failed_release_delay)
+        return {"error": "Error reserving seats"}, 500
+
+    return flow.created(booking)
+
+async def create_booking_json(data):
+    """``POST /api/bookings`` with its JSON body, as decoded (None if it was not JSON)."""
+    booking, error = flow.read_booking(data)
+    if error is not None:
+        return error
+    return await create_booking_result(**booking)
+
+async def create_bookings_batch(data):
+    """Create many bookings at once, reporting a result per item.
+
+    Items are grouped so that every distinct user is looked up once (the
+    loader folds them into ``BatchGetUsers`` calls), every event gets one
+    ``BatchHoldSeats`` and one ``BatchConfirmHolds`` call, and all bookings
+    are inserted in one transaction.  An invalid item fails on its own.
+    """
+    items, results, error = flow.read_batch(data)
+    if error is not None:
+        return error
+    clients = get_clients()
+
+    by_event = flow.group_by_event(items)
+    user_calls = {}
+    for indices in by_event.values():
+        for i in indices:
+            if items[i]["user_id"] not in user_calls:
+                user_calls[items[i]["user_id"]] = clients.users.load(items[i]["user_id"])
+    hold_ids = {i: uuid.uuid4().hex for indices in by_event.values() for i in indices}
+    hold_calls = {
+        event_id: call(clients.event.BatchHoldSeats, flow.batch_hold_request(event_id, indices, items, hold_ids))
+        for event_id, indices in by_event.items()
+    }
+    if by_event:
+        await asyncio.wait(list(user_calls.values()) + list(hold_calls.values()))
+
+    # Seats held for this batch and neither confirmed nor given back yet;
+    # if any step below raises, they are released on the way out rather
+    # than left until their holds expire.
+    held = {}
+    bookings = {}
+    try:
+        flow.settle_holds(by_event, items, user_calls, hold_calls, results, held, release_hold)
+        if held:
+            bookings = dict(zip(held, await run_db(flow.insert_bookings, [items[i] for i in held])))
+
+        confirmations = flow.group_by_event(items, held)
+        confirm_calls = {
+            event_id: call(clients.event.BatchConfirmHolds, flow.batch_confirm_request(
+                event_id, indices, hold_ids, bookings
+            ))
+            for event_id, indices in confirmations.items()
+        }
+        if confirm_calls:
+            await asyncio.wait(list(confirm_calls.values()))
+
+        discarded, failed = flow.settle_confirms(
+            confirmations, confirm_calls, bookings, results, held, release_hold
+        )
+        if discarded:
+            await run_db(flow.discard_bookings, discarded)
+        if failed:
+            await run_db(fail_bookings, engine, failed, failed_release_delay)
+    except Exception:
+        for i, hold_id in held.items():
+            release_hold(items[i]["event_id"], hold_id)
+        # Their confirms may have gone through under the booking id.
+        unsettled = [bookings[i] for i in held if i in bookings]
+        if unsettled:
+            await run_db(fail_bookings, engine, unsettled, failed_release_delay)
+        raise
+
+    return flow.batch_body(results)
+
+async def list_bookings(scope, args, send):
+    query, error = flow.read_list_query(lambda name: args.get(name, [None])[0])
+    if error is not None:
+        return await respond(send, *error)
+
+    headers = dict(scope["headers"])
+    accept = headers.get(b"accept", b"").decode("latin-1").split(",")[0].split(";")[0].strip()
+    if args.get("format", [None])[0] == "ndjson" or accept == "application/x-ndjson":
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson")]
+        })
+        pages = iter_pages(engine, after=query["after"], **query["filters"])
+        while True:
+            page = await run_db(next, pages, None)
+            if page is None:
+                break
+            chunk = "".join(json.dumps(booking_dict(booking)) + "\n" for booking in page)
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        return await send({"type": "http.response.body", "body": b""})
+
+    body, code = await run_db(lambda: flow.list_bookings_result(**query))
+    await respond(send, body, code)
+
+async def read_json(receive):
+    """The request body decoded as JSON, or None if it is not JSON."""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            try:
+                return json.loads(body)
+            except ValueError:
+                return None
+
+async def respond(send, body, code):
+    payload = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": code,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode())]
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+BOOKING_PATH = re.compile(r"/api/bookings/(\d+)")
+ROUTES = {
+    "/api/bookings", "/api/bookings/batch", "/api/stats/user-cache", "/api/stats/seat-releases", "/metrics"
+}
+
+def route_name(path):
+    # The same route labels as Flask's url rules, so both apps' metrics line up.
+    if path in ROUTES:
+        return path
+    if BOOKING_PATH.fullmatch(path):
+        return "/api/bookings/<int:booking_id>"
+    return "unmatched"
+
+async def respond_metrics(send):
+    payload = metrics.render().encode()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", metrics.CONTENT_TYPE.encode()),
+                    (b"content-length", str(len(payload)).encode())]
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+async def route(scope, receive, send):
+    method, path = scope["method"], scope["path"]
+    if path == "/api/bookings" and method == "GET":
+        args = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        return await list_bookings(scope, args, send)
+    if path == "/api/bookings" and method == "POST":
+        body, code = await create_booking_json(await read_json(receive))
+    elif path == "/api/bookings/batch" and method == "POST":
+        body, code = await create_bookings_batch(await read_json(receive))
+    elif BOOKING_PATH.fullmatch(path) and method in ("GET", "DELETE"):
+        booking_id = int(BOOKING_PATH.fullmatch(path).group(1))
+        if method == "GET":
+            body, code = await run_db(flow.get_booking_result, booking_id)
+        else:
+            body, code = await run_db(flow.cancel_booking_result, booking_id)
+    elif path == "/metrics" and method == "GET":
+        return await respond_metrics(send)
+    elif path == "/api/stats/seat-releases" and method == "GET":
+        body, code = await run_db(flow.seat_release_stats)
+    elif path == "/api/stats/user-cache" and method == "GET":
+        body, code = flow.user_cache_stats()
+    else:
+        body, code = {"error": "Not found"}, 404
+    await respond(send, body, code)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_clients()
+            flow.release_worker.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_clients()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    global in_flight
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    if in_flight >= max_in_flight:
+        return await respond(send, {"error": "Too many requests in flight"}, 503)
+    in_flight += 1
+    started = perf_counter()
+    status = [None]
+
+    async def send_timed(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+        await send(message)
+
+    try:
+        await route(scope, receive, send_timed)
+    except Exception as e:
+        if status[0] is not None:
+            # Part of the response is already out (an NDJSON export), so
+            # there is no sending an error now; the server drops the
+            # connection and the client sees a truncated body.
+            status[0] = 500
+            raise
+        await respond(send_timed, {"error": str(e)}, 500)
+    finally:
+        in_flight -= 1
+        metrics.HTTP_REQUESTS.observe(
+            (scope["method"], route_name(scope["path"]), str(status[0] or 500)), perf_counter() - started
+        )
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")), lifespan="on")
@@ -1,171 +1,345 @@
+import json
 import os
-from flask import Flask, request, jsonify
+import queue
+import uuid
+from concurrent import futures
+from flask import Flask, Response, request, jsonify, stream_with_context
 import grpc
-from datetime import datetime
-from user_pb2 import UserRequest
 from user_pb2_grpc import UserServiceStub
-from event_pb2 import (
-    CheckAvailabilityRequest, ReserveSeatsRequest, ReleaseSeatsRequest
-)
+from event_pb2 import ConfirmHoldRequest, ReleaseSeatsRequest
 from event_pb2_grpc import EventServiceStub
-from models import init_db, get_session, Booking
+from booking_pb2 import (
+    CreateBookingResponse, GetBookingResponse, CancelBookingResponse
+)
+import booking_pb2_grpc
+import flow
+from flow import engine, event_timeout, failed_release_delay
+from user_loader import UserLoader
+from outbox import fail_bookings
+from listing import booking_dict, iter_bookings, iter_pages, parse_cursor, InvalidCursor
+from common import metrics
+from common.sharding import ShardRouter
 
+# The threaded front doors, Flask and gRPC.  They call the user and event
+# services on blocking stubs from their request threads; what they share
+# with the ASGI app in asgi.py is in flow.py.
 app = Flask(__name__)
-engine = init_db()
-user_host = os.getenv("USER_SERVICE_HOST", "localhost")
-user_channel = grpc.insecure_channel(f"{user_host}:50051")
-user_client = UserServiceStub(user_channel)
-event_host = os.getenv("EVENT_SERVICE_HOST", "localhost")
-event_channel = grpc.insecure_channel(f"{event_host}:50052")
-event_client = EventServiceStub(event_channel)
+metrics.instrument_flask(app)
+user_channel = flow.blocking_channel(f"{flow.user_host}:{flow.user_port}")
+event_client = ShardRouter(EventServiceStub, flow.event_shards, flow.blocking_channel)
+user_loader = UserLoader(
+    UserServiceStub(user_channel),
+    window=flow.user_batch_window,
+    max_batch=flow.user_batch_size,
+    timeout=flow.user_timeout,
+    cache=flow.user_cache
+)
+flow.release_worker.start()
+
+def first_failure(calls, failed):
+    """Return the first call to fail, as soon as it does, or None once all succeeded.
+
+    ``failed(call)`` tells whether a finished call failed, by raising or by
+    its answer.  Calls still running when one fails are left to the caller.
+    """
+    finished = queue.Queue()
+    for call in calls:
+        call.add_done_callback(finished.put)
+    for _ in calls:
+        call = finished.get()
+        if failed(call):
+            return call
+    return None
+
+def wait_all(calls):
+    finished = queue.Queue()
+    for call in calls:
+        call.add_done_callback(finished.put)
+    for _ in calls:
+        finished.get()
+
+pending_releases = set()
+
+def release_hold(event_id, hold_id):
+    """Best-effort release of a hold we are not going to confirm.
+
+    Anything missed here is reclaimed by the event service once the hold
+    expires, so failures are ignored.  The call is kept referenced until it
+    finishes because gRPC cancels futures that are garbage collected.
+    """
+    call = event_client.ReleaseSeats.future(
+        ReleaseSeatsRequest(event_id=event_id, booking_id=hold_id),
+        timeout=event_timeout
+    )
+    pending_releases.add(call)
+    call.add_done_callback(pending_releases.discard)
+
+def create_booking_result(user_id, event_id, number_of_tickets, contiguous=False, row=0):
+    """Hold the seats while the user is looked up, record the booking, then
+    confirm the hold under the new booking id."""
+    hold_id = uuid.uuid4().hex
+    user_call = user_loader.load(user_id)
+    hold_call = event_client.HoldSeats.future(
+        flow.hold_request(hold_id, event_id, number_of_tickets, contiguous=contiguous, row=row),
+        timeout=event_timeout
+    )
+    # Whichever of the two fails first decides, and the other is cancelled.
+    failed = first_failure(
+        [user_call, hold_call],
+        lambda call: call.exception() is not None or (call is hold_call and not call.result().success)
+    )
+    if failed is user_call:
+        def release_if_held(call):
+            # A cancelled hold may still have been taken by the event service.
+            if call.cancelled() or (call.exception() is None and call.result().success):
+                release_hold(event_id, hold_id)
+        hold_call.cancel()
+        hold_call.add_done_callback(release_if_held)
+        return flow.user_error(user_call.exception(), user_id)
+    if failed is hold_call:
+        user_call.cancel()
+        if hold_call.exception() is not None:
+            return flow.event_error(hold_call.exception(), event_id)
+        return flow.not_enough_seats(hold_call.result())
+
+    try:
+        booking, = flow.insert_bookings([{
+            "user_id": user_id, "event_id": event_id, "number_of_tickets": number_of_tickets
+        }])
+    except Exception:
+        release_hold(event_id, hold_id)
+        raise
+
+    try:
+        confirm_response = event_client.ConfirmHold(
+            ConfirmHoldRequest(event_id=event_id, hold_id=hold_id, booking_id=str(booking.booking_id)),
+            timeout=event_timeout
+        )
+        if not confirm_response.success:
+            flow.discard_bookings([booking.booking_id])
+            release_hold(event_id, hold_id)
+            return {"error": confirm_response.message}, 400
+    except grpc.RpcError:
+        # The confirm may or may not have been applied.  Give the hold back
+        # now in case it was not, and have the outbox release the booking
+        # id once it no longer can be.
+        release_hold(event_id, hold_id)
+        fail_bookings(engine, [booking], failed_release_delay)
+        return {"error": "Error reserving seats"}, 500
+
+    return flow.created(booking)
+
+def create_bookings_batch_result(data):
+    """Create many bookings at once, reporting a result per item.
+
+    Items are grouped so that every distinct user is looked up once (the
+    loader folds them into ``BatchGetUsers`` calls), every event gets one
+    ``BatchHoldSeats`` and one ``BatchConfirmHolds`` call, and all bookings
+    are inserted in one transaction.  An invalid item fails on its own.
+    """
+    items, results, error = flow.read_batch(data)
+    if error is not None:
+        return error
+
+    by_event = flow.group_by_event(items)
+    user_calls = {}
+    for indices in by_event.values():
+        for i in indices:
+            if items[i]["user_id"] not in user_calls:
+                user_calls[items[i]["user_id"]] = user_loader.load(items[i]["user_id"])
+    hold_ids = {i: uuid.uuid4().hex for indices in by_event.values() for i in indices}
+    hold_calls = {
+        event_id: event_client.BatchHoldSeats.future(
+            flow.batch_hold_request(event_id, indices, items, hold_ids), timeout=event_timeout
+        )
+        for event_id, indices in by_event.items()
+    }
+    wait_all(list(user_calls.values()) + list(hold_calls.values()))
+
+    # Seats held for this batch and neither confirmed nor given back yet;
+    # if any step below raises, they are released on the way out rather
+    # than left until their holds expire.
+    held = {}
+    bookings = {}
+    try:
+        flow.settle_holds(by_event, items, user_calls, hold_calls, results, held, release_hold)
+        if held:
+            bookings = dict(zip(held, flow.insert_bookings([items[i] for i in held])))
+
+        confirmations = flow.group_by_event(items, held)
+        confirm_calls = {
+            event_id: event_client.BatchConfirmHolds.future(
+                flow.batch_confirm_request(event_id, indices, hold_ids, bookings), timeout=event_timeout
+            )
+            for event_id, indices in confirmations.items()
+        }
+        wait_all(list(confirm_calls.values()))
+
+        discarded, failed = flow.settle_confirms(
+            confirmations, confirm_calls, bookings, results, held, release_hold
+        )
+        if discarded:
+            flow.discard_bookings(discarded)
+        if failed:
+            fail_bookings(engine, failed, failed_release_delay)
+    except Exception:
+        for i, hold_id in held.items():
+            release_hold(items[i]["event_id"], hold_id)
+        # Their confirms may have gone through under the booking id.
+        unsettled = [bookings[i] for i in held if i in bookings]
+        if unsettled:
+            fail_bookings(engine, unsettled, failed_release_delay)
+        raise
+
+    return flow.batch_body(results)
 
 @app.route("/api/bookings", methods=["POST"])
 def create_booking():
     try:
-        data = request.get_json()
-        user_id = data.get("user_id")
-        event_id = data.get("event_id")
-        number_of_tickets = data.get("number_of_tickets")
-        
-        if not all([user_id, event_id, number_of_tickets]):
-            return jsonify({"error": "Missing required fields"}), 400
-        try:
-            user_request = UserRequest(user_id=user_id)
-            user_response = user_client.GetUser(user_request)
-        except grpc.RpcError as e:
-            if e.code() == grpc.StatusCode.NOT_FOUND:
-                return jsonify({"error": f"User with id {user_id} not found"}), 404
-            return jsonify({"error": "Error connecting to User Service"}), 500
-        try:
-            availability_request = CheckAvailabilityRequest(
-                event_id=event_id,
-                number_of_tickets=number_of_tickets
-            )
-            availability_response = event_client.CheckAvailability(availability_request)
-            
-            if not availability_response.available:
-                return jsonify({
-                    "error": "Not enough seats available",
-                    "available_seats": availability_response.available_seats
-                }), 400
-        except grpc.RpcError as e:
-            if e.code() == grpc.StatusCode.NOT_FOUND:
-                return jsonify({"error": f"Event with id {event_id} not found"}), 404
-            return jsonify({"error": "Error connecting to Event Service"}), 500
-        
-        session = get_session(engine)
-        try:
-            booking = Booking(
-                user_id=user_id,
-                event_id=event_id,
-                number_of_tickets=number_of_tickets,
-                status="confirmed"
-            )
-            session.add(booking)
-            session.commit()
-            booking_id = booking.booking_id
-        finally:
-            session.close()
-        
-        try:
-            reserve_request = ReserveSeatsRequest(
-                event_id=event_id,
-                number_of_tickets=number_of_tickets,
-                booking_id=str(booking_id)
-            )
-            reserve_response = event_client.ReserveSeats(reserve_request)
-            
-            if not reserve_response.success:
-                session = get_session(engine)
-                try:
-                    booking = session.query(Booking).filter(Booking.booking_id == booking_id).first()
-                    if booking:
-                        session.delete(booking)
-                        session.commit()
-                finally:
-                    session.close()
-                
-                return jsonify({"error": reserve_response.message}), 400
-        except grpc.RpcError:
-            session = get_session(engine)
-            try:
-                booking = session.query(Booking).filter(Booking.booking_id == booking_id).first()
-                if booking:
-                    session.delete(booking)
-                    session.commit()
-            finally:
-                session.close()
-            
-            return jsonify({"error": "Error reserving seats"}), 500
-        
-        session = get_session(engine)
-        try:
-            booking = session.query(Booking).filter(Booking.booking_id == booking_id).first()
-            return jsonify({
-                "booking_id": booking.booking_id,
-                "status": booking.status,
-                "message": "Booking created successfully",
-                "created_at": booking.created_at.isoformat() + "Z"
-            }), 201
-        finally:
-            session.close()
-            
+        booking, error = flow.read_booking(request.get_json(silent=True))
+        body, code = error if error is not None else create_booking_result(**booking)
+        return jsonify(body), code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/api/bookings/batch", methods=["POST"])
+def create_bookings_batch():
+    """Create many bookings at once, reporting a result per item."""
+    try:
+        body, code = create_bookings_batch_result(request.get_json(silent=True))
+        return jsonify(body), code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/bookings", methods=["GET"])
+def list_bookings():
+    """List bookings filtered by user_id, event_id and status.
+
+    Returns one page (``limit``, default 50) and a ``next_cursor`` to pass
+    back as ``cursor``; ``order=desc`` lists newest first.  With
+    ``format=ndjson`` (or ``Accept: application/x-ndjson``) every matching
+    booking is streamed instead, one JSON object per line.
+    """
+    query, error = flow.read_list_query(request.args.get)
+    if error is not None:
+        body, code = error
+        return jsonify(body), code
+    
+    if (request.args.get("format") == "ndjson"
+            or request.accept_mimetypes.best == "application/x-ndjson"):
+        pages = iter_pages(engine, after=query["after"], **query["filters"])
+        chunks = (
+            "".join(json.dumps(booking_dict(booking)) + "\n" for booking in page)
+            for page in pages
+        )
+        return Response(stream_with_context(chunks), mimetype="application/x-ndjson")
+    
+    body, code = flow.list_bookings_result(**query)
+    return jsonify(body), code
+
 @app.route("/api/bookings/<int:booking_id>", methods=["GET"])
 def get_booking(booking_id):
-    session = get_session(engine)
-    try:
-        booking = session.query(Booking).filter(Booking.booking_id == booking_id).first()
-        if booking is None:
-            return jsonify({"error": "Booking not found"}), 404
-        
-        return jsonify({
-            "booking_id": booking.booking_id,
-            "user_id": booking.user_id,
-            "event_id": booking.event_id,
-            "status": booking.status,
-            "number_of_tickets": booking.number_of_tickets,
-            "created_at": booking.created_at.isoformat() + "Z"
-        }), 200
-    finally:
-        session.close()
+    body, code = flow.get_booking_result(booking_id)
+    return jsonify(body), code
 
 @app.route("/api/bookings/<int:booking_id>", methods=["DELETE"])
 def cancel_booking(booking_id):
-    session = get_session(engine)
-    try:
-        booking = session.query(Booking).filter(Booking.booking_id == booking_id).first()
-        if booking is None:
-            return jsonify({"error": "Booking not found"}), 404
-        
-        if booking.status == "cancelled":
-            return jsonify({"error": "Booking already cancelled"}), 400
-        
+    body, code = flow.cancel_booking_result(booking_id)
+    return jsonify(body), code
+
+@app.route("/api/stats/user-cache", methods=["GET"])
+def user_cache_stats():
+    body, code = flow.user_cache_stats()
+    return jsonify(body), code
+
+@app.route("/api/stats/seat-releases", methods=["GET"])
+def seat_release_stats():
+    body, code = flow.seat_release_stats()
+    return jsonify(body), code
+
+STATUS_CODES = {
+    400: grpc.StatusCode.FAILED_PRECONDITION,
+    404: grpc.StatusCode.NOT_FOUND,
+    500: grpc.StatusCode.INTERNAL,
+}
+
+class BookingServicer(booking_pb2_grpc.BookingServiceServicer):
+    """gRPC front door; every RPC runs the same code as its HTTP route."""
+    
+    def _result(self, context, call, *args, **kwargs):
         try:
-            release_request = ReleaseSeatsRequest(
-                event_id=booking.event_id,
-                number_of_tickets=booking.number_of_tickets,
-                booking_id=str(booking_id)
-            )
-            release_response = event_client.ReleaseSeats(release_request)
-            
-            if not release_response.success:
-                return jsonify({"error": release_response.message}), 400
-        except grpc.RpcError as e:
-            return jsonify({"error": "Error releasing seats"}), 500
-        booking.status = "cancelled"
-        session.commit()
-        
-        return jsonify({
-            "success": True,
-            "message": "Booking cancelled successfully"
-        }), 200
-    finally:
-        session.close()
+            body, code = call(*args, **kwargs)
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, str(e))
+        if code >= 400:
+            context.abort(STATUS_CODES.get(code, grpc.StatusCode.UNKNOWN), body["error"])
+        return body
+    
+    def CreateBooking(self, request, context):
+        if not all([request.user_id, request.event_id, request.number_of_tickets]):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Missing required fields")
+        body = self._result(
+            context, create_booking_result,
+            request.user_id, request.event_id, request.number_of_tickets,
+            contiguous=request.contiguous, row=request.row
+        )
+        return CreateBookingResponse(**body)
+    
+    def GetBooking(self, request, context):
+        return GetBookingResponse(**self._result(context, flow.get_booking_result, request.booking_id))
+    
+    def CancelBooking(self, request, context):
+        try:
+            body, code = flow.cancel_booking_result(request.booking_id)
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, str(e))
+        if code == 404 or code >= 500:
+            context.abort(STATUS_CODES[code], body["error"])
+        if code >= 400:
+            return CancelBookingResponse(success=False, message=body["error"])
+        return CancelBookingResponse(**body)
+    
+    def ListBookings(self, request, context):
+        # limit=0 streams every matching booking (export); otherwise one page,
+        # continued by passing the last booking_id received as the cursor.
+        try:
+            after = parse_cursor(request.cursor)
+        except InvalidCursor as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        bookings = iter_bookings(
+            engine,
+            after=after,
+            limit=request.limit or None,
+            user_id=request.user_id or None,
+            event_id=request.event_id or None,
+            status=request.status or None,
+            descending=request.descending
+        )
+        for booking in bookings:
+            if not context.is_active():
+                return
+            yield GetBookingResponse(**booking_dict(booking))
+
+def serve_grpc(address):
+    """Start the gRPC front door next to the HTTP one; returns (server, port)."""
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=int(os.getenv("GRPC_WORKERS", "10"))),
+        interceptors=[metrics.ServerInterceptor()]
+    )
+    booking_pb2_grpc.add_BookingServiceServicer_to_server(BookingServicer(), server)
+    port = server.add_insecure_port(address)
+    server.start()
+    print(f"Booking gRPC service starting on port {port}")
+    return server, port
 
 if __name__ == "__main__":
+    grpc_server, _ = serve_grpc(f"[::]:{os.getenv('GRPC_PORT', '50053')}")
     port = int(os.getenv("PORT", "5000"))
-    app.run(host="0.0.0.0", port=port)
+    # HTTP_SERVER=uvicorn serves the HTTP API from asgi.py on asyncio
+    # instead of Flask's threads; the gRPC front door is the same either way.
+    if os.getenv("HTTP_SERVER", "flask") == "uvicorn":
+        import uvicorn
+        uvicorn.run("asgi:app", host="0.0.0.0", port=port, lifespan="on")
+    else:
+        app.run(host="0.0.0.0", port=port)
 
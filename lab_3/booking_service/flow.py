@@ -0,0 +1,348 @@
+"""The parts of the booking flow every front door shares.
+
+Each front door calls the user and event services on clients of its own:
+booking.py (Flask and the gRPC servicer) on blocking stubs from its request
+threads, asgi.py on ``grpc.aio`` from the server's event loop.  Everything
+that does not wait on those services is here, once: the configuration,
+reading requests, building the hold and confirm requests and reading their
+results, the database steps and the response bodies.  Every ``*_result``
+returns ``(body, http_status)``.
+"""
+import os
+import grpc
+from event_pb2 import HoldSeatsRequest, ConfirmHoldRequest, BatchHoldSeatsRequest, BatchConfirmHoldsRequest
+from event_pb2_grpc import EventServiceStub
+from models import init_db, get_session, Booking
+from user_loader import UserNotFound, InvalidUserId, INT32_MAX
+from outbox import ReleaseWorker, cancel_booking as queue_cancellation
+from listing import booking_page, booking_dict, parse_cursor, InvalidCursor
+from common import metrics
+from common.cache import TTLCache
+from common.sharding import ShardRouter, parse_shards
+
+engine = init_db()
+user_host = os.getenv("USER_SERVICE_HOST", "localhost")
+user_port = os.getenv("USER_SERVICE_PORT", "50051")
+event_host = os.getenv("EVENT_SERVICE_HOST", "localhost")
+event_port = os.getenv("EVENT_SERVICE_PORT", "50052")
+# EVENT_SERVICE_SHARDS (name=host:port,...) spreads events over several
+# event service shards; every call is routed by its event_id.
+event_shards = parse_shards(os.getenv("EVENT_SERVICE_SHARDS")) or [(f"{event_host}:{event_port}",) * 2]
+user_timeout = float(os.getenv("USER_SERVICE_TIMEOUT", "2.0"))
+event_timeout = float(os.getenv("EVENT_SERVICE_TIMEOUT", "2.0"))
+hold_ttl = int(os.getenv("HOLD_TTL_SECONDS", "60"))
+# A booking whose confirm timed out has its seats released by id once no
+# confirm can land any more: after the hold TTL, plus a call's timeout.
+failed_release_delay = hold_ttl + event_timeout
+batch_limit = int(os.getenv("BOOKING_BATCH_LIMIT", "1000"))
+page_limit = int(os.getenv("BOOKING_PAGE_LIMIT", "1000"))
+user_batch_window = float(os.getenv("USER_BATCH_WINDOW_MS", "2")) / 1000
+user_batch_size = int(os.getenv("USER_BATCH_SIZE", "100"))
+user_cache_ttl = float(os.getenv("USER_CACHE_TTL", "30"))
+user_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=user_cache_ttl
+) if user_cache_ttl > 0 else None
+if user_cache is not None:
+    metrics.instrument_cache(user_cache, "booking_users")
+
+def blocking_channel(address):
+    # Blocking channels, for the threaded front doors and release_worker;
+    # their calls are timed like every other RPC.
+    return grpc.intercept_channel(grpc.insecure_channel(address), metrics.ClientInterceptor())
+
+# Cancellations are queued in the database and their seats released by a
+# worker thread, which has blocking channels of its own.  There is one per
+# process, whichever front doors it serves.
+release_worker = ReleaseWorker(
+    engine,
+    ShardRouter(EventServiceStub, event_shards, blocking_channel),
+    batch_size=int(os.getenv("SEAT_RELEASE_BATCH", "500")),
+    window=float(os.getenv("SEAT_RELEASE_WINDOW_MS", "10")) / 1000,
+    interval=float(os.getenv("SEAT_RELEASE_INTERVAL", "5")),
+    retry_delay=float(os.getenv("SEAT_RELEASE_RETRY_SECONDS", "1")),
+    max_retry_delay=float(os.getenv("SEAT_RELEASE_MAX_RETRY_SECONDS", "60")),
+    timeout=event_timeout
+)
+
+def user_error(error, user_id):
+    if isinstance(error, UserNotFound):
+        return {"error": f"User with id {user_id} not found"}, 404
+    if isinstance(error, InvalidUserId):
+        return {"error": str(error)}, 400
+    return {"error": "Error connecting to User Service"}, 500
+
+def event_error(error, event_id):
+    code = error.code() if isinstance(error, grpc.RpcError) else None
+    if code == grpc.StatusCode.NOT_FOUND:
+        return {"error": f"Event with id {event_id} not found"}, 404
+    if code == grpc.StatusCode.INVALID_ARGUMENT:
+        return {"error": error.details()}, 400
+    return {"error": "Error connecting to Event Service"}, 500
+
+def is_int(value, low):
+    # bool is an int to Python but not to JSON.
+    return isinstance(value, int) and not isinstance(value, bool) and low <= value <= INT32_MAX
+
+def read_booking(data):
+    """Check one booking from a JSON body.
+
+    Returns ``(fields, None)`` with the arguments of create_booking_result,
+    or ``(None, (body, 400))`` saying what is wrong with it.
+    """
+    if not isinstance(data, dict):
+        return None, ({"error": "Expected a JSON object"}, 400)
+    if not all([data.get("user_id"), data.get("event_id"), data.get("number_of_tickets")]):
+        return None, ({"error": "Missing required fields"}, 400)
+    for name in ("user_id", "event_id", "number_of_tickets"):
+        if not is_int(data[name], 1):
+            return None, ({"error": f"{name} must be a positive integer"}, 400)
+    row = data.get("row", 0)
+    if not is_int(row, 0):
+        return None, ({"error": "row must be a non-negative integer"}, 400)
+    contiguous = data.get("contiguous", False)
+    if not isinstance(contiguous, bool):
+        return None, ({"error": "contiguous must be true or false"}, 400)
+    return {
+        "user_id": data["user_id"],
+        "event_id": data["event_id"],
+        "number_of_tickets": data["number_of_tickets"],
+        "contiguous": contiguous,
+        "row": row
+    }, None
+
+def hold_request(hold_id, event_id, number_of_tickets, contiguous=False, row=0, **_):
+    return HoldSeatsRequest(
+        event_id=event_id,
+        number_of_tickets=number_of_tickets,
+        hold_id=hold_id,
+        ttl_seconds=hold_ttl,
+        contiguous=contiguous,
+        row=row
+    )
+
+def not_enough_seats(hold_response):
+    return {
+        "error": "Not enough seats available",
+        "available_seats": hold_response.available_seats
+    }, 400
+
+def created(booking):
+    return {
+        "booking_id": booking.booking_id,
+        "status": booking.status,
+        "message": "Booking created successfully",
+        "created_at": booking.created_at.isoformat() + "Z"
+    }, 201
+
+def insert_bookings(items):
+    session = get_session(engine)
+    try:
+        bookings = [
+            Booking(
+                user_id=item["user_id"],
+                event_id=item["event_id"],
+                number_of_tickets=item["number_of_tickets"],
+                status="confirmed"
+            )
+            for item in items
+        ]
+        session.add_all(bookings)
+        session.commit()
+        # expire_on_commit is off, so the committed booking_id and
+        # created_at are still loaded and no re-read is needed.
+        return bookings
+    finally:
+        session.close()
+
+def discard_bookings(booking_ids):
+    session = get_session(engine)
+    try:
+        session.query(Booking).filter(Booking.booking_id.in_(booking_ids)).delete(
+            synchronize_session=False
+        )
+        session.commit()
+    finally:
+        session.close()
+
+def read_batch(data):
+    """Check a ``POST /api/bookings/batch`` body.
+
+    Returns ``(items, results, None)``: every item read by read_booking
+    (None where it is invalid) and a result list with the invalid items'
+    errors filled in.  A body that is not a batch at all gives
+    ``(None, None, (body, 400))``.
+    """
+    items = data.get("bookings") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, None, ({"error": "Expected a non-empty list of bookings"}, 400)
+    if len(items) > batch_limit:
+        return None, None, ({"error": f"At most {batch_limit} bookings per batch"}, 400)
+    checked = [read_booking(item) for item in items]
+    return [booking for booking, _ in checked], [error for _, error in checked], None
+
+def group_by_event(items, indices=None):
+    by_event = {}
+    for i in range(len(items)) if indices is None else indices:
+        if items[i] is not None:
+            by_event.setdefault(items[i]["event_id"], []).append(i)
+    return by_event
+
+def batch_hold_request(event_id, indices, items, hold_ids):
+    return BatchHoldSeatsRequest(
+        event_id=event_id,
+        ttl_seconds=hold_ttl,
+        holds=[hold_request(hold_ids[i], **items[i]) for i in indices]
+    )
+
+def batch_confirm_request(event_id, indices, hold_ids, bookings):
+    return BatchConfirmHoldsRequest(
+        event_id=event_id,
+        holds=[
+            ConfirmHoldRequest(
+                event_id=event_id,
+                hold_id=hold_ids[i],
+                booking_id=str(bookings[i].booking_id)
+            )
+            for i in indices
+        ]
+    )
+
+def settle_holds(by_event, items, user_calls, hold_calls, results, held, release_hold):
+    """Record what the finished user lookups and holds of a batch mean for each item.
+
+    Successful holds go into ``held`` (item index to hold id); a hold whose
+    user turned out not to exist is released again.
+    """
+    for event_id, indices in by_event.items():
+        hold_call = hold_calls[event_id]
+        if hold_call.exception() is not None:
+            for i in indices:
+                results[i] = event_error(hold_call.exception(), event_id)
+            continue
+        for i, hold in zip(indices, hold_call.result().holds):
+            user_id = items[i]["user_id"]
+            if hold.success:
+                held[i] = hold.hold_id
+            if user_calls[user_id].exception() is not None:
+                results[i] = user_error(user_calls[user_id].exception(), user_id)
+                if hold.success:
+                    release_hold(event_id, held.pop(i))
+            elif not hold.success:
+                results[i] = ({"error": hold.message, "available_seats": hold.available_seats}, 400)
+
+def settle_confirms(confirmations, confirm_calls, bookings, results, held, release_hold):
+    """Record the finished confirms of a batch; returns ``(discarded, failed)``.
+
+    ``discarded`` are the ids of bookings whose confirm was refused and
+    ``failed`` the bookings whose confirm call raised, as in
+    create_booking_result: their hold is given back now, the booking id
+    through the outbox (fail_bookings) once no confirm can land.
+    """
+    discarded = []
+    failed = []
+    for event_id, indices in confirmations.items():
+        confirm_call = confirm_calls[event_id]
+        if confirm_call.exception() is not None:
+            for i in indices:
+                results[i] = ({"error": "Error reserving seats"}, 500)
+                failed.append(bookings[i])
+                release_hold(event_id, held.pop(i))
+            continue
+        for i, confirmation in zip(indices, confirm_call.result().holds):
+            if confirmation.success:
+                del held[i]
+                results[i] = created(bookings[i])
+            else:
+                results[i] = ({"error": confirmation.message}, 400)
+                discarded.append(bookings[i].booking_id)
+                release_hold(event_id, held.pop(i))
+    return discarded, failed
+
+def batch_body(results):
+    return {
+        "results": [dict(body, index=i, code=code) for i, (body, code) in enumerate(results)],
+        "created": sum(1 for _, code in results if code == 201),
+        "failed": sum(1 for _, code in results if code != 201)
+    }, 200
+
+def get_booking_result(booking_id):
+    session = get_session(engine)
+    try:
+        booking = session.get(Booking, booking_id)
+    finally:
+        session.close()
+    if booking is None:
+        return {"error": "Booking not found"}, 404
+    return booking_dict(booking), 200
+
+def cancel_booking_result(booking_id):
+    # The seats are given back by release_worker once this has committed,
+    # so a cancellation never waits on the event service.
+    cancelled = queue_cancellation(engine, booking_id)
+    if cancelled is None:
+        return {"error": "Booking not found"}, 404
+    if cancelled is not True:
+        return {"error": f"Booking already {cancelled}"}, 400
+    release_worker.wake()
+
+    return {
+        "success": True,
+        "message": "Booking cancelled successfully"
+    }, 200
+
+def read_list_query(get):
+    """Check the query of ``GET /api/bookings``; ``get(name)`` returns a parameter or None.
+
+    Returns ``(query, None)``, with the ``filters`` and the ``after`` and
+    ``limit`` of the page, or ``(None, (body, 400))``.  A filter that does
+    not parse is an error rather than no filter at all.
+    """
+    numbers = {}
+    for name in ("user_id", "event_id", "limit"):
+        value = get(name)
+        if not value:
+            continue
+        try:
+            numbers[name] = int(value)
+        except ValueError:
+            return None, ({"error": f"{name} must be an integer"}, 400)
+        if name != "limit" and abs(numbers[name]) > INT32_MAX:
+            return None, ({"error": f"{name} is out of range"}, 400)
+    try:
+        after = parse_cursor(get("cursor"))
+    except InvalidCursor as e:
+        return None, ({"error": str(e)}, 400)
+    return {
+        "filters": {
+            "user_id": numbers.get("user_id"),
+            "event_id": numbers.get("event_id"),
+            "status": get("status"),
+            "descending": get("order") == "desc"
+        },
+        "after": after,
+        "limit": numbers.get("limit", 50)
+    }, None
+
+def list_bookings_result(filters, after, limit):
+    """One page of ``GET /api/bookings``; ``limit`` is clamped to ``page_limit``."""
+    limit = min(max(limit, 1), page_limit)
+    session = get_session(engine)
+    try:
+        # One extra row tells whether there is a next page.
+        page = booking_page(session, after=after, limit=limit + 1, **filters)
+    finally:
+        session.close()
+    next_cursor = str(page[limit - 1].booking_id) if len(page) > limit else None
+    return {
+        "bookings": [booking_dict(booking) for booking in page[:limit]],
+        "next_cursor": next_cursor
+    }, 200
+
+def user_cache_stats():
+    if user_cache is None:
+        return {"enabled": False}, 200
+    return {"enabled": True, **user_cache.stats()}, 200
+
+def seat_release_stats():
+    return release_worker.stats(), 200
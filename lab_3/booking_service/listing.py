@@ -0,0 +1,84 @@
+from sqlalchemy import select
+from models import get_session, Booking
+
+EXPORT_CHUNK = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_cursor(cursor):
+    """Cursors are the id of the last booking already returned."""
+    if not cursor:
+        return None
+    try:
+        return int(cursor)
+    except ValueError:
+        raise InvalidCursor(f"Invalid cursor: {cursor}")
+
+
+def booking_page(session, user_id=None, event_id=None, status=None, after=None,
+                 limit=50, descending=False):
+    """One page of bookings ordered by ``booking_id``, starting past ``after``.
+
+    Keyset pagination: the next page continues from the last id seen rather
+    than an OFFSET, so every page is a range read on an index that ends in
+    ``booking_id`` ((user_id, booking_id), (event_id, booking_id) or
+    (status, booking_id)) however deep into the listing it is.  Rows are
+    plain column tuples, not ORM objects, which keeps large exports cheap.
+    """
+    query = select(*Booking.__table__.columns)
+    if user_id is not None:
+        query = query.where(Booking.user_id == user_id)
+    if event_id is not None:
+        query = query.where(Booking.event_id == event_id)
+    if status:
+        query = query.where(Booking.status == status)
+    if descending:
+        if after is not None:
+            query = query.where(Booking.booking_id < after)
+        query = query.order_by(Booking.booking_id.desc())
+    else:
+        if after is not None:
+            query = query.where(Booking.booking_id > after)
+        query = query.order_by(Booking.booking_id)
+    return session.execute(query.limit(limit)).all()
+
+
+def iter_pages(engine, after=None, limit=None, chunk=EXPORT_CHUNK, **filters):
+    """Yield pages of matching bookings, each page read in its own session.
+
+    Only one page is held at a time and no read transaction stays open
+    between pages, so an export of any size runs in constant memory.
+    """
+    sent = 0
+    while limit is None or sent < limit:
+        size = chunk if limit is None else min(chunk, limit - sent)
+        session = get_session(engine)
+        try:
+            page = booking_page(session, after=after, limit=size, **filters)
+        finally:
+            session.close()
+        if page:
+            yield page
+        sent += len(page)
+        if len(page) < size:
+            return
+        after = page[-1].booking_id
+
+
+def iter_bookings(engine, **kwargs):
+    for page in iter_pages(engine, **kwargs):
+        yield from page
+
+
+def booking_dict(booking):
+    return {
+        "booking_id": booking.booking_id,
+        "user_id": booking.user_id,
+        "event_id": booking.event_id,
+        "status": booking.status,
+        "number_of_tickets": booking.number_of_tickets,
+        "created_at": booking.created_at.isoformat() + "Z"
+    }
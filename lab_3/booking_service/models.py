@@ -1,12 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from common.database import get_engine, get_session
+from common.migrations import migrate, create_index, sqlite_autoincrement
 from datetime import datetime
 
 Base = declarative_base()
 
 class Booking(Base):
     __tablename__ = 'bookings'
+    # Ids are never handed out twice, so a seat release queued or sent for
+    # a booking id can only ever reach the booking it was meant for.
+    __table_args__ = {'sqlite_autoincrement': True}
     
     booking_id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
@@ -15,12 +19,48 @@ class Booking(Base):
     number_of_tickets = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class SeatRelease(Base):
+    """Outbox of seat releases owed to the event service by cancelled bookings.
+
+    A row is written in the same transaction that cancels the booking and
+    deleted once the event service has freed the seats; the booking id is
+    both the key and what the event service releases by, so a row is never
+    queued twice and resending it is harmless.
+    """
+    __tablename__ = 'seat_releases'
+    
+    booking_id = Column(Integer, primary_key=True, autoincrement=False)
+    event_id = Column(Integer, nullable=False)
+    number_of_tickets = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String(200), nullable=True)
+
+ix_bookings_user_id = Index('ix_bookings_user_id', Booking.user_id, Booking.booking_id)
+ix_bookings_event_id = Index('ix_bookings_event_id', Booking.event_id, Booking.booking_id)
+ix_bookings_status = Index('ix_bookings_status', Booking.status, Booking.booking_id)
+ix_seat_releases_due = Index('ix_seat_releases_due', SeatRelease.next_attempt_at, SeatRelease.booking_id)
+
+MIGRATIONS = [
+    (1, 'Index bookings by user and by event', [
+        create_index(ix_bookings_user_id),
+        create_index(ix_bookings_event_id),
+    ]),
+    (2, 'Index bookings by status for keyset listing', [
+        create_index(ix_bookings_status),
+    ]),
+    (3, 'Index queued seat releases by due time', [
+        create_index(ix_seat_releases_due),
+    ]),
+    (4, 'Never reuse booking ids', [
+        sqlite_autoincrement(Booking.__table__),
+    ]),
+]
+
 def init_db():
-    engine = create_engine('sqlite:///bookings.db')
+    engine = get_engine('bookings.db')
     Base.metadata.create_all(engine)
+    migrate(engine, MIGRATIONS)
     return engine
 
-def get_session(engine):
-    Session = sessionmaker(bind=engine)
-    return Session()
-
@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import grpc
+from sqlalchemy import delete, func, select, update
+from event_pb2 import BulkReleaseSeatsRequest
+from models import get_session, Booking, SeatRelease
+
+logger = logging.getLogger(__name__)
+
+def cancel_booking(engine, booking_id):
+    """Cancel a booking and queue the release of its seats, in one transaction.
+
+    Returns None if there is no such booking, True if this call cancelled
+    it and otherwise the status that kept it from being cancelled:
+    ``cancelled``, or ``failed`` for a booking whose seats are already
+    being released.  Of two concurrent cancellations only one changes the
+    status, so seats are queued once.
+    """
+    session = get_session(engine)
+    try:
+        booking = session.get(Booking, booking_id)
+        if booking is None:
+            return None
+        cancelled = session.execute(
+            update(Booking)
+            .where(Booking.booking_id == booking_id, Booking.status == "confirmed")
+            .values(status="cancelled")
+        ).rowcount
+        if not cancelled:
+            session.rollback()
+            return session.get(Booking, booking_id).status
+        session.add(SeatRelease(
+            booking_id=booking_id,
+            event_id=booking.event_id,
+            number_of_tickets=booking.number_of_tickets
+        ))
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def fail_bookings(engine, bookings, release_after):
+    """Mark bookings whose confirm may or may not have landed as failed.
+
+    The rows are kept (their ids, never reused, cannot come to mean another
+    booking) and a release of each is queued for ``release_after`` seconds
+    from now.  With that longer than the hold TTL it goes out once the
+    holds behind them have expired, when a confirm still on its way can no
+    longer succeed, so whichever way it went the seats come back and none
+    stay confirmed to a booking nobody has.
+    """
+    due = datetime.utcnow() + timedelta(seconds=release_after)
+    session = get_session(engine)
+    try:
+        session.execute(
+            update(Booking)
+            .where(Booking.booking_id.in_([booking.booking_id for booking in bookings]))
+            .values(status="failed")
+        )
+        session.add_all([
+            SeatRelease(
+                booking_id=booking.booking_id,
+                event_id=booking.event_id,
+                number_of_tickets=booking.number_of_tickets,
+                next_attempt_at=due
+            )
+            for booking in bookings
+        ])
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+class ReleaseWorker:
+    """Drains the ``seat_releases`` outbox into ``BulkReleaseSeats`` calls.
+
+    A daemon thread wakes when a cancellation is queued, waits ``window``
+    seconds so a burst of them goes out together, and sends every due row,
+    ``batch_size`` at a time with one call per event.  It also polls every
+    ``interval`` seconds, which picks up retries and rows left behind by a
+    process that stopped before sending them.  Released rows are deleted;
+    rows whose call failed are retried after ``retry_delay`` seconds,
+    doubling up to ``max_retry_delay``.  Releases are keyed on the booking
+    id, so sending one twice (after a timeout, or from two processes) frees
+    its seats only once.
+
+    ``stats()`` counts ``failed_groups``, per-event calls that did not
+    release their rows, apart from ``aborted_drains``, rounds cut short by
+    an exception (the database, usually), which are also logged.
+    """
+
+    def __init__(self, engine, event_client, batch_size=500, window=0.01, interval=5.0,
+                 retry_delay=1.0, max_retry_delay=60.0, timeout=None):
+        self.engine = engine
+        self.event_client = event_client
+        self.batch_size = batch_size
+        self.window = window
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.timeout = timeout
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.released = 0
+        self.failed_groups = 0
+        self.aborted_drains = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="seat-releases", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            if self._wake.wait(self.interval):
+                time.sleep(self.window)
+            self._wake.clear()
+            try:
+                while self.drain() >= self.batch_size:
+                    pass
+            except Exception:
+                # The rows are still there for the next round.
+                self.aborted_drains += 1
+                logger.exception("Draining the seat release outbox failed")
+
+    def drain(self):
+        """Send one batch of due releases; returns the number of rows in it."""
+        now = datetime.utcnow()
+        session = get_session(self.engine)
+        try:
+            rows = session.execute(
+                select(SeatRelease.booking_id, SeatRelease.event_id, SeatRelease.attempts)
+                .where(SeatRelease.next_attempt_at <= now)
+                .order_by(SeatRelease.next_attempt_at, SeatRelease.booking_id)
+                .limit(self.batch_size)
+            ).all()
+        finally:
+            session.close()
+        if not rows:
+            return 0
+
+        by_event = {}
+        for row in rows:
+            by_event.setdefault(row.event_id, []).append(row)
+        calls = [
+            (group, self.event_client.BulkReleaseSeats.future(
+                BulkReleaseSeatsRequest(
+                    event_id=event_id,
+                    booking_ids=[str(row.booking_id) for row in group]
+                ),
+                timeout=self.timeout
+            ))
+            for event_id, group in by_event.items()
+        ]
+
+        released = []
+        failed = []
+        for group, call in calls:
+            try:
+                response = call.result()
+            except grpc.RpcError as e:
+                failed.append((group, e.details() or e.code().name))
+                continue
+            if response.success:
+                released.extend(row.booking_id for row in group)
+            else:
+                failed.append((group, response.message))
+
+        session = get_session(self.engine)
+        try:
+            if released:
+                session.execute(delete(SeatRelease).where(SeatRelease.booking_id.in_(released)))
+            for group, error in failed:
+                attempts = min(row.attempts for row in group)
+                delay = min(self.retry_delay * 2 ** attempts, self.max_retry_delay)
+                session.execute(
+                    update(SeatRelease)
+                    .where(SeatRelease.booking_id.in_([row.booking_id for row in group]))
+                    .values(
+                        attempts=SeatRelease.attempts + 1,
+                        next_attempt_at=now + timedelta(seconds=delay),
+                        last_error=error[:200]
+                    )
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        self.batches += 1
+        self.released += len(released)
+        self.failed_groups += len(failed)
+        return len(rows)
+
+    def stats(self):
+        session = get_session(self.engine)
+        try:
+            pending = session.execute(select(func.count()).select_from(SeatRelease)).scalar()
+        finally:
+            session.close()
+        return {
+            "pending": pending,
+            "batches": self.batches,
+            "released": self.released,
+            "failed_groups": self.failed_groups,
+            "aborted_drains": self.aborted_drains,
+        }
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from user_pb2 import BatchGetUsersRequest
+
+
+class UserNotFound(Exception):
+    def __init__(self, user_id):
+        super().__init__(f"User with id {user_id} not found")
+        self.user_id = user_id
+
+
+class InvalidUserId(ValueError):
+    def __init__(self, user_id):
+        super().__init__(f"Invalid user id: {user_id!r}")
+        self.user_id = user_id
+
+
+INT32_MAX = 2 ** 31 - 1
+
+
+def valid_user_id(user_id):
+    # One id BatchGetUsersRequest cannot hold would fail the whole batch.
+    return isinstance(user_id, int) and not isinstance(user_id, bool) and 0 < user_id <= INT32_MAX
+
+
+class UserLoader:
+    """Coalesces concurrent user lookups into ``BatchGetUsers`` calls.
+
+    ``load()`` returns a future right away.  A dispatcher thread collects
+    the ids requested by all request threads for up to ``window`` seconds
+    (or until ``max_batch`` distinct ids are waiting) and fetches them with
+    one RPC; repeated ids share a single slot in the batch.  With a
+    ``cache``, known users are answered without any RPC at all.  An id that
+    is not a positive 32-bit integer fails its own lookup with
+    ``InvalidUserId`` and never joins a batch.  A future cancelled while it
+    waits is dropped when its batch comes back.
+    """
+
+    def __init__(self, client, window=0.002, max_batch=100, timeout=None, cache=None):
+        self.client = client
+        self.cache = cache
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._dispatcher = None
+
+    def load(self, user_id):
+        future = Future()
+        if not valid_user_id(user_id):
+            future.set_exception(InvalidUserId(user_id))
+            return future
+        if self.cache is not None:
+            user = self.cache.get(user_id)
+            if user is not None:
+                future.set_result(user)
+                return future
+        with self._cond:
+            waiting = self._pending.setdefault(user_id, [])
+            waiting.append(future)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch, name="user-loader", daemon=True
+                )
+                self._dispatcher.start()
+        return future
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, {}
+            self._send(batch)
+
+    def _send(self, batch):
+        try:
+            call = self.client.BatchGetUsers.future(
+                BatchGetUsersRequest(user_ids=list(batch)), timeout=self.timeout
+            )
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        call.add_done_callback(lambda call: self._resolve(batch, call))
+
+    def _resolve(self, batch, call):
+        error = call.exception()
+        if error is not None:
+            self._fail(batch, error)
+            return
+
+        users = {user.user_id: user for user in call.result().users}
+        if self.cache is not None:
+            for user in users.values():
+                self.cache.put(user.user_id, user, user.version)
+        for user_id, futures in batch.items():
+            user = users.get(user_id)
+            for future in futures:
+                # A caller that gave up cancelled its future while it waited.
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if user is None:
+                    future.set_exception(UserNotFound(user_id))
+                else:
+                    future.set_result(user)
+
+    def _fail(self, batch, error):
+        for futures in batch.values():
+            for future in futures:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+
+
+class AsyncUserLoader:
+    """``UserLoader`` for asyncio and ``grpc.aio`` stubs.
+
+    Same batching rules, but the window is a timer on the event loop and
+    every waiting lookup is an asyncio future rather than a thread.
+    """
+
+    def __init__(self, client, window=0.002, max_batch=100, timeout=None, cache=None):
+        self.client = client
+        self.cache = cache
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._pending = {}
+        self._timer = None
+        self._sending = set()
+
+    def load(self, user_id):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not valid_user_id(user_id):
+            future.set_exception(InvalidUserId(user_id))
+            return future
+        if self.cache is not None:
+            user = self.cache.get(user_id)
+            if user is not None:
+                future.set_result(user)
+                return future
+        self._pending.setdefault(user_id, []).append(future)
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch):
+        try:
+            response = await self.client.BatchGetUsers(
+                BatchGetUsersRequest(user_ids=list(batch)), timeout=self.timeout
+            )
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        users = {user.user_id: user for user in response.users}
+        if self.cache is not None:
+            for user in users.values():
+                self.cache.put(user.user_id, user, user.version)
+        for user_id, futures in batch.items():
+            user = users.get(user_id)
+            for future in futures:
+                if future.done():
+                    continue
+                if user is None:
+                    future.set_exception(UserNotFound(user_id))
+                else:
+                    future.set_result(user)
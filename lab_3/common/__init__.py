@@ -0,0 +1,5 @@
+"""Modules shared by the lab_3 services.
+
+metrics.py and server.py are also used by lab1, which keeps copies in
+lab1/common; run ``python tools/sync_common.py`` after changing them.
+"""
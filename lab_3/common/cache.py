@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire ``ttl`` seconds after they are stored.
+
+    Every entry carries a version stamp; ``put`` never replaces an entry with
+    an older version, so a slow response cannot overwrite a fresher one.
+    ``invalidate`` with a version leaves an empty entry at that version behind,
+    so a value read before the change cannot be stored after it.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, version, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=0):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > version:
+                return
+            self._entries[key] = (value, version, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key, version=None):
+        """Drop ``key``; with a ``version``, also refuse older values for it until the ttl runs out."""
+        with self._lock:
+            if version is None:
+                self._entries.pop(key, None)
+                return
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > version:
+                version = entry[1]
+            self._entries[key] = (None, version, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
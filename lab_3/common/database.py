@@ -0,0 +1,84 @@
+import os
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+from common.metrics import instrument_engine
+
+_engines = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        # WAL lets readers run alongside the single writer instead of queueing
+        # behind it; NORMAL only fsyncs the WAL at checkpoints.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+        cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def get_engine(default_sqlite_path):
+    """Return the process-wide engine for a service database.
+
+    ``DATABASE_URL`` points the service at a server database instead of the
+    default SQLite file.  The pool is sized to the worker pool through
+    ``DB_POOL_SIZE`` / ``DB_MAX_OVERFLOW``.  Its statements and commits are
+    timed into the ``sql_query_duration_seconds`` histogram.
+    """
+    url = os.getenv("DATABASE_URL", f"sqlite:///{default_sqlite_path}")
+    with _lock:
+        engine = _engines.get(url)
+        if engine is not None:
+            return engine
+
+        options = {}
+        in_memory = url in ("sqlite://", "sqlite:///:memory:")
+        if not in_memory:
+            options["pool_size"] = int(os.getenv("DB_POOL_SIZE", "10"))
+            options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+        if url.startswith("sqlite"):
+            options["connect_args"] = {"check_same_thread": False}
+        else:
+            options["pool_pre_ping"] = True
+
+        engine = create_engine(url, **options)
+        if url.startswith("sqlite"):
+            event.listen(engine, "connect", _sqlite_pragmas)
+        instrument_engine(engine)
+        _engines[url] = engine
+        return engine
+
+
+def _reset_after_fork():
+    # A forked worker process must not use connections pooled by its parent;
+    # drop them (leaving them open for the parent) so each pool starts empty.
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _sessions.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_session(engine):
+    """Return the calling thread's session for ``engine``.
+
+    Sessions come from one thread-scoped registry per engine, so repeated
+    calls on a worker thread reuse the same session object; ``close()``
+    hands its connection back to the pool.  Objects stay readable after
+    ``commit()`` without a reload.
+    """
+    registry = _sessions.get(engine)
+    if registry is None:
+        with _lock:
+            registry = _sessions.get(engine)
+            if registry is None:
+                registry = _sessions[engine] = scoped_session(
+                    sessionmaker(bind=engine, expire_on_commit=False)
+                )
+    return registry()
@@ -0,0 +1,447 @@
+"""Latency histograms and counters in the Prometheus text format.
+
+Every process keeps its own series; ``render()`` returns them for a
+``/metrics`` endpoint.  gRPC services get one from ``serve_http`` (see
+``METRICS_PORT`` in common/server.py), the HTTP apps from
+``instrument_flask`` or their own route.
+
+Recording is a bisect over the bucket bounds and a dict lookup under a
+lock, around a microsecond per observation, so the interceptors and hooks
+below stay on for every call.
+"""
+import os
+import re
+import threading
+from bisect import bisect_left
+from time import perf_counter
+import grpc
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from half a millisecond (a cached lookup, a point SELECT) up to
+# the RPC deadlines.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = [(values, self._copy(data)) for values, data in self._series.items()]
+        for values, data in sorted(series):
+            lines.extend(self._samples(values, data))
+        return lines
+
+    def _copy(self, data):
+        return data
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def _samples(self, values, total):
+        yield f"{self.name}{_format_labels(self.labels, values)} {total}"
+
+
+class Histogram(_Metric):
+    """Per label set: a count per bucket (not cumulative until rendered) and the sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, seconds):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts = self._series.get(labels)
+            if counts is None:
+                # One slot per bound, one for +Inf, then the sum.
+                counts = self._series[labels] = [0] * (len(self.buckets) + 2)
+            counts[i] += 1
+            counts[-1] += seconds
+
+    def _copy(self, counts):
+        return list(counts)
+
+    def _samples(self, values, counts):
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            total += count
+            le = _format_labels(self.labels, values, f'le="{bound}"')
+            yield f"{self.name}_bucket{le} {total}"
+        labels = _format_labels(self.labels, values)
+        yield f"{self.name}_sum{labels} {counts[-1]}"
+        yield f"{self.name}_count{labels} {total}"
+
+
+class Collected(_Metric):
+    """Series read when rendered, from functions returning ``{label values: value}``.
+
+    For numbers that something else keeps anyway, such as a cache's hit
+    count, so nothing extra happens on the path that updates them.
+    """
+
+    def __init__(self, name, help, labels, kind):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self._sources = []
+
+    def reset(self):
+        # The sources live on in a forked worker, and report its own state.
+        self._lock = threading.Lock()
+
+    def add(self, collect):
+        with self._lock:
+            self._sources.append(collect)
+
+    def render(self):
+        with self._lock:
+            sources = list(self._sources)
+        series = {}
+        for collect in sources:
+            series.update(collect())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(series.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+def histogram(name, help, labels=(), buckets=BUCKETS):
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+
+def counter(name, help, labels=()):
+    return _register(Counter, name, help, labels)
+
+
+def collected(name, help, labels=(), kind="gauge"):
+    return _register(Collected, name, help, labels, kind)
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _reset_after_fork():
+    # A forked worker reports its own calls only, not what its parent had
+    # recorded before the fork (schema setup, seeding).
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for metric in _registry.values():
+        metric.reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+RPC_SERVER = histogram(
+    "grpc_server_handling_seconds", "Time spent handling gRPC calls.",
+    ("grpc_service", "grpc_method", "grpc_code")
+)
+RPC_CLIENT = histogram(
+    "grpc_client_handling_seconds", "Time until gRPC calls made by this process completed.",
+    ("grpc_service", "grpc_method", "grpc_code")
+)
+HTTP_REQUESTS = histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests.",
+    ("method", "route", "status")
+)
+SQL_QUERIES = histogram(
+    "sql_query_duration_seconds", "Time spent executing SQL statements and commits.",
+    ("operation", "table")
+)
+SQL_ERRORS = counter(
+    "sql_errors_total", "SQL statements that raised.", ("operation", "table")
+)
+CACHE_EVENTS = collected(
+    "cache_events_total", "Hits, misses, evictions and expirations of in-process caches.",
+    ("cache", "event"), kind="counter"
+)
+CACHE_ENTRIES = collected("cache_entries", "Entries held by in-process caches.", ("cache",))
+
+_rpc_labels = {}
+
+
+def _method_labels(method):
+    labels = _rpc_labels.get(method)
+    if labels is None:
+        name = method.decode() if isinstance(method, bytes) else method
+        service, _, rpc = name.lstrip("/").rpartition("/")
+        labels = _rpc_labels[method] = (service, rpc)
+    return labels
+
+
+def _code_name(code):
+    return code.name if code is not None else "OK"
+
+
+class ServerInterceptor(grpc.ServerInterceptor):
+    """Times every call a gRPC server handles, by method and status code.
+
+    Streaming responses are timed until the stream ends.  A handler that
+    raises without setting a code counts as UNKNOWN, the code gRPC sends.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        method = handler_call_details.method
+        cached = self._handlers.get(method)
+        if cached is not None and cached[0] is handler:
+            return cached[1]
+        wrapped = self._wrap(_method_labels(method), handler)
+        self._handlers[method] = (handler, wrapped)
+        return wrapped
+
+    def _wrap(self, labels, handler):
+        if handler.request_streaming and handler.response_streaming:
+            behavior, factory = handler.stream_stream, grpc.stream_stream_rpc_method_handler
+        elif handler.request_streaming:
+            behavior, factory = handler.stream_unary, grpc.stream_unary_rpc_method_handler
+        elif handler.response_streaming:
+            behavior, factory = handler.unary_stream, grpc.unary_stream_rpc_method_handler
+        else:
+            behavior, factory = handler.unary_unary, grpc.unary_unary_rpc_method_handler
+
+        if handler.response_streaming:
+            def timed(request, context):
+                started = perf_counter()
+                code = "UNKNOWN"
+                try:
+                    yield from behavior(request, context)
+                    # Handlers stop early once the client has gone away.
+                    code = _code_name(context.code()) if context.is_active() else "CANCELLED"
+                except GeneratorExit:
+                    code = "CANCELLED"
+                    raise
+                except Exception:
+                    if context.code() is not None:
+                        code = context.code().name
+                    raise
+                finally:
+                    RPC_SERVER.observe(labels + (code,), perf_counter() - started)
+        else:
+            def timed(request, context):
+                started = perf_counter()
+                try:
+                    response = behavior(request, context)
+                except Exception:
+                    code = context.code()
+                    RPC_SERVER.observe(
+                        labels + (code.name if code is not None else "UNKNOWN",),
+                        perf_counter() - started
+                    )
+                    raise
+                RPC_SERVER.observe(labels + (_code_name(context.code()),), perf_counter() - started)
+                return response
+
+        return factory(
+            timed,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+
+class ClientInterceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+    """Times the calls made through a channel, blocking or ``.future()``:
+    ``grpc.intercept_channel(channel, ClientInterceptor())``."""
+
+    def _timed(self, continuation, client_call_details, request):
+        labels = _method_labels(client_call_details.method)
+        started = perf_counter()
+        call = continuation(client_call_details, request)
+        call.add_done_callback(
+            lambda done: RPC_CLIENT.observe(labels + (_code_name(done.code()),), perf_counter() - started)
+        )
+        return call
+
+    def intercept_unary_unary(self, continuation, client_call_details, request):
+        return self._timed(continuation, client_call_details, request)
+
+    def intercept_unary_stream(self, continuation, client_call_details, request):
+        return self._timed(continuation, client_call_details, request)
+
+
+class AsyncClientInterceptor(grpc.aio.UnaryUnaryClientInterceptor):
+    """``ClientInterceptor`` for ``grpc.aio`` channels (``interceptors=[...]``)."""
+
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        labels = _method_labels(client_call_details.method)
+        started = perf_counter()
+        call = await continuation(client_call_details, request)
+        # Waiting here rather than in a done callback, where the aio call's
+        # code() could not be awaited; the caller gets the finished call.
+        try:
+            await call
+            code = "OK"
+        except grpc.RpcError as e:
+            code = e.code().name
+        except BaseException:
+            RPC_CLIENT.observe(labels + ("CANCELLED",), perf_counter() - started)
+            raise
+        RPC_CLIENT.observe(labels + (code,), perf_counter() - started)
+        return call
+
+
+_VERB = re.compile(r"\s*(\w+)")
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+[\"`]?(\w+)", re.IGNORECASE)
+_statements = {}
+
+
+def _statement_labels(statement):
+    labels = _statements.get(statement)
+    if labels is None:
+        verb = _VERB.match(statement)
+        table = _TABLE.search(statement)
+        labels = (
+            verb.group(1).upper() if verb else "",
+            table.group(1) if table else ""
+        )
+        # Expanded IN lists make new statement strings; stop remembering
+        # them rather than grow without bound.
+        if len(_statements) < 10000:
+            _statements[statement] = labels
+    return labels
+
+
+def instrument_engine(engine):
+    """Time every statement and commit run through a SQLAlchemy engine,
+    labelled by operation and (first) table."""
+    from sqlalchemy import event
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started"] = perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        SQL_QUERIES.observe(_statement_labels(statement), perf_counter() - conn.info["metrics_started"])
+
+    def handle_error(context):
+        if context.statement is not None:
+            SQL_ERRORS.inc(_statement_labels(context.statement))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+    # There is no event after a commit, and with SQLite the commit (the WAL
+    # write) is where a write transaction spends its time.
+    do_commit = engine.dialect.do_commit
+
+    def timed_commit(dbapi_connection):
+        started = perf_counter()
+        try:
+            do_commit(dbapi_connection)
+        finally:
+            SQL_QUERIES.observe(("COMMIT", ""), perf_counter() - started)
+
+    engine.dialect.do_commit = timed_commit
+
+
+def instrument_cache(cache, name):
+    """Report a ``TTLCache``'s counters and size, labelled ``cache=name``."""
+    def events():
+        stats = cache.stats()
+        return {
+            (name, event): stats[event]
+            for event in ("hits", "misses", "evictions", "expirations")
+        }
+
+    CACHE_EVENTS.add(events)
+    CACHE_ENTRIES.add(lambda: {(name,): cache.stats()["size"]})
+
+
+def instrument_flask(app):
+    """Time every request of a Flask app by route and status, and serve ``/metrics``."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            HTTP_REQUESTS.observe(
+                (request.method, route, str(response.status_code)), perf_counter() - started
+            )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE)
+
+
+def serve_http(port, host=""):
+    """Serve ``/metrics`` on ``port`` from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,91 @@
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def create_index(index):
+    """Migration step creating an index declared on a model, if it is missing."""
+    def step(connection):
+        index.create(connection, checkfirst=True)
+    return step
+
+
+def add_column(table, column_ddl):
+    """Migration step adding a column to a table created before the column existed."""
+    name = column_ddl.split()[0]
+
+    def step(connection):
+        columns = {c['name'] for c in inspect(connection).get_columns(table)}
+        if name not in columns:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column_ddl}'))
+    return step
+
+
+def sqlite_autoincrement(table):
+    """Migration step rebuilding a SQLite table created without AUTOINCREMENT.
+
+    SQLite cannot add it in place, so the table is renamed, created again
+    from its model (indexes included) and its rows copied across.  Other
+    databases never hand out an id twice anyway and are left alone.
+    """
+    def step(connection):
+        if connection.dialect.name != 'sqlite':
+            return
+        ddl = connection.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': table.name}
+        ).scalar()
+        if ddl is None or 'AUTOINCREMENT' in ddl.upper():
+            return
+        for index in table.indexes:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        connection.execute(text(f'ALTER TABLE {table.name} RENAME TO {table.name}_old'))
+        table.create(connection)
+        columns = ', '.join(column.name for column in table.columns)
+        connection.execute(text(
+            f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old'
+        ))
+        connection.execute(text(f'DROP TABLE {table.name}_old'))
+    return step
+
+
+def migrate(engine, migrations):
+    """Apply the ``(version, description, steps)`` migrations not yet recorded.
+
+    ``Base.metadata.create_all`` still creates missing tables with their
+    current shape, so every step has to be a no-op on a fresh database;
+    ``create_index``, ``add_column`` and ``sqlite_autoincrement`` all check
+    before they change anything.  Each version runs in its own transaction and is recorded in
+    ``schema_migrations``.
+    """
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+    for version, description, steps in sorted(migrations, key=lambda m: m[0]):
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as connection:
+                for step in steps:
+                    if isinstance(step, str):
+                        connection.execute(text(step))
+                    else:
+                        step(connection)
+                connection.execute(schema_migrations.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another worker process applied the same version first.
+            pass
@@ -0,0 +1,87 @@
+import bisect
+import hashlib
+
+
+def parse_shards(value):
+    """``name=host:port,...`` -> ``[(name, address), ...]``.
+
+    The name is what gets hashed, so every process must use the same names
+    for the same shards; it defaults to the address when left out.
+    """
+    shards = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, address = item.rpartition("=")
+        shards.append((name or address, address))
+    return shards
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of keys (event ids) onto named shards.
+
+    Every shard sits on the ring at ``replicas`` points and a key belongs to
+    the first point at or after its hash.  Adding a shard only takes over the
+    keys that now land on its points, about 1/N of them, all of which come
+    from the shards already there; nothing moves between the old shards.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one shard")
+        self.nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key):
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+
+class _RoutedMethod:
+    def __init__(self, router, name):
+        self.router = router
+        self.name = name
+
+    def _target(self, request):
+        return getattr(self.router.stub_for(request.event_id), self.name)
+
+    def __call__(self, request, *args, **kwargs):
+        return self._target(request)(request, *args, **kwargs)
+
+    def future(self, request, *args, **kwargs):
+        return self._target(request).future(request, *args, **kwargs)
+
+
+class ShardRouter:
+    """Drop-in for a service stub that calls the shard owning each request.
+
+    ``router.HoldSeats(request)`` and ``router.HoldSeats.future(request)``
+    hash ``request.event_id`` onto the ring and make the call on that
+    shard's stub, so it works for every RPC whose request carries the event
+    id.  ``channel_factory`` opens a channel per shard address, which makes
+    the same router usable with ``grpc.aio`` channels.
+    """
+
+    def __init__(self, stub_class, shards, channel_factory):
+        self.ring = HashRing([name for name, _ in shards])
+        self.channels = {name: channel_factory(address) for name, address in shards}
+        self.stubs = {name: stub_class(channel) for name, channel in self.channels.items()}
+
+    def stub_for(self, event_id):
+        return self.stubs[self.ring.node_for(event_id)]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = _RoutedMethod(self, name)
+        setattr(self, name, method)
+        return method
@@ -0,0 +1,103 @@
+import threading
+import time
+
+
+class _Pending:
+    __slots__ = ("count", "booking_id", "expires_at", "done", "seat_numbers", "error")
+
+    def __init__(self, count, booking_id, expires_at):
+        self.count = count
+        self.booking_id = booking_id
+        self.expires_at = expires_at
+        self.done = False
+        self.seat_numbers = None
+        self.error = None
+
+
+class _EventQueue:
+    __slots__ = ("cond", "pending", "leader")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = []
+        self.leader = False
+
+
+class ReservationBatcher:
+    """Group commit for ``ReserveSeats``.
+
+    Concurrent reservations for the same event queue up behind whichever
+    caller is currently writing.  When that write finishes, the next caller
+    becomes the leader, takes up to ``max_batch`` queued requests (waiting at
+    most ``window`` seconds for more to arrive) and allocates them all in a
+    single inventory transaction; every other caller just waits for its own
+    result.  With ``window=0`` a lone request pays no extra latency and
+    batches form only while a commit is in flight.
+    """
+
+    def __init__(self, inventory, max_batch=64, window=0.0):
+        self.inventory = inventory
+        self.max_batch = max_batch
+        self.window = window
+        self._queues = {}
+        self._guard = threading.Lock()
+
+    def _queue(self, event_id):
+        with self._guard:
+            queue = self._queues.get(event_id)
+            if queue is None:
+                queue = self._queues[event_id] = _EventQueue()
+            return queue
+
+    def reserve(self, event_id, count, booking_id, expires_at=None):
+        queue = self._queue(event_id)
+        pending = _Pending(count, booking_id, expires_at)
+        with queue.cond:
+            queue.pending.append(pending)
+            if len(queue.pending) >= self.max_batch:
+                queue.cond.notify_all()
+
+        while True:
+            with queue.cond:
+                while not pending.done and queue.leader:
+                    queue.cond.wait()
+                if pending.done:
+                    break
+                queue.leader = True
+                batch = self._collect(queue)
+            try:
+                self._commit(event_id, batch)
+            finally:
+                with queue.cond:
+                    queue.leader = False
+                    queue.cond.notify_all()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.seat_numbers
+
+    def _collect(self, queue):
+        deadline = time.monotonic() + self.window
+        while len(queue.pending) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            queue.cond.wait(remaining)
+        batch = queue.pending[:self.max_batch]
+        del queue.pending[:self.max_batch]
+        return batch
+
+    def _commit(self, event_id, batch):
+        try:
+            results = self.inventory.reserve_many(
+                event_id, [(p.count, p.booking_id, p.expires_at) for p in batch]
+            )
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for pending, result in zip(batch, results):
+            if isinstance(result, Exception):
+                pending.error = result
+            else:
+                pending.seat_numbers = result
+            pending.done = True
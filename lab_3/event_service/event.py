@@ -1,161 +1,571 @@
-from concurrent import futures
+from datetime import datetime, timedelta
+import functools
+import itertools
+import json
+import logging
 import grpc
 import os
+import threading
+import time
+import uuid
+from sqlalchemy.exc import IntegrityError
 from event_pb2 import (
     CheckAvailabilityRequest, CheckAvailabilityResponse, EventInfo,
     ReserveSeatsRequest, ReserveSeatsResponse,
-    ReleaseSeatsRequest, ReleaseSeatsResponse
+    ReleaseSeatsRequest, ReleaseSeatsResponse,
+    HoldSeatsRequest, HoldSeatsResponse,
+    ConfirmHoldRequest, ConfirmHoldResponse,
+    BatchHoldSeatsRequest, BatchHoldSeatsResponse,
+    BatchConfirmHoldsRequest, BatchConfirmHoldsResponse,
+    BulkReleaseSeatsRequest, BulkReleaseSeatsResponse,
+    WatchAvailabilityRequest, AvailabilityUpdate,
+    CreateEventRequest, CreateEventResponse, SeatMapChunk,
+    EventRows, MoveEventResponse
 )
 import event_pb2_grpc
-from models import init_db, get_session, Event, Seat
+from models import init_db, get_session, Event, SeatRow
+from inventory import create_inventory, NotEnoughSeats, PROVISION_BATCH
+from batching import ReservationBatcher
+from watch import AvailabilityHub
+from transfer import MoveGate, EventMoving, export_rows, import_rows, delete_event
+from common.server import serve as run_service
+from common.sharding import HashRing, parse_shards
+
+logger = logging.getLogger(__name__)
+
+# Every WatchAvailability stream keeps a server thread for as long as it is
+# open.  The server gets this many threads on top of GRPC_THREADS and refuses
+# watchers past it, so streams never take the threads unary calls run on.
+MAX_WATCHERS = int(os.getenv("MAX_WATCHERS", "100"))
+
+def mutates_event(handler):
+    """Run an RPC that changes ``request.event_id``'s seats inside its move gate
+    and the watch hub's write gate."""
+    @functools.wraps(handler)
+    def wrapper(self, request, context):
+        try:
+            with self.moves.enter(request.event_id), self.watch_hub.writing(request.event_id):
+                return handler(self, request, context)
+        except EventMoving as e:
+            context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+    return wrapper
 
 class EventService(event_pb2_grpc.EventServiceServicer):
     def __init__(self):
         self.engine = init_db()
-        self._init_sample_data()
+        self.inventory = create_inventory(self.engine, os.getenv("INVENTORY_BACKEND", "sql"))
+        batch_size = int(os.getenv("RESERVATION_BATCH_SIZE", "64"))
+        if batch_size > 1:
+            batch_window = float(os.getenv("RESERVATION_BATCH_WINDOW_MS", "0")) / 1000
+            self.reservations = ReservationBatcher(self.inventory, batch_size, batch_window)
+        else:
+            self.reservations = self.inventory
+        self.watch_hub = AvailabilityHub(
+            self.inventory, float(os.getenv("WATCH_RESYNC_SECONDS", "5"))
+        )
+        self.watchers = threading.BoundedSemaphore(MAX_WATCHERS)
+        # Only used when a hold does not ask for a TTL; booking_service
+        # always asks for its own HOLD_TTL_SECONDS, with the same default.
+        self.hold_ttl = int(os.getenv("HOLD_TTL_SECONDS", "60"))
+        self.hold_sweep_interval = float(os.getenv("HOLD_SWEEP_INTERVAL", "5"))
+        # With EVENT_SHARDS set this process is the shard EVENT_SHARD of that
+        # ring and only creates the events that hash to it.  A shard added to
+        # a ring that already has events (EVENT_SHARD_JOINING=1) starts
+        # empty and gets its events from rebalance.py.
+        shards = parse_shards(os.getenv("EVENT_SHARDS"))
+        self.ring = HashRing([name for name, _ in shards]) if shards else None
+        self.shard = os.getenv("EVENT_SHARD")
+        if self.ring is not None and self.shard not in self.ring.nodes:
+            raise ValueError(f"EVENT_SHARD must be one of {', '.join(self.ring.nodes)}")
+        self.moves = MoveGate()
+        self.move_drain_timeout = float(os.getenv("MOVE_DRAIN_SECONDS", "10"))
+        if os.getenv("EVENT_SHARD_JOINING", "0") != "1":
+            self._init_sample_data()
+        threading.Thread(target=self._sweep_holds, name="hold-sweeper", daemon=True).start()
+    
+    def _sweep_holds(self):
+        while True:
+            time.sleep(self.hold_sweep_interval)
+            try:
+                with self.watch_hub.writing():
+                    released = self.inventory.release_expired()
+                    for event_id, count in released.items():
+                        self.watch_hub.publish(event_id, count)
+            except Exception:
+                logger.exception("Error releasing expired holds")
     
     def _init_sample_data(self):
         session = get_session(self.engine)
         try:
             if session.query(Event).count() == 0:
-                event1 = Event(
+                events = [Event(
                     event_id=101,
                     name="Концерт симфонического оркестра",
                     date="2024-02-20T19:00:00Z",
                     venue="Концертный зал",
                     ticket_price=2500.0,
-                    total_seats=100
-                )
-                event2 = Event(
+                    total_seats=100,
+                    row_length=10
+                ), Event(
                     event_id=102,
                     name="Театральная постановка 'Гамлет'",
                     date="2024-02-25T18:00:00Z",
                     venue="Драматический театр",
                     ticket_price=1800.0,
-                    total_seats=150
-                )
-                session.add(event1)
-                session.add(event2)
+                    total_seats=150,
+                    row_length=15
+                )]
+                events = [event for event in events if self.owns(event.event_id)]
+                session.add_all(events)
                 session.commit()
                 
-                for i in range(1, 101):
-                    seat = Seat(event_id=101, seat_number=i, is_reserved=False)
-                    session.add(seat)
-                
-                for i in range(1, 151):
-                    seat = Seat(event_id=102, seat_number=i, is_reserved=False)
-                    session.add(seat)
-                
+                for event in events:
+                    self.inventory.provision(session, event.event_id, event.total_seats)
                 session.commit()
         finally:
             session.close()
     
+    def owns(self, event_id):
+        return self.ring is None or self.ring.node_for(event_id) == self.shard
+    
+    def _check_owner(self, event_id, context):
+        if self.ring is None:
+            return
+        if not event_id:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "event_id is required on a sharded event service")
+        if not self.owns(event_id):
+            context.abort(
+                grpc.StatusCode.FAILED_PRECONDITION,
+                f"Event {event_id} belongs to shard {self.ring.node_for(event_id)}"
+            )
+    
+    def _get_event(self, event_id, context):
+        session = get_session(self.engine)
+        try:
+            event = session.query(Event).filter(Event.event_id == event_id).first()
+        finally:
+            session.close()
+        
+        if event is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Event with id {event_id} not found")
+        return event
+    
     def CheckAvailability(self, request, context):
+        event = self._get_event(request.event_id, context)
+        available_seats = self.inventory.available(request.event_id)
+        available = available_seats >= request.number_of_tickets
+        
+        event_info = EventInfo(
+            event_id=event.event_id,
+            name=event.name,
+            date=event.date,
+            venue=event.venue,
+            ticket_price=event.ticket_price
+        )
+        
+        return CheckAvailabilityResponse(
+            available=available,
+            available_seats=available_seats,
+            event=event_info
+        )
+    
+    def _reserve(self, request, booking_id, expires_at=None):
+        if request.contiguous:
+            return self.inventory.reserve_block(
+                request.event_id, request.number_of_tickets, booking_id, expires_at, request.row
+            )
+        return self.reservations.reserve(
+            request.event_id, request.number_of_tickets, booking_id, expires_at
+        )
+    
+    @mutates_event
+    def ReserveSeats(self, request, context):
+        self._get_event(request.event_id, context)
+        try:
+            seat_numbers = self._reserve(request, request.booking_id)
+        except NotEnoughSeats as e:
+            return ReserveSeatsResponse(success=False, message=str(e))
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error reserving seats: {str(e)}")
+        
+        self.watch_hub.publish(request.event_id, -len(seat_numbers))
+        return ReserveSeatsResponse(
+            success=True,
+            message="Seats reserved successfully",
+            seat_numbers=seat_numbers
+        )
+    
+    @mutates_event
+    def ReleaseSeats(self, request, context):
+        try:
+            released = self.inventory.release(request.event_id, request.booking_id)
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error releasing seats: {str(e)}")
+        
+        self.watch_hub.publish(request.event_id, released)
+        if not released:
+            return ReleaseSeatsResponse(
+                success=False,
+                message=f"No seats found for booking {request.booking_id}"
+            )
+        
+        return ReleaseSeatsResponse(
+            success=True,
+            message="Seats released successfully"
+        )
+    
+    @mutates_event
+    def HoldSeats(self, request, context):
+        self._get_event(request.event_id, context)
+        hold_id = request.hold_id or uuid.uuid4().hex
+        expires_at = datetime.utcnow() + timedelta(seconds=request.ttl_seconds or self.hold_ttl)
+        try:
+            seat_numbers = self._reserve(request, hold_id, expires_at)
+        except NotEnoughSeats as e:
+            return HoldSeatsResponse(
+                success=False,
+                message=str(e),
+                hold_id=hold_id,
+                available_seats=e.available
+            )
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error holding seats: {str(e)}")
+        
+        self.watch_hub.publish(request.event_id, -len(seat_numbers))
+        return HoldSeatsResponse(
+            success=True,
+            message="Seats held successfully",
+            hold_id=hold_id,
+            seat_numbers=seat_numbers,
+            expires_at=expires_at.isoformat() + "Z"
+        )
+    
+    @mutates_event
+    def ConfirmHold(self, request, context):
+        try:
+            confirmed = self.inventory.confirm(request.event_id, request.hold_id, request.booking_id)
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error confirming hold: {str(e)}")
+        
+        return self._confirm_response(request.hold_id, confirmed)
+    
+    def _confirm_response(self, hold_id, confirmed):
+        if not confirmed:
+            return ConfirmHoldResponse(
+                success=False,
+                message=f"Hold {hold_id} not found or expired"
+            )
+        
+        return ConfirmHoldResponse(
+            success=True,
+            message="Hold confirmed successfully"
+        )
+    
+    @mutates_event
+    def BatchHoldSeats(self, request, context):
+        # Plain holds are allocated together in one inventory transaction;
+        # contiguous ones need their own block search each.
+        self._get_event(request.event_id, context)
+        expires_at = datetime.utcnow() + timedelta(seconds=request.ttl_seconds or self.hold_ttl)
+        hold_ids = [item.hold_id or uuid.uuid4().hex for item in request.holds]
+        results = [None] * len(hold_ids)
+        plain = [i for i, item in enumerate(request.holds) if not item.contiguous]
+        try:
+            if plain:
+                reserved = self.inventory.reserve_many(request.event_id, [
+                    (request.holds[i].number_of_tickets, hold_ids[i], expires_at) for i in plain
+                ])
+                for i, result in zip(plain, reserved):
+                    results[i] = result
+            for i, item in enumerate(request.holds):
+                if not item.contiguous:
+                    continue
+                try:
+                    results[i] = self.inventory.reserve_block(
+                        request.event_id, item.number_of_tickets, hold_ids[i], expires_at, item.row
+                    )
+                except (NotEnoughSeats, ValueError) as e:
+                    results[i] = e
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error holding seats: {str(e)}")
+        
+        holds = []
+        taken = 0
+        for hold_id, result in zip(hold_ids, results):
+            if isinstance(result, Exception):
+                holds.append(HoldSeatsResponse(
+                    success=False,
+                    message=str(result),
+                    hold_id=hold_id,
+                    available_seats=getattr(result, "available", 0)
+                ))
+                continue
+            taken += len(result)
+            holds.append(HoldSeatsResponse(
+                success=True,
+                message="Seats held successfully",
+                hold_id=hold_id,
+                seat_numbers=result,
+                expires_at=expires_at.isoformat() + "Z"
+            ))
+        
+        self.watch_hub.publish(request.event_id, -taken)
+        return BatchHoldSeatsResponse(holds=holds)
+    
+    @mutates_event
+    def BatchConfirmHolds(self, request, context):
+        try:
+            confirmed = self.inventory.confirm_many(
+                request.event_id, [(item.hold_id, item.booking_id) for item in request.holds]
+            )
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error confirming holds: {str(e)}")
+        
+        return BatchConfirmHoldsResponse(holds=[
+            self._confirm_response(item.hold_id, ok) for item, ok in zip(request.holds, confirmed)
+        ])
+    
+    @mutates_event
+    def BulkReleaseSeats(self, request, context):
+        # Idempotent per booking: seats already given back are simply not
+        # found again, so the caller can resend a batch after any failure.
+        try:
+            released = self.inventory.release_many(request.event_id, list(request.booking_ids))
+        except Exception as e:
+            context.abort(grpc.StatusCode.INTERNAL, f"Error releasing seats: {str(e)}")
+        
+        self.watch_hub.publish(request.event_id, released)
+        return BulkReleaseSeatsResponse(
+            success=True,
+            message=f"Released {released} seats of {len(request.booking_ids)} bookings",
+            released_seats=released
+        )
+    
+    def WatchAvailability(self, request, context):
+        self._get_event(request.event_id, context)
+        if not self.watchers.acquire(blocking=False):
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, f"More than {MAX_WATCHERS} availability watchers")
+        try:
+            subscription, available_seats = self.watch_hub.subscribe(request.event_id)
+            context.add_callback(subscription.close)
+            try:
+                yield AvailabilityUpdate(event_id=request.event_id, available_seats=available_seats)
+                while context.is_active():
+                    update = subscription.get(timeout=self.watch_hub.resync_interval)
+                    if update is None:
+                        if context.is_active():
+                            self.watch_hub.resync(request.event_id)
+                        continue
+                    available_seats, delta = update
+                    yield AvailabilityUpdate(
+                        event_id=request.event_id,
+                        available_seats=available_seats,
+                        delta=delta
+                    )
+            finally:
+                self.watch_hub.unsubscribe(subscription)
+        finally:
+            self.watchers.release()
+
+    def CreateEvent(self, request, context):
+        self._check_owner(request.event_id, context)
+        return self._create_event(request, None, context)
+    
+    def ProvisionSeatMap(self, request_iterator, context):
+        header = next(request_iterator, None)
+        if header is None or not header.HasField("event"):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "The first message must carry the event")
+        self._check_owner(header.event.event_id, context)
+        return self._create_event(header.event, self._seat_rows(header, request_iterator), context)
+    
+    @staticmethod
+    def _seat_rows(header, request_iterator):
+        yield from header.rows
+        for chunk in request_iterator:
+            yield from chunk.rows
+    
+    def _create_event(self, request, rows, context):
         session = get_session(self.engine)
         try:
-            event = session.query(Event).filter(Event.event_id == request.event_id).first()
-            if event is None:
-                context.abort(grpc.StatusCode.NOT_FOUND, f"Event with id {request.event_id} not found")
-            
-            available_seats = session.query(Seat).filter(
-                Seat.event_id == request.event_id,
-                Seat.is_reserved == False
-            ).count()
-            
-            available = available_seats >= request.number_of_tickets
-            
-            event_info = EventInfo(
+            event, row_count = self._provision_event(session, request, rows)
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            context.abort(grpc.StatusCode.ALREADY_EXISTS, f"Event with id {request.event_id} already exists")
+        except ValueError as e:
+            session.rollback()
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+        except Exception as e:
+            session.rollback()
+            context.abort(grpc.StatusCode.INTERNAL, f"Error creating event: {str(e)}")
+        finally:
+            session.close()
+        
+        return CreateEventResponse(
+            success=True,
+            message="Event created successfully",
+            event_id=event.event_id,
+            total_seats=event.total_seats,
+            rows=row_count
+        )
+    
+    def _provision_event(self, session, request, rows):
+        # Seats are written in PROVISION_BATCH chunks as the rows arrive and
+        # nothing per seat is kept in memory; the event and all of its seats
+        # are committed together.
+        if not all([request.name, request.date, request.venue]):
+            raise ValueError("Missing required fields")
+        if rows is None and request.total_seats < 1:
+            raise ValueError("total_seats must be positive")
+        
+        event = Event(
+            event_id=request.event_id or None,
+            name=request.name,
+            date=request.date,
+            venue=request.venue,
+            ticket_price=request.ticket_price,
+            total_seats=request.total_seats if rows is None else 0,
+            row_length=(request.row_length or None) if rows is None else None
+        )
+        session.add(event)
+        session.flush()
+        if rows is None:
+            self.inventory.provision(session, event.event_id, event.total_seats)
+            return event, 0
+        
+        total_seats = 0
+        provisioned = 0
+        row_count = 0
+        pending = []
+        for spec in rows:
+            if spec.seats < 1:
+                raise ValueError(f"Row {row_count + 1} has no seats")
+            row_count += 1
+            pending.append({
+                "event_id": event.event_id,
+                "row_number": row_count,
+                "section": spec.section or None,
+                "first_seat": total_seats + 1,
+                "seat_count": spec.seats
+            })
+            total_seats += spec.seats
+            if total_seats - provisioned >= PROVISION_BATCH:
+                session.connection().execute(SeatRow.__table__.insert(), pending)
+                self.inventory.provision(session, event.event_id, total_seats, provisioned + 1)
+                provisioned = total_seats
+                pending = []
+        if not total_seats:
+            raise ValueError("Seat map has no seats")
+        if pending:
+            session.connection().execute(SeatRow.__table__.insert(), pending)
+            self.inventory.provision(session, event.event_id, total_seats, provisioned + 1)
+        event.total_seats = total_seats
+        return event, row_count
+
+    def ListEvents(self, request, context):
+        session = get_session(self.engine)
+        try:
+            events = session.query(Event).order_by(Event.event_id).all()
+        finally:
+            session.close()
+        for event in events:
+            yield EventInfo(
                 event_id=event.event_id,
                 name=event.name,
                 date=event.date,
                 venue=event.venue,
                 ticket_price=event.ticket_price
             )
-            
-            return CheckAvailabilityResponse(
-                available=available,
-                available_seats=available_seats,
-                event=event_info
-            )
+    
+    def ExportEvent(self, request, context):
+        # From here on writes to the event are refused on this shard, until
+        # DropEvent removes it or ThawEvent gives it back.  A read-only
+        # export (rebalance comparing two copies) leaves it writable.
+        self._get_event(request.event_id, context)
+        if not request.read_only:
+            try:
+                self.moves.freeze(request.event_id, self.move_drain_timeout)
+            except TimeoutError as e:
+                context.abort(grpc.StatusCode.UNAVAILABLE, str(e))
+        session = get_session(self.engine)
+        try:
+            for table, rows in export_rows(session, request.event_id):
+                yield EventRows(event_id=request.event_id, table=table, rows=json.dumps(rows))
         finally:
             session.close()
     
-    def ReserveSeats(self, request, context):
+    def ImportEvent(self, request_iterator, context):
+        first = next(request_iterator, None)
+        if first is None:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Nothing to import")
+        event_id = first.event_id
+        self._check_owner(event_id, context)
+        
+        imported = 0
         session = get_session(self.engine)
         try:
-            event = session.query(Event).filter(Event.event_id == request.event_id).first()
-            if event is None:
-                context.abort(grpc.StatusCode.NOT_FOUND, f"Event with id {request.event_id} not found")
-            
-            available_seats = session.query(Seat).filter(
-                Seat.event_id == request.event_id,
-                Seat.is_reserved == False
-            ).limit(request.number_of_tickets).all()
-            
-            if len(available_seats) < request.number_of_tickets:
-                return ReserveSeatsResponse(
-                    success=False,
-                    message=f"Not enough seats available. Requested: {request.number_of_tickets}, Available: {len(available_seats)}"
-                )
-            
-            seat_numbers = []
-            for seat in available_seats:
-                seat.is_reserved = True
-                seat.booking_id = request.booking_id
-                seat_numbers.append(seat.seat_number)
-            
+            for chunk in itertools.chain([first], request_iterator):
+                if chunk.event_id != event_id:
+                    raise ValueError("An import carries a single event")
+                rows = json.loads(chunk.rows)
+                import_rows(session, chunk.table, rows)
+                imported += len(rows)
             session.commit()
-            
-            return ReserveSeatsResponse(
-                success=True,
-                message="Seats reserved successfully",
-                seat_numbers=seat_numbers
-            )
+        except IntegrityError:
+            session.rollback()
+            context.abort(grpc.StatusCode.ALREADY_EXISTS, f"Event with id {event_id} already exists")
+        except ValueError as e:
+            session.rollback()
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(e))
         except Exception as e:
             session.rollback()
-            context.abort(grpc.StatusCode.INTERNAL, f"Error reserving seats: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, f"Error importing event: {str(e)}")
         finally:
             session.close()
+        
+        self.inventory.forget(event_id)
+        return MoveEventResponse(success=True, message=f"Event {event_id} imported", rows=imported)
     
-    def ReleaseSeats(self, request, context):
+    def DropEvent(self, request, context):
+        # Only a copy that was exported, or that the ring now gives to
+        # another shard, can be dropped.
+        if not self.moves.frozen(request.event_id) and self.owns(request.event_id):
+            context.abort(
+                grpc.StatusCode.FAILED_PRECONDITION,
+                f"Event {request.event_id} belongs to this shard and is not being moved"
+            )
         session = get_session(self.engine)
         try:
-            seats = session.query(Seat).filter(
-                Seat.event_id == request.event_id,
-                Seat.booking_id == request.booking_id,
-                Seat.is_reserved == True
-            ).all()
-            
-            if not seats:
-                return ReleaseSeatsResponse(
-                    success=False,
-                    message=f"No seats found for booking {request.booking_id}"
-                )
-            
-            for seat in seats:
-                seat.is_reserved = False
-                seat.booking_id = None
-            
+            delete_event(session, request.event_id)
             session.commit()
-            
-            return ReleaseSeatsResponse(
-                success=True,
-                message="Seats released successfully"
-            )
         except Exception as e:
             session.rollback()
-            context.abort(grpc.StatusCode.INTERNAL, f"Error releasing seats: {str(e)}")
+            context.abort(grpc.StatusCode.INTERNAL, f"Error dropping event: {str(e)}")
         finally:
             session.close()
+        
+        self.inventory.forget(request.event_id)
+        self.moves.thaw(request.event_id)
+        return MoveEventResponse(success=True, message=f"Event {request.event_id} dropped")
+    
+    def ThawEvent(self, request, context):
+        self.moves.thaw(request.event_id)
+        return MoveEventResponse(success=True, message=f"Event {request.event_id} accepts writes again")
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def register(server):
     event_pb2_grpc.add_EventServiceServicer_to_server(EventService(), server)
-    port = os.getenv("PORT", "50052")
-    server.add_insecure_port(f"[::]:{port}")
-    print(f"Event Service starting on port {port}")
-    server.start()
-    server.wait_for_termination()
+
+def serve():
+    # Seat indexes, holds and reservation batching live in this process's
+    # memory, so the event service always runs as a single process.
+    run_service(
+        "Event Service", register, int(os.getenv("PORT", "50052")), processes=1,
+        stream_threads=MAX_WATCHERS
+    )
 
 if __name__ == "__main__":
     serve()
@@ -0,0 +1,655 @@
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import bindparam, func, select, update
+from models import get_session, Event, Seat, SeatRow, SeatMap, SeatAllocation
+from seat_index import FreeRunIndex
+
+
+class NotEnoughSeats(Exception):
+    def __init__(self, requested, available):
+        super().__init__(f"Not enough seats available. Requested: {requested}, Available: {available}")
+        self.requested = requested
+        self.available = available
+
+
+PROVISION_BATCH = 5000
+
+
+def row_starts(session, event):
+    """First seat of every row of an event, or None if it has no row layout."""
+    starts = session.execute(
+        select(SeatRow.first_seat).where(
+            SeatRow.event_id == event.event_id
+        ).order_by(SeatRow.row_number)
+    ).scalars().all()
+    if starts:
+        return starts
+    if event.row_length:
+        return range(1, event.total_seats + 1, event.row_length)
+    return None
+
+
+class Inventory:
+    """Shared entry points of the inventory backends.
+
+    ``reserve_many`` takes ``(count, booking_id, expires_at)`` requests; a
+    request with ``expires_at`` is a hold that ``confirm_many`` turns into a
+    regular reservation and ``release_expired`` gives back once it lapses.
+    ``release_many`` frees the seats of several bookings in one transaction.
+
+    ``reserve_block`` allocates adjacent seats instead.  It is served from a
+    ``FreeRunIndex`` per event, built on the first such request and then
+    kept current by every reserve and release of this process; changes to
+    the index are made under the event lock.
+
+    ``provision(session, event_id, total_seats, first_seat=1)`` adds seats
+    ``first_seat..total_seats`` in the caller's transaction, so a seat map
+    can be provisioned a chunk at a time.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._indexes = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, event_id):
+        with self._guard:
+            lock = self._locks.get(event_id)
+            if lock is None:
+                lock = self._locks[event_id] = threading.Lock()
+            return lock
+
+    def _mark(self, event_id, seat_numbers, free):
+        # Caller holds the event lock.
+        index = self._indexes.get(event_id)
+        if index is not None:
+            index.mark(seat_numbers, free)
+
+    def forget(self, event_id):
+        """Drop what is cached about an event whose rows changed under us."""
+        with self._lock(event_id):
+            self._indexes.pop(event_id, None)
+
+    def reserve(self, event_id, count, booking_id, expires_at=None):
+        result = self.reserve_many(event_id, [(count, booking_id, expires_at)])[0]
+        if isinstance(result, NotEnoughSeats):
+            raise result
+        return result
+
+    def confirm(self, event_id, hold_id, booking_id):
+        return self.confirm_many(event_id, [(hold_id, booking_id)])[0]
+
+
+class SqlInventory(Inventory):
+    """One ``Seat`` row per seat; every operation goes to the database."""
+
+    def provision(self, session, event_id, total_seats, first_seat=1):
+        # Bulk INSERTs of PROVISION_BATCH rows; no ORM objects are created,
+        # so memory stays flat whatever the venue size.
+        for start in range(first_seat, total_seats + 1, PROVISION_BATCH):
+            end = min(start + PROVISION_BATCH, total_seats + 1)
+            session.connection().execute(Seat.__table__.insert(), [
+                {"event_id": event_id, "seat_number": n, "is_reserved": False}
+                for n in range(start, end)
+            ])
+        self._indexes.pop(event_id, None)
+
+    def available(self, event_id):
+        session = get_session(self.engine)
+        try:
+            return session.execute(
+                select(func.count()).select_from(Seat).where(
+                    Seat.event_id == event_id,
+                    Seat.is_reserved == False
+                )
+            ).scalar()
+        finally:
+            session.close()
+
+    def reserve_many(self, event_id, requests):
+        session = get_session(self.engine)
+        try:
+            results = None
+            if len(requests) > 1:
+                results = self._claim_batch(session, event_id, requests)
+            if results is None:
+                results = [
+                    self._claim(session, event_id, count, booking_id, expires_at)
+                    for count, booking_id, expires_at in requests
+                ]
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if event_id in self._indexes:
+            with self._lock(event_id):
+                for result in results:
+                    if not isinstance(result, NotEnoughSeats):
+                        self._mark(event_id, result, False)
+        return results
+
+    def _claim(self, session, event_id, count, booking_id, expires_at):
+        # A single conditional UPDATE: the candidate subquery and the write
+        # run as one statement, and the outer ``is_reserved`` check makes a
+        # seat taken by a concurrent writer drop out instead of being booked
+        # twice.  A request that gets fewer than ``count`` seats gives them
+        # back, so it gets all of its seats or none.
+        candidates = select(Seat.seat_id).where(
+            Seat.event_id == event_id,
+            Seat.is_reserved == False
+        ).order_by(Seat.seat_number).limit(count).with_for_update(skip_locked=True)
+        claim = update(Seat).where(
+            Seat.seat_id.in_(candidates),
+            Seat.is_reserved == False
+        ).values(
+            is_reserved=True, booking_id=booking_id, hold_expires_at=expires_at
+        ).returning(Seat.seat_number)
+
+        seat_numbers = sorted(session.execute(claim).scalars())
+        if len(seat_numbers) < count:
+            if seat_numbers:
+                session.execute(update(Seat).where(
+                    Seat.event_id == event_id,
+                    Seat.seat_number.in_(seat_numbers)
+                ).values(is_reserved=False, booking_id=None, hold_expires_at=None))
+            return NotEnoughSeats(count, len(seat_numbers))
+        return seat_numbers
+
+    def _claim_batch(self, session, event_id, requests):
+        # Read enough free seats for the whole batch, hand them out in order
+        # and write them with one executemany.  If a concurrent writer got to
+        # any of them first the row count comes up short and the caller falls
+        # back to claiming request by request.
+        total = sum(count for count, _, _ in requests)
+        free = session.execute(
+            select(Seat.seat_id, Seat.seat_number).where(
+                Seat.event_id == event_id,
+                Seat.is_reserved == False
+            ).order_by(Seat.seat_number).limit(total).with_for_update(skip_locked=True)
+        ).all()
+
+        results = []
+        params = []
+        taken = 0
+        for count, booking_id, expires_at in requests:
+            if len(free) - taken < count:
+                results.append(NotEnoughSeats(count, len(free) - taken))
+                continue
+            chunk = free[taken:taken + count]
+            taken += count
+            params.extend(
+                {"claim_seat_id": seat_id, "claim_booking_id": booking_id, "claim_expires_at": expires_at}
+                for seat_id, _ in chunk
+            )
+            results.append([seat_number for _, seat_number in chunk])
+
+        if params:
+            seats = Seat.__table__
+            claim = seats.update().where(
+                seats.c.seat_id == bindparam("claim_seat_id"),
+                seats.c.is_reserved == False
+            ).values(
+                is_reserved=True,
+                booking_id=bindparam("claim_booking_id"),
+                hold_expires_at=bindparam("claim_expires_at")
+            )
+            if session.connection().execute(claim, params).rowcount != len(params):
+                session.rollback()
+                return None
+        return results
+
+    def reserve_block(self, event_id, count, booking_id, expires_at=None, row=0):
+        # The index only picks the block; the UPDATE still checks every seat
+        # in it, so a seat taken by another process makes the row count come
+        # up short, and the index is rebuilt from the table and asked again.
+        with self._lock(event_id):
+            for _ in range(3):
+                index = self._indexes.get(event_id) or self._build_index(event_id)
+                first = index.find(count, row)
+                if first is None:
+                    break
+                last = first + count - 1
+                session = get_session(self.engine)
+                try:
+                    claimed = session.execute(update(Seat).where(
+                        Seat.event_id == event_id,
+                        Seat.seat_number.between(first, last),
+                        Seat.is_reserved == False
+                    ).values(
+                        is_reserved=True, booking_id=booking_id, hold_expires_at=expires_at
+                    )).rowcount
+                    if claimed == count:
+                        session.commit()
+                        seat_numbers = list(range(first, last + 1))
+                        index.mark(seat_numbers, False)
+                        return seat_numbers
+                    session.rollback()
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+                del self._indexes[event_id]
+        raise NotEnoughSeats(count, self.available(event_id))
+
+    def _build_index(self, event_id):
+        session = get_session(self.engine)
+        try:
+            event = session.get(Event, event_id)
+            if event is None:
+                raise LookupError(f"Event with id {event_id} not found")
+            free_seats = session.execute(
+                select(Seat.seat_number).where(
+                    Seat.event_id == event_id,
+                    Seat.is_reserved == False
+                )
+            ).scalars()
+            index = FreeRunIndex(event.total_seats, row_starts(session, event), free_seats)
+        finally:
+            session.close()
+        self._indexes[event_id] = index
+        return index
+
+    def release(self, event_id, booking_id):
+        return self.release_many(event_id, [booking_id])
+
+    def release_many(self, event_id, booking_ids):
+        statement = update(Seat).where(
+            Seat.event_id == event_id,
+            Seat.booking_id.in_(booking_ids),
+            Seat.is_reserved == True
+        ).values(
+            is_reserved=False, booking_id=None, hold_expires_at=None
+        ).returning(Seat.seat_number)
+        session = get_session(self.engine)
+        try:
+            seat_numbers = session.execute(statement).scalars().all()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if seat_numbers and event_id in self._indexes:
+            with self._lock(event_id):
+                self._mark(event_id, seat_numbers, True)
+        return len(seat_numbers)
+
+    def confirm_many(self, event_id, confirmations):
+        now = datetime.utcnow()
+        session = get_session(self.engine)
+        try:
+            results = [
+                session.execute(update(Seat).where(
+                    Seat.event_id == event_id,
+                    Seat.booking_id == hold_id,
+                    Seat.hold_expires_at >= now
+                ).values(booking_id=booking_id, hold_expires_at=None)).rowcount > 0
+                for hold_id, booking_id in confirmations
+            ]
+            session.commit()
+            return results
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def release_expired(self):
+        statement = update(Seat).where(
+            Seat.hold_expires_at < datetime.utcnow()
+        ).values(
+            is_reserved=False, booking_id=None, hold_expires_at=None
+        ).returning(Seat.event_id, Seat.seat_number)
+        session = get_session(self.engine)
+        try:
+            rows = session.execute(statement).all()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        released = Counter(event_id for event_id, _ in rows)
+        for event_id in released:
+            if event_id in self._indexes:
+                with self._lock(event_id):
+                    self._mark(
+                        event_id,
+                        [seat_number for e, seat_number in rows if e == event_id],
+                        True
+                    )
+        return dict(released)
+
+
+class SeatBitmap:
+    """Free-seat bitset of one event: bit ``n - 1`` is set while seat ``n`` is free."""
+
+    __slots__ = ("total_seats", "free", "free_count")
+
+    def __init__(self, total_seats, reserved=0):
+        full = (1 << total_seats) - 1
+        self.total_seats = total_seats
+        self.free = full & ~reserved
+        self.free_count = bin(self.free).count("1")
+
+    @classmethod
+    def from_bytes(cls, total_seats, data):
+        return cls(total_seats, int.from_bytes(data, "little"))
+
+    def to_bytes(self, free=None):
+        full = (1 << self.total_seats) - 1
+        reserved = full & ~(self.free if free is None else free)
+        return reserved.to_bytes((self.total_seats + 7) // 8, "little")
+
+    def take(self, count, free):
+        seat_numbers = []
+        while len(seat_numbers) < count:
+            lowest = free & -free
+            free ^= lowest
+            seat_numbers.append(lowest.bit_length())
+        return seat_numbers, free
+
+    def give_back(self, seat_numbers):
+        free = self.free
+        for seat_number in seat_numbers:
+            free |= 1 << (seat_number - 1)
+        return free
+
+
+def _encode_seats(seat_numbers):
+    return ",".join(str(n) for n in seat_numbers)
+
+
+def _decode_seats(value):
+    return [int(n) for n in value.split(",") if n]
+
+
+class BitmapInventory(Inventory):
+    """Seat map of every event kept as an in-memory bitset.
+
+    The bitset is persisted as a single ``seat_maps`` blob per event and each
+    reservation as one ``seat_allocations`` row, so a reservation costs one
+    blob update and one insert regardless of the venue size.
+    """
+
+    def __init__(self, engine):
+        super().__init__(engine)
+        self._maps = {}
+
+    def provision(self, session, event_id, total_seats, first_seat=1):
+        if first_seat == 1:
+            bitmap = SeatBitmap(total_seats)
+            session.add(SeatMap(event_id=event_id, total_seats=total_seats, bitmap=bitmap.to_bytes()))
+        else:
+            # Seats past the old total have no reserved bit, so they are free
+            # as soon as the total grows.
+            session.query(SeatMap).filter(SeatMap.event_id == event_id).update(
+                {SeatMap.total_seats: total_seats}
+            )
+        self._maps.pop(event_id, None)
+        self._indexes.pop(event_id, None)
+
+    def forget(self, event_id):
+        with self._lock(event_id):
+            self._maps.pop(event_id, None)
+            self._indexes.pop(event_id, None)
+
+    def _load(self, session, event_id):
+        bitmap = self._maps.get(event_id)
+        if bitmap is not None:
+            return bitmap
+
+        row = session.get(SeatMap, event_id)
+        if row is None:
+            row = self._import_seat_rows(session, event_id)
+        bitmap = SeatBitmap.from_bytes(row.total_seats, row.bitmap)
+        self._maps[event_id] = bitmap
+        return bitmap
+
+    def _import_seat_rows(self, session, event_id):
+        # Databases created by the SQL backend only have Seat rows; convert
+        # an event's once, on first use.  Only one way: the Seat rows are
+        # not kept up to date after this, so create_inventory will not open
+        # the file with the SQL backend again.
+        event = session.get(Event, event_id)
+        if event is None:
+            raise LookupError(f"Event with id {event_id} not found")
+
+        reserved = 0
+        holders = {}
+        expiries = {}
+        rows = session.query(Seat.seat_number, Seat.booking_id, Seat.hold_expires_at).filter(
+            Seat.event_id == event_id,
+            Seat.is_reserved == True
+        )
+        for seat_number, booking_id, expires_at in rows:
+            reserved |= 1 << (seat_number - 1)
+            holders.setdefault(booking_id or "", []).append(seat_number)
+            expiries[booking_id or ""] = expires_at
+
+        bitmap = SeatBitmap(event.total_seats, reserved)
+        row = SeatMap(event_id=event_id, total_seats=event.total_seats, bitmap=bitmap.to_bytes())
+        session.add(row)
+        for booking_id, seat_numbers in holders.items():
+            session.add(SeatAllocation(
+                event_id=event_id,
+                booking_id=booking_id,
+                seat_numbers=_encode_seats(seat_numbers),
+                expires_at=expiries[booking_id]
+            ))
+        session.commit()
+        return row
+
+    def _build_index(self, session, event_id, bitmap):
+        event = session.get(Event, event_id)
+        bits = bin(bitmap.free)[:1:-1]
+        index = FreeRunIndex(
+            bitmap.total_seats,
+            row_starts(session, event) if event is not None else None,
+            (i + 1 for i, bit in enumerate(bits) if bit == "1")
+        )
+        self._indexes[event_id] = index
+        return index
+
+    def available(self, event_id):
+        bitmap = self._maps.get(event_id)
+        if bitmap is not None:
+            return bitmap.free_count
+
+        with self._lock(event_id):
+            session = get_session(self.engine)
+            try:
+                return self._load(session, event_id).free_count
+            finally:
+                session.close()
+
+    def reserve_many(self, event_id, requests):
+        with self._lock(event_id):
+            session = get_session(self.engine)
+            try:
+                bitmap = self._load(session, event_id)
+                free = bitmap.free
+                free_count = bitmap.free_count
+                results = []
+                for count, booking_id, expires_at in requests:
+                    if free_count < count:
+                        results.append(NotEnoughSeats(count, free_count))
+                        continue
+                    seat_numbers, free = bitmap.take(count, free)
+                    free_count -= count
+                    session.add(SeatAllocation(
+                        event_id=event_id,
+                        booking_id=booking_id,
+                        seat_numbers=_encode_seats(seat_numbers),
+                        expires_at=expires_at
+                    ))
+                    results.append(seat_numbers)
+
+                if free_count != bitmap.free_count:
+                    session.query(SeatMap).filter(SeatMap.event_id == event_id).update(
+                        {SeatMap.bitmap: bitmap.to_bytes(free)}
+                    )
+                    session.commit()
+
+                bitmap.free = free
+                bitmap.free_count = free_count
+                for result in results:
+                    if not isinstance(result, NotEnoughSeats):
+                        self._mark(event_id, result, False)
+                return results
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def reserve_block(self, event_id, count, booking_id, expires_at=None, row=0):
+        with self._lock(event_id):
+            session = get_session(self.engine)
+            try:
+                bitmap = self._load(session, event_id)
+                index = self._indexes.get(event_id)
+                if index is None:
+                    index = self._build_index(session, event_id, bitmap)
+                first = index.find(count, row)
+                if first is None:
+                    raise NotEnoughSeats(count, bitmap.free_count)
+
+                seat_numbers = list(range(first, first + count))
+                block = ((1 << count) - 1) << (first - 1)
+                free = bitmap.free & ~block
+                session.add(SeatAllocation(
+                    event_id=event_id,
+                    booking_id=booking_id,
+                    seat_numbers=_encode_seats(seat_numbers),
+                    expires_at=expires_at
+                ))
+                session.query(SeatMap).filter(SeatMap.event_id == event_id).update(
+                    {SeatMap.bitmap: bitmap.to_bytes(free)}
+                )
+                session.commit()
+
+                bitmap.free = free
+                bitmap.free_count -= count
+                index.mark(seat_numbers, False)
+                return seat_numbers
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+    def release(self, event_id, booking_id):
+        return self._free(event_id, SeatAllocation.booking_id == booking_id)
+
+    def release_many(self, event_id, booking_ids):
+        return self._free(event_id, SeatAllocation.booking_id.in_(booking_ids))
+
+    def confirm_many(self, event_id, confirmations):
+        now = datetime.utcnow()
+        session = get_session(self.engine)
+        try:
+            results = [
+                session.query(SeatAllocation).filter(
+                    SeatAllocation.event_id == event_id,
+                    SeatAllocation.booking_id == hold_id,
+                    SeatAllocation.expires_at >= now
+                ).update({SeatAllocation.booking_id: booking_id, SeatAllocation.expires_at: None}) > 0
+                for hold_id, booking_id in confirmations
+            ]
+            session.commit()
+            return results
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def release_expired(self):
+        now = datetime.utcnow()
+        session = get_session(self.engine)
+        try:
+            event_ids = session.query(SeatAllocation.event_id).filter(
+                SeatAllocation.expires_at < now
+            ).distinct().all()
+        finally:
+            session.close()
+
+        released = {}
+        for (event_id,) in event_ids:
+            count = self._free(event_id, SeatAllocation.expires_at < now)
+            if count:
+                released[event_id] = count
+        return released
+
+    def _free(self, event_id, condition):
+        with self._lock(event_id):
+            session = get_session(self.engine)
+            try:
+                allocations = session.query(SeatAllocation).filter(
+                    SeatAllocation.event_id == event_id,
+                    condition
+                ).all()
+                if not allocations:
+                    return 0
+
+                bitmap = self._load(session, event_id)
+                seat_numbers = []
+                for allocation in allocations:
+                    seat_numbers.extend(_decode_seats(allocation.seat_numbers))
+                    session.delete(allocation)
+
+                free = bitmap.give_back(seat_numbers)
+                session.query(SeatMap).filter(SeatMap.event_id == event_id).update(
+                    {SeatMap.bitmap: bitmap.to_bytes(free)}
+                )
+                session.commit()
+
+                bitmap.free = free
+                bitmap.free_count += len(seat_numbers)
+                self._mark(event_id, seat_numbers, True)
+                return len(seat_numbers)
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+
+BACKENDS = {
+    "sql": SqlInventory,
+    "bitmap": BitmapInventory,
+}
+
+
+def create_inventory(engine, backend):
+    """The ``backend`` inventory (``sql`` or ``bitmap``) over ``engine``'s database.
+
+    A database moves from ``sql`` to ``bitmap``, but not back: once the
+    bitmap backend has converted an event, its Seat rows go stale.  The
+    SQL backend refuses a database that has any seat maps.
+    """
+    try:
+        inventory_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown inventory backend: {backend}")
+    if inventory_class is SqlInventory:
+        session = get_session(engine)
+        try:
+            converted = session.execute(select(SeatMap.event_id).limit(1)).first() is not None
+        finally:
+            session.close()
+        if converted:
+            raise ValueError(
+                "This database has been used with INVENTORY_BACKEND=bitmap; "
+                "its Seat rows are stale and the sql backend cannot use it"
+            )
+    return inventory_class(engine)
@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, LargeBinary, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship
+from common.database import get_engine, get_session
+from common.migrations import migrate, create_index, add_column
 
 Base = declarative_base()
 
@@ -13,6 +15,7 @@ class Event(Base):
     venue = Column(String(100), nullable=False)
     ticket_price = Column(Float, nullable=False)
     total_seats = Column(Integer, nullable=False, default=100)
+    row_length = Column(Integer, nullable=True)
     
     seats = relationship("Seat", back_populates="event", cascade="all, delete-orphan")
 
@@ -24,15 +27,83 @@ class Seat(Base):
     seat_number = Column(Integer, nullable=False)
     is_reserved = Column(Boolean, default=False)
     booking_id = Column(String(50), nullable=True)
+    hold_expires_at = Column(DateTime, nullable=True)
     
     event = relationship("Event", back_populates="seats")
 
+class SeatRow(Base):
+    __tablename__ = 'seat_rows'
+    
+    event_id = Column(Integer, ForeignKey('events.event_id'), primary_key=True)
+    row_number = Column(Integer, primary_key=True)
+    section = Column(String(100), nullable=True)
+    first_seat = Column(Integer, nullable=False)
+    seat_count = Column(Integer, nullable=False)
+
+class SeatMap(Base):
+    __tablename__ = 'seat_maps'
+    
+    event_id = Column(Integer, ForeignKey('events.event_id'), primary_key=True)
+    total_seats = Column(Integer, nullable=False)
+    bitmap = Column(LargeBinary, nullable=False)
+
+class SeatAllocation(Base):
+    __tablename__ = 'seat_allocations'
+    __table_args__ = (
+        Index('ix_seat_allocations_event_booking', 'event_id', 'booking_id'),
+    )
+    
+    allocation_id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey('events.event_id'), nullable=False)
+    booking_id = Column(String(50), nullable=False)
+    seat_numbers = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+
+# Free seats are claimed and counted per event in seat order, and released
+# per booking; both indexes are partial so they only cover the rows those
+# queries can match.
+ix_seats_event_free = Index(
+    'ix_seats_event_free', Seat.event_id, Seat.seat_number,
+    sqlite_where=Seat.is_reserved == False,
+    postgresql_where=Seat.is_reserved == False,
+)
+ix_seats_event_booking = Index(
+    'ix_seats_event_booking', Seat.event_id, Seat.booking_id,
+    sqlite_where=Seat.booking_id.isnot(None),
+    postgresql_where=Seat.booking_id.isnot(None),
+)
+# Held seats carry an expiry until they are confirmed; the sweeper looks
+# them up by expiry, so only unconfirmed holds are indexed.
+ix_seats_hold_expires = Index(
+    'ix_seats_hold_expires', Seat.hold_expires_at,
+    sqlite_where=Seat.hold_expires_at.isnot(None),
+    postgresql_where=Seat.hold_expires_at.isnot(None),
+)
+ix_seat_allocations_expires = Index(
+    'ix_seat_allocations_expires', SeatAllocation.expires_at,
+    sqlite_where=SeatAllocation.expires_at.isnot(None),
+    postgresql_where=SeatAllocation.expires_at.isnot(None),
+)
+
+MIGRATIONS = [
+    (1, 'Index free seats and seats by booking', [
+        create_index(ix_seats_event_free),
+        create_index(ix_seats_event_booking),
+    ]),
+    (2, 'Seat holds with expiry', [
+        add_column('seats', 'hold_expires_at DATETIME'),
+        add_column('seat_allocations', 'expires_at DATETIME'),
+        create_index(ix_seats_hold_expires),
+        create_index(ix_seat_allocations_expires),
+    ]),
+    (3, 'Row layout of events', [
+        add_column('events', 'row_length INTEGER'),
+    ]),
+]
+
 def init_db():
-    engine = create_engine('sqlite:///events.db')
+    engine = get_engine('events.db')
     Base.metadata.create_all(engine)
+    migrate(engine, MIGRATIONS)
     return engine
 
-def get_session(engine):
-    Session = sessionmaker(bind=engine)
-    return Session()
-
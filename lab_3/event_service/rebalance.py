@@ -0,0 +1,124 @@
+"""Move events to their new shards after the event service shard list changes.
+
+    python rebalance.py plan --old s0=event-0:50052,s1=event-1:50052 \\
+                             --new s0=event-0:50052,s1=event-1:50052,s2=event-2:50052
+    python rebalance.py move --old ... --new ...
+    python rebalance.py drop --old ... --new ...
+
+Adding a shard:
+
+1. start it with ``EVENT_SHARDS=<new list>``, ``EVENT_SHARD=<its name>`` and
+   ``EVENT_SHARD_JOINING=1``, so it does not create the sample events;
+2. ``move`` copies every event whose owner changes onto its new shard.  The
+   old copy is frozen from the export on, so writes that still reach it
+   fail with UNAVAILABLE rather than being lost.  An event the new shard
+   already has counts as moved only if both copies are identical (a
+   repeated ``move``); otherwise the move fails and the old copy is thawed;
+3. once ``move`` reports no failures, restart the booking services with
+   ``EVENT_SERVICE_SHARDS=<new list>`` (and give the old shards the new
+   ``EVENT_SHARDS`` at their next restart);
+4. ``drop`` deletes the moved events from their old shards.
+
+Consistent hashing means only the events that hash to the new shard move,
+about 1/N of them, and none move between the shards that were already there.
+"""
+import argparse
+import json
+import sys
+import grpc
+from event_pb2 import CheckAvailabilityRequest, ListEventsRequest, MoveEventRequest
+from event_pb2_grpc import EventServiceStub
+from common.sharding import HashRing, parse_shards
+
+
+def planned_moves(old, new, stubs):
+    """``(event_id, source, target)`` for every event the new ring places elsewhere."""
+    ring = HashRing([name for name, _ in new])
+    for name, _ in old:
+        for event in stubs[name].ListEvents(ListEventsRequest()):
+            owner = ring.node_for(event.event_id)
+            if owner != name:
+                yield event.event_id, name, owner
+
+
+def event_copy(stub, event_id, timeout):
+    """Every row of one event on one shard, per table and in a fixed order."""
+    tables = {}
+    request = MoveEventRequest(event_id=event_id, read_only=True)
+    for chunk in stub.ExportEvent(request, timeout=timeout):
+        tables.setdefault(chunk.table, []).extend(
+            json.dumps(row, sort_keys=True) for row in json.loads(chunk.rows)
+        )
+    return {table: sorted(rows) for table, rows in tables.items()}
+
+
+def move(event_id, source, target, stubs, timeout):
+    request = MoveEventRequest(event_id=event_id)
+    try:
+        response = stubs[target].ImportEvent(stubs[source].ExportEvent(request), timeout=timeout)
+    except grpc.RpcError as e:
+        if e.code() == grpc.StatusCode.ALREADY_EXISTS:
+            # Either an earlier move got this far, or the target has an
+            # event of its own with this id; only the first is a move.
+            try:
+                same = event_copy(stubs[source], event_id, timeout) == event_copy(stubs[target], event_id, timeout)
+            except grpc.RpcError as compare_error:
+                same, details = False, compare_error.details()
+            else:
+                details = f"{target} has a different copy"
+            if same:
+                print(f"event {event_id}: already on {target}")
+                return True
+        else:
+            details = e.details()
+        # Abandon the move; the old shard takes writes again.
+        stubs[source].ThawEvent(request, timeout=timeout)
+        print(f"event {event_id}: {source} -> {target} failed: {details}")
+        return False
+    print(f"event {event_id}: {source} -> {target}, {response.rows} rows")
+    return True
+
+
+def drop(event_id, source, target, stubs, timeout):
+    try:
+        stubs[target].CheckAvailability(CheckAvailabilityRequest(event_id=event_id), timeout=timeout)
+    except grpc.RpcError as e:
+        print(f"event {event_id}: not dropped from {source}, {target} does not have it ({e.code().name})")
+        return False
+    try:
+        stubs[source].DropEvent(MoveEventRequest(event_id=event_id), timeout=timeout)
+    except grpc.RpcError as e:
+        print(f"event {event_id}: drop from {source} failed: {e.details()}")
+        return False
+    print(f"event {event_id}: dropped from {source}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["plan", "move", "drop"])
+    parser.add_argument("--old", required=True, help="shard list the events are on now")
+    parser.add_argument("--new", required=True, help="shard list to rebalance to")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    old, new = parse_shards(args.old), parse_shards(args.new)
+    addresses = {}
+    for name, address in old + new:
+        if addresses.setdefault(name, address) != address:
+            parser.error(f"Shard {name} has two addresses")
+    stubs = {name: EventServiceStub(grpc.insecure_channel(address)) for name, address in addresses.items()}
+
+    failures = 0
+    for event_id, source, target in list(planned_moves(old, new, stubs)):
+        if args.command == "plan":
+            print(f"event {event_id}: {source} -> {target}")
+        elif args.command == "move":
+            failures += not move(event_id, source, target, stubs, args.timeout)
+        else:
+            failures += not drop(event_id, source, target, stubs, args.timeout)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+class FreeRunIndex:
+    """Segment tree over the seats of one event, keyed by free-run length.
+
+    Every node stores the longest run of free seats inside its range and the
+    free runs touching its left and right edges, so the front-most block of
+    ``n`` adjacent free seats is found by one descent and marking a seat
+    costs one leaf-to-root pass, both O(log seats).  With ``row_starts`` (the
+    first seat of every row, in order) runs are cut at row boundaries and a
+    block never spans two rows.
+
+    Seats are 1-based as everywhere else; lower seat numbers are treated as
+    the better ones.
+    """
+
+    def __init__(self, total_seats, row_starts=None, free_seats=()):
+        self.total_seats = total_seats
+        self.row_starts = list(row_starts or [1])
+        self._boundaries = {first - 1 for first in self.row_starts}
+        size = 1
+        while size < max(total_seats, 1):
+            size *= 2
+        self.size = size
+        self.prefix = [0] * (2 * size)
+        self.suffix = [0] * (2 * size)
+        self.longest = [0] * (2 * size)
+
+        for seat_number in free_seats:
+            leaf = size + seat_number - 1
+            self.prefix[leaf] = self.suffix[leaf] = self.longest[leaf] = 1
+        width = 1
+        level = size // 2
+        while level:
+            width *= 2
+            for node in range(level, 2 * level):
+                self._pull(node, (node - level) * width, width)
+            level //= 2
+
+    def _boundary(self, position):
+        return position in self._boundaries
+
+    def _pull(self, node, start, width):
+        left, right = 2 * node, 2 * node + 1
+        half = width // 2
+        joined = not self._boundary(start + half)
+        prefix, suffix = self.prefix, self.suffix
+
+        prefix[node] = prefix[left]
+        if joined and prefix[left] == half:
+            prefix[node] += prefix[right]
+        suffix[node] = suffix[right]
+        if joined and suffix[right] == half:
+            suffix[node] += suffix[left]
+        longest = max(self.longest[left], self.longest[right])
+        if joined:
+            longest = max(longest, suffix[left] + prefix[right])
+        self.longest[node] = longest
+
+    def mark(self, seat_numbers, free):
+        value = 1 if free else 0
+        for seat_number in seat_numbers:
+            node = self.size + seat_number - 1
+            self.prefix[node] = self.suffix[node] = self.longest[node] = value
+            position = seat_number - 1
+            width = 1
+            node //= 2
+            while node:
+                width *= 2
+                self._pull(node, position - position % width, width)
+                node //= 2
+
+    def row_range(self, row):
+        """Seat numbers ``(first, last)`` of a 1-based row."""
+        if not row:
+            return 1, self.total_seats
+        if row < 1 or row > len(self.row_starts):
+            raise ValueError(f"Row {row} does not exist")
+        if row == len(self.row_starts):
+            return self.row_starts[row - 1], self.total_seats
+        return self.row_starts[row - 1], self.row_starts[row] - 1
+
+    def find(self, count, row=0):
+        """First seat of the front-most free block of ``count`` seats, or None."""
+        if count < 1:
+            return None
+        first, last = self.row_range(row)
+        if last - first + 1 < count or self.longest[1] < count:
+            return None
+        found, _ = self._search(1, 0, self.size, count, first - 1, last, 0)
+        return None if found is None else found + 1
+
+    def _search(self, node, start, width, count, lo, hi, run):
+        # ``run`` is the length of the free run ending just before ``start``
+        # within [lo, hi); nodes are visited left to right and only a node
+        # that can hold the block by itself is descended into.
+        end = start + width
+        if end <= lo or start >= hi:
+            return None, run
+        if self._boundary(start):
+            run = 0
+        if lo <= start and end <= hi:
+            if run + self.prefix[node] >= count:
+                return start - run, run
+            if self.longest[node] < count:
+                if self.prefix[node] == width:
+                    return None, run + width
+                return None, self.suffix[node]
+        half = width // 2
+        found, run = self._search(2 * node, start, half, count, lo, hi, run)
+        if found is not None:
+            return found, run
+        return self._search(2 * node + 1, start + half, half, count, lo, hi, run)
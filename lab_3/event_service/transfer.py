@@ -0,0 +1,123 @@
+import base64
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import DateTime, LargeBinary, select
+from models import Base
+
+TRANSFER_CHUNK = 5000
+
+
+class EventMoving(Exception):
+    def __init__(self, event_id):
+        super().__init__(f"Event {event_id} is moving to another shard")
+        self.event_id = event_id
+
+
+class MoveGate:
+    """Holds back writes to an event while it is copied to another shard.
+
+    Every call that changes an event's seats runs inside ``enter``.
+    ``freeze`` makes later calls fail with ``EventMoving`` and waits for the
+    ones already inside to finish, so an export taken after it is the final
+    state of the event on this shard.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = {}
+        self._moving = set()
+
+    @contextmanager
+    def enter(self, event_id):
+        with self._cond:
+            if event_id in self._moving:
+                raise EventMoving(event_id)
+            self._active[event_id] = self._active.get(event_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[event_id] -= 1
+                if not self._active[event_id]:
+                    del self._active[event_id]
+                    self._cond.notify_all()
+
+    def freeze(self, event_id, timeout=10.0):
+        with self._cond:
+            self._moving.add(event_id)
+            if not self._cond.wait_for(lambda: event_id not in self._active, timeout):
+                self._moving.discard(event_id)
+                raise TimeoutError(f"Writes to event {event_id} did not drain in {timeout}s")
+
+    def thaw(self, event_id):
+        with self._cond:
+            self._moving.discard(event_id)
+
+    def frozen(self, event_id):
+        with self._cond:
+            return event_id in self._moving
+
+
+def event_tables():
+    """Tables with per-event rows, parents before children."""
+    return [table for table in Base.metadata.sorted_tables if "event_id" in table.c]
+
+
+def _surrogate_key(table):
+    # Autoincrement ids (seat_id, allocation_id) are local to a database and
+    # are left for the importing shard to assign.
+    key = list(table.primary_key.columns)
+    if len(key) == 1 and key[0].name != "event_id":
+        return key[0].name
+    return None
+
+
+def _portable(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return value.isoformat()
+    if isinstance(column.type, LargeBinary):
+        return base64.b64encode(value).decode()
+    return value
+
+
+def _native(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, LargeBinary):
+        return base64.b64decode(value)
+    return value
+
+
+def export_rows(session, event_id, chunk=TRANSFER_CHUNK):
+    """Yield ``(table_name, rows)`` with every row of one event, ``chunk`` rows at a time."""
+    for table in event_tables():
+        skip = _surrogate_key(table)
+        columns = [column for column in table.columns if column.name != skip]
+        result = session.connection().execution_options(yield_per=chunk).execute(
+            select(*columns).where(table.c.event_id == event_id).order_by(*table.primary_key.columns)
+        )
+        for rows in result.partitions():
+            yield table.name, [
+                {column.name: _portable(column, value) for column, value in zip(columns, row)}
+                for row in rows
+            ]
+
+
+def import_rows(session, table_name, rows):
+    table = Base.metadata.tables.get(table_name)
+    if table is None or "event_id" not in table.c:
+        raise ValueError(f"Unknown event table: {table_name}")
+    session.connection().execute(table.insert(), [
+        {name: _native(table.c[name], value) for name, value in row.items()}
+        for row in rows
+    ])
+
+
+def delete_event(session, event_id):
+    for table in reversed(event_tables()):
+        session.execute(table.delete().where(table.c.event_id == event_id))
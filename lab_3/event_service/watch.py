@@ -0,0 +1,150 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Subscription:
+    def __init__(self, hub, event_id, maxsize):
+        self.hub = hub
+        self.event_id = event_id
+        self.updates = queue.Queue(maxsize)
+
+    def push(self, update):
+        # A slow watcher loses its oldest updates, never the newest: every
+        # update carries the absolute count, so the last one it gets is the
+        # current count even if some in between were skipped.
+        while True:
+            try:
+                self.updates.put_nowait(update)
+                return
+            except queue.Full:
+                try:
+                    self.updates.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        try:
+            return self.updates.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+        self.push(None)
+
+
+class AvailabilityHub:
+    """In-process fan-out of seat-count changes to ``WatchAvailability`` streams.
+
+    The hub keeps the current count of every watched event and adjusts it by
+    the deltas published after each reserve or release, so subscribers never
+    touch the database.  The count is re-read from the inventory at most once
+    per ``resync_interval`` per event to pick up writes from other processes,
+    which keeps the database cost independent of the number of watchers.
+
+    Every change to an event's seats runs inside ``writing``, from before the
+    inventory call until after its ``publish``.  Reading the count holds new
+    writes to that event back and waits for the running ones, so a count is
+    never read between a commit and its publish, which would count that
+    change twice.
+    """
+
+    def __init__(self, inventory, resync_interval=5.0, queue_size=256):
+        self.inventory = inventory
+        self.resync_interval = resync_interval
+        self.queue_size = queue_size
+        self._lock = threading.Condition()
+        self._subscribers = {}
+        self._counts = {}
+        self._synced_at = {}
+        self._writers = {}
+        self._reading = set()
+
+    @contextmanager
+    def writing(self, event_id=None):
+        """Bracket a change to ``event_id``'s seats (any event's, if None) and its publish."""
+        with self._lock:
+            self._lock.wait_for(lambda: not self._reading if event_id is None else event_id not in self._reading)
+            self._writers[event_id] = self._writers.get(event_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._writers[event_id] -= 1
+                if not self._writers[event_id]:
+                    del self._writers[event_id]
+                    self._lock.notify_all()
+
+    def _read_count(self, event_id):
+        # Caller holds the lock and gets it back with the event still held:
+        # no write to it can start until _done_reading.
+        self._lock.wait_for(lambda: event_id not in self._reading)
+        self._reading.add(event_id)
+        self._lock.wait_for(lambda: event_id not in self._writers and None not in self._writers)
+        self._lock.release()
+        try:
+            return self.inventory.available(event_id)
+        finally:
+            self._lock.acquire()
+
+    def _done_reading(self, event_id):
+        self._reading.discard(event_id)
+        self._lock.notify_all()
+
+    def subscribe(self, event_id):
+        subscription = Subscription(self, event_id, self.queue_size)
+        with self._lock:
+            # A subscriber already reading the count leaves it in _counts.
+            self._lock.wait_for(lambda: event_id not in self._reading)
+            if event_id not in self._counts:
+                try:
+                    self._counts[event_id] = self._read_count(event_id)
+                    self._synced_at[event_id] = time.monotonic()
+                finally:
+                    self._done_reading(event_id)
+            self._subscribers.setdefault(event_id, set()).add(subscription)
+            count = self._counts[event_id]
+        return subscription, count
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.event_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.event_id]
+                del self._counts[subscription.event_id]
+                del self._synced_at[subscription.event_id]
+
+    def publish(self, event_id, delta):
+        if not delta or event_id not in self._subscribers:
+            return
+        with self._lock:
+            if event_id not in self._counts:
+                return
+            count = self._counts[event_id] = self._counts[event_id] + delta
+            # Pushed under the lock so updates reach every queue in the
+            # order the counts were computed.
+            for subscription in self._subscribers[event_id]:
+                subscription.push((count, delta))
+
+    def resync(self, event_id):
+        with self._lock:
+            synced_at = self._synced_at.get(event_id)
+            if synced_at is None or time.monotonic() - synced_at < self.resync_interval:
+                return
+            self._synced_at[event_id] = time.monotonic()
+            try:
+                available = self._read_count(event_id)
+            finally:
+                self._done_reading(event_id)
+            if event_id not in self._counts:
+                return
+            delta = available - self._counts[event_id]
+            self._counts[event_id] = available
+            if delta:
+                for subscription in self._subscribers[event_id]:
+                    subscription.push((available, delta))
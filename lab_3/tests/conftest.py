@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+LAB_DIR = Path(__file__).resolve().parents[1]
+
+# The services import their own modules top-level (``models``, ``inventory``),
+# the way their Dockerfiles lay them out.
+sys.path[:0] = [str(LAB_DIR / "event_service"), str(LAB_DIR)]
@@ -0,0 +1,36 @@
+from common.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_invalidate_refuses_values_read_before_the_change():
+    clock = Clock()
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.put(1, "v1", 1)
+    cache.invalidate(1, 2)
+    assert cache.get(1) is None
+
+    cache.put(1, "v1", 1)
+    assert cache.get(1) is None
+    cache.put(1, "v2", 2)
+    assert cache.get(1) == "v2"
+
+    cache.invalidate(1, 3)
+    clock.now = 11
+    assert cache.get(1) is None
+    cache.put(1, "v2", 2)
+    assert cache.get(1) == "v2"
+
+
+def test_invalidate_without_a_version_just_drops_the_key():
+    cache = TTLCache()
+    cache.put(1, "v2", 2)
+    cache.invalidate(1)
+    cache.put(1, "v1", 1)
+    assert cache.get(1) == "v1"
@@ -0,0 +1,13 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def test_copies_of_common_modules_are_in_sync():
+    result = subprocess.run(
+        [sys.executable, str(ROOT / "tools" / "sync_common.py"), "--check"],
+        capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stdout
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from common.migrations import migrate
+from models import Base, Event, MIGRATIONS, get_engine, get_session
+from inventory import NotEnoughSeats, create_inventory
+
+EVENT_ID = 101
+
+
+def open_database(path):
+    engine = get_engine(str(path))
+    Base.metadata.create_all(engine)
+    migrate(engine, MIGRATIONS)
+    return engine
+
+
+def add_event(engine, inventory, total_seats=20, row_length=5):
+    session = get_session(engine)
+    try:
+        session.add(Event(
+            event_id=EVENT_ID, name="Test", date="2024-01-01T19:00:00Z", venue="Hall",
+            ticket_price=100.0, total_seats=total_seats, row_length=row_length
+        ))
+        session.commit()
+        inventory.provision(session, EVENT_ID, total_seats)
+        session.commit()
+    finally:
+        session.close()
+
+
+@pytest.fixture(params=["sql", "bitmap"])
+def inventory(request, tmp_path):
+    engine = open_database(tmp_path / "events.db")
+    inventory = create_inventory(engine, request.param)
+    add_event(engine, inventory)
+    return inventory
+
+
+def test_reserve_and_release(inventory):
+    assert inventory.available(EVENT_ID) == 20
+    seats = inventory.reserve(EVENT_ID, 3, "booking-1")
+    assert len(set(seats)) == 3
+    assert inventory.available(EVENT_ID) == 17
+    assert inventory.release(EVENT_ID, "booking-1") == 3
+    assert inventory.available(EVENT_ID) == 20
+
+
+def test_reserve_more_than_available(inventory):
+    inventory.reserve(EVENT_ID, 18, "booking-1")
+    with pytest.raises(NotEnoughSeats):
+        inventory.reserve(EVENT_ID, 3, "booking-2")
+    assert inventory.available(EVENT_ID) == 2
+
+
+def test_reserve_many_fails_only_what_does_not_fit(inventory):
+    results = inventory.reserve_many(EVENT_ID, [
+        (15, "booking-1", None), (10, "booking-2", None), (5, "booking-3", None)
+    ])
+    assert len(results[0]) == 15
+    assert isinstance(results[1], NotEnoughSeats)
+    assert len(results[2]) == 5
+    assert not set(results[0]) & set(results[2])
+    assert inventory.available(EVENT_ID) == 0
+    assert inventory.release_many(EVENT_ID, ["booking-1", "booking-3"]) == 20
+
+
+def test_reserve_block_stays_in_one_row(inventory):
+    inventory.reserve(EVENT_ID, 2, "booking-1")
+    seats = inventory.reserve_block(EVENT_ID, 4, "booking-2")
+    assert seats == list(range(seats[0], seats[0] + 4))
+    assert (seats[0] - 1) // 5 == (seats[-1] - 1) // 5
+    with pytest.raises(NotEnoughSeats):
+        inventory.reserve_block(EVENT_ID, 6, "booking-3")
+
+
+def test_confirm_needs_an_unexpired_hold(inventory):
+    now = datetime.utcnow()
+    inventory.reserve(EVENT_ID, 2, "hold-1", expires_at=now + timedelta(minutes=5))
+    inventory.reserve(EVENT_ID, 2, "hold-2", expires_at=now - timedelta(seconds=1))
+    assert inventory.confirm_many(EVENT_ID, [("hold-1", "booking-1"), ("hold-2", "booking-2")]) == [True, False]
+    assert inventory.confirm(EVENT_ID, "missing", "booking-3") is False
+
+    assert inventory.release_expired() == {EVENT_ID: 2}
+    assert inventory.available(EVENT_ID) == 18
+    # The confirmed hold is no longer a hold and is not swept.
+    assert inventory.release_expired() == {}
+    assert inventory.release(EVENT_ID, "booking-1") == 2
+
+
+def test_sql_backend_refuses_a_converted_database(tmp_path):
+    engine = open_database(tmp_path / "events.db")
+    add_event(engine, create_inventory(engine, "sql"))
+    bitmap = create_inventory(engine, "bitmap")
+    bitmap.reserve(EVENT_ID, 4, "booking-1")
+    assert bitmap.available(EVENT_ID) == 16
+
+    with pytest.raises(ValueError):
+        create_inventory(engine, "sql")
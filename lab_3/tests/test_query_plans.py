@@ -0,0 +1,26 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+LAB_DIR = Path(__file__).resolve().parents[1]
+
+
+@pytest.mark.parametrize("service, env", [
+    ("user_service", {}),
+    ("event_service", {"INVENTORY_BACKEND": "sql"}),
+    ("event_service", {"INVENTORY_BACKEND": "bitmap"}),
+    ("booking_service", {}),
+])
+def test_hot_path_queries_use_indexes(service, env):
+    result = subprocess.run(
+        [sys.executable, str(LAB_DIR / "benchmarks" / "query_plans.py"), service],
+        env={**os.environ, **env},
+        capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    scans = json.loads(result.stdout.strip().splitlines()[-1])
+    assert scans == [], "\n".join(f"full scan of {scan['table']}: {scan['statement']}" for scan in scans)
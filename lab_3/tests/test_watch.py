@@ -0,0 +1,79 @@
+import threading
+
+from watch import AvailabilityHub
+
+
+class Seats:
+    def __init__(self, available):
+        self.count = available
+
+    def available(self, event_id):
+        return self.count
+
+
+def test_subscribe_does_not_count_a_committed_change_twice():
+    seats = Seats(10)
+    hub = AvailabilityHub(seats)
+    committed, publish = threading.Event(), threading.Event()
+
+    def reserve():
+        with hub.writing(1):
+            seats.count -= 2
+            committed.set()
+            publish.wait(5)
+            hub.publish(1, -2)
+
+    writer = threading.Thread(target=reserve)
+    writer.start()
+    committed.wait(5)
+
+    result = []
+    subscriber = threading.Thread(target=lambda: result.append(hub.subscribe(1)))
+    subscriber.start()
+    subscriber.join(0.2)
+    assert subscriber.is_alive()
+
+    publish.set()
+    writer.join(5)
+    subscriber.join(5)
+    subscription, count = result[0]
+    assert count == 8
+    assert subscription.get(timeout=0.1) is None
+
+
+def test_later_subscribers_share_the_published_count():
+    seats = Seats(10)
+    hub = AvailabilityHub(seats)
+    first, count = hub.subscribe(1)
+    assert count == 10
+
+    with hub.writing(1):
+        seats.count -= 3
+        hub.publish(1, -3)
+    assert first.get(timeout=1) == (7, -3)
+
+    seats.count = 0  # a later subscriber does not go back to the inventory
+    second, count = hub.subscribe(1)
+    assert count == 7
+    first.close()
+    second.close()
+
+
+def test_a_full_queue_keeps_the_newest_update():
+    seats = Seats(100)
+    hub = AvailabilityHub(seats, queue_size=4)
+    subscription, count = hub.subscribe(1)
+
+    for _ in range(10):
+        with hub.writing(1):
+            seats.count -= 1
+            hub.publish(1, -1)
+
+    updates = []
+    update = subscription.get(timeout=0.1)
+    while update is not None:
+        updates.append(update)
+        update = subscription.get(timeout=0.1)
+    assert len(updates) == 4
+    assert updates[-1] == (90, -1)
+    subscription.close()
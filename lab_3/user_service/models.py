@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import Column, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from common.database import get_engine, get_session
+from common.migrations import migrate, add_column
 
 Base = declarative_base()
 
@@ -11,13 +12,21 @@ class User(Base):
     name = Column(String(100), nullable=False)
     email = Column(String(100), nullable=False, unique=True)
     phone = Column(String(20))
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    
+    # Every UPDATE bumps ``version``; caches use it to tell fresh profiles
+    # from stale ones.
+    __mapper_args__ = {'version_id_col': version}
+
+MIGRATIONS = [
+    (1, 'Add users.version for cache invalidation', [
+        add_column('users', "version INTEGER NOT NULL DEFAULT 1"),
+    ]),
+]
 
 def init_db():
-    engine = create_engine('sqlite:///users.db')
+    engine = get_engine('users.db')
     Base.metadata.create_all(engine)
+    migrate(engine, MIGRATIONS)
     return engine
 
-def get_session(engine):
-    Session = sessionmaker(bind=engine)
-    return Session()
-
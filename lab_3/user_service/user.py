@@ -1,15 +1,44 @@
-from concurrent import futures
 import grpc
 import os
-from user_pb2 import UserRequest, UserResponse
+from user_pb2 import UserRequest, UserResponse, BatchGetUsersRequest, BatchGetUsersResponse
 import user_pb2_grpc
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from models import init_db, get_session, User
+from common import metrics
+from common.cache import TTLCache
+from common.server import serve as run_service
+
+def user_response(user):
+    return UserResponse(
+        user_id=user.user_id,
+        name=user.name,
+        email=user.email,
+        phone=user.phone or "",
+        version=user.version
+    )
 
 class UserService(user_pb2_grpc.UserServiceServicer):
     def __init__(self):
         self.engine = init_db()
+        self.cache = TTLCache(
+            maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("USER_CACHE_TTL", "60"))
+        )
+        # On /metrics as cache_events_total and cache_entries{cache="users"}.
+        metrics.instrument_cache(self.cache, "users")
+        event.listen(User, "after_update", self._invalidate)
+        event.listen(User, "after_delete", self._invalidate_deleted)
         self._init_sample_data()
     
+    # A GetUser that read the row before this change may put it only after
+    # this runs; the version left behind makes the cache refuse it.
+    def _invalidate(self, mapper, connection, user):
+        self.cache.invalidate(user.user_id, user.version)
+    
+    def _invalidate_deleted(self, mapper, connection, user):
+        self.cache.invalidate(user.user_id, user.version + 1)
+    
     def _init_sample_data(self):
         session = get_session(self.engine)
         try:
@@ -21,33 +50,60 @@ class UserService(user_pb2_grpc.UserServiceServicer):
                 ]
                 session.add_all(sample_users)
                 session.commit()
+        except IntegrityError:
+            # Another worker process seeded them first.
+            session.rollback()
         finally:
             session.close()
     
     def GetUser(self, request, context):
+        cached = self.cache.get(request.user_id)
+        if cached is not None:
+            return cached
+        
         session = get_session(self.engine)
         try:
             user = session.query(User).filter(User.user_id == request.user_id).first()
             if user is None:
                 context.abort(grpc.StatusCode.NOT_FOUND, f"User with id {request.user_id} not found")
             
-            return UserResponse(
-                user_id=user.user_id,
-                name=user.name,
-                email=user.email,
-                phone=user.phone or ""
-            )
+            response = user_response(user)
         finally:
             session.close()
+        
+        self.cache.put(response.user_id, response, response.version)
+        return response
+    
+    def BatchGetUsers(self, request, context):
+        users = []
+        missing = set()
+        for user_id in set(request.user_ids):
+            cached = self.cache.get(user_id)
+            if cached is None:
+                missing.add(user_id)
+            else:
+                users.append(cached)
+        if not missing:
+            return BatchGetUsersResponse(users=users)
+        
+        session = get_session(self.engine)
+        try:
+            loaded = [
+                user_response(user)
+                for user in session.query(User).filter(User.user_id.in_(missing))
+            ]
+        finally:
+            session.close()
+        
+        for response in loaded:
+            self.cache.put(response.user_id, response, response.version)
+        return BatchGetUsersResponse(users=users + loaded)
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def register(server):
     user_pb2_grpc.add_UserServiceServicer_to_server(UserService(), server)
-    port = os.getenv("PORT", "50051")
-    server.add_insecure_port(f"[::]:{port}")
-    print(f"User Service starting on port {port}")
-    server.start()
-    server.wait_for_termination()
+
+def serve():
+    run_service("User Service", register, int(os.getenv("PORT", "50051")), prepare=init_db)
 
 if __name__ == "__main__":
     serve()
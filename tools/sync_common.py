@@ -0,0 +1,50 @@
+"""Keep the copies of the shared service modules in step with lab_3/common.
+
+Every lab is built from its own directory, so lab1's services cannot use
+lab_3's ``common`` package and carry copies of the modules they need in
+lab1/common.  lab_3/common is the canonical one: change a module there,
+then
+
+    python tools/sync_common.py            copy it over every copy
+    python tools/sync_common.py --check    exit 1 if any copy differs
+"""
+import argparse
+import filecmp
+import shutil
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CANONICAL = ROOT / "lab_3" / "common"
+COPIES = {
+    ROOT / "lab1" / "common": ("metrics.py", "server.py"),
+}
+
+
+def stale_copies():
+    return [
+        (CANONICAL / name, directory / name)
+        for directory, names in COPIES.items()
+        for name in names
+        if not (directory / name).exists()
+        or not filecmp.cmp(CANONICAL / name, directory / name, shallow=False)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only report copies that differ")
+    args = parser.parse_args()
+
+    stale = stale_copies()
+    for source, copy in stale:
+        if args.check:
+            print(f"{copy.relative_to(ROOT)} differs from {source.relative_to(ROOT)}")
+        else:
+            shutil.copyfile(source, copy)
+            print(f"updated {copy.relative_to(ROOT)}")
+    return 1 if args.check and stale else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())